@@ -1,9 +1,12 @@
 from raco import expression
+from raco import memo
 from raco import scheme
+from raco import statistics
 from raco.utility import Printable, real_str
 
 from abc import ABCMeta, abstractmethod
 import copy
+import itertools
 import operator
 import math
 from raco.expression import StateVar
@@ -39,10 +42,23 @@ class SchemaError(Exception):
     pass
 
 
+class OperatorMeta(ABCMeta):
+    """Memoize the derived properties of every operator class (see
+    raco.memo), including those that subclasses override."""
+
+    MEMOIZED = ('scheme', 'num_tuples', 'partitioning', 'column_stats')
+
+    def __new__(mcs, name, bases, namespace):
+        for prop in mcs.MEMOIZED:
+            if callable(namespace.get(prop)):
+                namespace[prop] = memo.memoized(namespace[prop])
+        return super(OperatorMeta, mcs).__new__(mcs, name, bases, namespace)
+
+
 class Operator(Printable):
 
     """Operator base class"""
-    __metaclass__ = ABCMeta
+    __metaclass__ = OperatorMeta
 
     def __init__(self):
         self.bound = None
@@ -55,6 +71,25 @@ class Operator(Printable):
     def set_stop_recursion(self):
         self.stop_recursion = True
 
+    def __setattr__(self, name, value):
+        # The memoized properties of the plans may depend on this attribute,
+        # unless it is new and this operator has not been used in a plan
+        # (e.g., while it is constructed)
+        if name in self.__dict__:
+            if not memo.same(self.__dict__[name], value):
+                memo.new_epoch()
+        elif '_memo' in self.__dict__:
+            memo.new_epoch()
+        if type(value) is list:
+            value = memo.ObservedList(value)
+        object.__setattr__(self, name, value)
+
+    def __getstate__(self):
+        # Copies and pickles start with no memoized properties
+        state = self.__dict__.copy()
+        state.pop('_memo', None)
+        return state
+
     @abstractmethod
     def apply(self, f):
         """ apply function f to its children. """
@@ -85,6 +120,12 @@ class Operator(Printable):
         Default implementation returns no information"""
         return RepresentationProperties()
 
+    def column_stats(self):
+        """Return the statistics of the columns output by this operator, a
+        list with a statistics.ColumnStats or None per column.
+        Default implementation returns no information"""
+        return [None] * len(self.scheme())
+
     def postorder(self, f):
         """Postorder traversal, applying a function to each operator.  The
         function returns an iterator"""
@@ -356,8 +397,40 @@ class NaryJoin(NaryOperator):
                 and self.conditions == other.conditions)
 
     def num_tuples(self):
-        # TODO: use AGM bound (P10 in http://arxiv.org/pdf/1310.3314v2.pdf)
-        return DEFAULT_CARDINALITY
+        """The AGM bound (P10 in http://arxiv.org/pdf/1310.3314v2.pdf)
+        on the size of the join: each condition is a variable, and so is
+        each column that no condition joins. The distinct values of a
+        column bound those of its variable, like a unary relation."""
+        variables = {}
+        for v, condition in enumerate(self.conditions):
+            for attr in condition:
+                variables[attr.position] = v
+        next_variable = itertools.count(len(self.conditions))
+        relations = []
+        offset = 0
+        for child in self.children():
+            width = len(child.scheme())
+            for col in range(offset, offset + width):
+                if col not in variables:
+                    variables[col] = next(next_variable)
+            relations.append((child.num_tuples(),
+                              set(variables[col] for col in
+                                  range(offset, offset + width))))
+            offset += width
+
+        stats = [s for child in self.children() for s in child.column_stats()]
+        for col, s in enumerate(stats):
+            if s is not None and s.ndv is not None:
+                relations.append((s.ndv, set([variables[col]])))
+        return int(round(statistics.agm_bound(relations)))
+
+    def column_stats(self):
+        stats = [s for child in self.children() for s in child.column_stats()]
+        if not self.output_columns:
+            return stats
+        combined = reduce(operator.add, [c.scheme() for c in self.children()])
+        return [stats[attr.get_position(combined)]
+                for attr in self.output_columns]
 
     def partitioning(self):
         """ The schemas are mutually exclusive
@@ -691,6 +764,9 @@ class CompositeBinaryOperator(BinaryOperator):
         """Return the scheme of the result."""
         return self.left.scheme() + self.right.scheme()
 
+    def column_stats(self):
+        return self.left.column_stats() + self.right.column_stats()
+
 
 class CrossProduct(CompositeBinaryOperator):
 
@@ -728,8 +804,13 @@ class Join(CompositeBinaryOperator):
                 and self.condition == other.condition)
 
     def num_tuples(self):
-        # this is black magic
-        return int(self.left.num_tuples() * self.right.num_tuples() / 10)
+        sel = statistics.selectivity(
+            self.condition, self.left.scheme() + self.right.scheme(),
+            self.left.column_stats() + self.right.column_stats())
+        if sel is None:
+            # this is black magic
+            return int(self.left.num_tuples() * self.right.num_tuples() / 10)
+        return int(self.left.num_tuples() * self.right.num_tuples() * sel)
 
     def copy(self, other):
         """deep copy"""
@@ -816,6 +897,20 @@ def project_partitioning(columnlist, input_partitioning):
             broadcasted=input_partitioning.broadcasted)
 
 
+def column_positions(exprs):
+    """The positions of the columns that unnamed expressions copy, or None
+    for the expressions that compute a value."""
+    return [e.position if isinstance(e, expression.UnnamedAttributeRef)
+            else None for e in exprs]
+
+
+def project_column_stats(exprs, input_stats):
+    """Return the column statistics of the output of unnamed expressions:
+    a column that is copied from the input keeps its statistics"""
+    return [None if pos is None else input_stats[pos]
+            for pos in column_positions(exprs)]
+
+
 class Apply(UnaryOperator):
 
     def __init__(self, emitters=None, input=None):
@@ -842,6 +937,10 @@ class Apply(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_stats(self):
+        return project_column_stats(self.get_unnamed_emit_exprs(),
+                                    self.input.column_stats())
+
     def copy(self, other):
         """deep copy"""
         self.emitters = other.emitters
@@ -975,12 +1074,18 @@ class Distinct(UnaryOperator):
         UnaryOperator.__init__(self, input)
 
     def num_tuples(self):
-        # TODO: better heuristics?
-        return self.input.num_tuples()
+        input_num = self.input.num_tuples()
+        count = statistics.distinct_count(self.input.column_stats(),
+                                          range(len(self.scheme())),
+                                          input_num)
+        return input_num if count is None else count
 
     def partitioning(self):
         return self.input.partitioning()
 
+    def column_stats(self):
+        return self.input.column_stats()
+
     def scheme(self):
         """scheme of the result"""
         return self.input.scheme()
@@ -1009,6 +1114,9 @@ class Limit(UnaryOperator):
     def partitioning(self):
         return self.input.partitioning()
 
+    def column_stats(self):
+        return self.input.column_stats()
+
     def copy(self, other):
         self.count = other.count
         UnaryOperator.copy(self, other)
@@ -1033,7 +1141,14 @@ class Select(UnaryOperator):
                 and self.condition == other.condition)
 
     def num_tuples(self):
-        return int(self.input.num_tuples() * 0.5)
+        sel = statistics.selectivity(self.condition, self.input.scheme(),
+                                     self.input.column_stats())
+        if sel is None:
+            sel = statistics.DEFAULT_SELECTIVITY
+        return int(self.input.num_tuples() * sel)
+
+    def column_stats(self):
+        return self.input.column_stats()
 
     def shortStr(self):
         if isinstance(self.condition, dict):
@@ -1087,6 +1202,10 @@ class Project(UnaryOperator):
         """
         return project_partitioning(self.columnlist, self.input.partitioning())
 
+    def column_stats(self):
+        return project_column_stats(self.get_unnamed_column_list(),
+                                    self.input.column_stats())
+
     def shortStr(self):
         return "%s(%s)" % (self.opname(), real_str(self.columnlist,
                                                    skip_out=True))
@@ -1147,7 +1266,16 @@ class GroupBy(UnaryOperator):
     def num_tuples(self):
         if not self.grouping_list:
             return 1
-        return self.input.num_tuples()
+        input_num = self.input.num_tuples()
+        count = statistics.distinct_count(
+            self.input.column_stats(),
+            column_positions(self.get_unnamed_grouping_list()), input_num)
+        return input_num if count is None else count
+
+    def column_stats(self):
+        return (project_column_stats(self.get_unnamed_grouping_list(),
+                                     self.input.column_stats()) +
+                [None] * len(self.aggregate_list))
 
     def partitioning(self):
         ip = self.input.partitioning()
@@ -1243,6 +1371,9 @@ class OrderBy(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_stats(self):
+        return self.input.column_stats()
+
     def partitioning(self):
         # TODO set sorted
         return RepresentationProperties()
@@ -1301,6 +1432,13 @@ class ProjectingJoin(Join):
 
         return project_partitioning(self.output_columns, joinp)
 
+    def column_stats(self):
+        stats = Join.column_stats(self)
+        if self.output_columns is None:
+            return stats
+        combined = self.left.scheme() + self.right.scheme()
+        return [stats[p.get_position(combined)] for p in self.output_columns]
+
     def scheme(self):
         """Return the scheme of the result."""
         if self.output_columns is None:
@@ -1342,6 +1480,9 @@ class Shuffle(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_stats(self):
+        return self.input.column_stats()
+
     def shortStr(self):
         if self.shuffle_type == self.ShuffleType.Hash:
             return "%s(%s(%s))" % (self.opname(), self.shuffle_type,
@@ -1398,6 +1539,9 @@ class HyperCubeShuffle(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_stats(self):
+        return self.input.column_stats()
+
     def shortStr(self):
         return "%s(%s)" % (self.opname(), real_str(self.hashed_columns,
                                                    skip_out=True))
@@ -1421,6 +1565,9 @@ class Collect(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_stats(self):
+        return self.input.column_stats()
+
     def partitioning(self):
         # TODO: implement one-partition partitioning?
         return RepresentationProperties()
@@ -1440,6 +1587,9 @@ class Broadcast(UnaryOperator):
     def num_tuples(self):
         return self.input.num_tuples()
 
+    def column_stats(self):
+        return self.input.column_stats()
+
     def shortStr(self):
         return self.opname()
 
@@ -1702,17 +1852,19 @@ class Scan(ZeroaryOperator):
     def __init__(self, relation_key=None, _scheme=None,
                  cardinality=DEFAULT_CARDINALITY,
                  partitioning=RepresentationProperties(),
-                 debroadcast=False):
+                 debroadcast=False, column_stats=None):
         """Initialize a scan operator.
 
         relation_key is a string of the form "user:program:relation"
         scheme is the schema of the relation.
+        column_stats is the list of the ColumnStats of its columns, if any.
         """
         self.relation_key = relation_key
         self._scheme = _scheme
         self._cardinality = cardinality
         self._partitioning = partitioning
         self._debroadcast = debroadcast
+        self._column_stats = column_stats
 
         ZeroaryOperator.__init__(self)
 
@@ -1742,6 +1894,11 @@ class Scan(ZeroaryOperator):
         return (RepresentationProperties() if
                 self._debroadcast else self._partitioning)
 
+    def column_stats(self):
+        if self._column_stats is None:
+            return [None] * len(self.scheme())
+        return list(self._column_stats)
+
     def __repr__(self):
         return "{op}({rk!r}, {sch!r}, {card!r}, {part!r}, {db!r})".format(
             op=self.opname(),
@@ -1758,6 +1915,7 @@ class Scan(ZeroaryOperator):
         self._cardinality = other._cardinality
         self._partitioning = other._partitioning
         self._debroadcast = other._debroadcast
+        self._column_stats = other._column_stats
 
         # TODO: need a cleaner and more general way of tracing information
         # through the compilation process for debugging purposes
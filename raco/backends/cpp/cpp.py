@@ -592,6 +592,12 @@ class CCAlgebra(Algebra):
         if kwargs.get('SwapJoinSides'):
             rule_grps_sequence.insert(0, [rules.SwapJoinSides()])
 
+        # order the joins by cost, after the selections form them
+        if kwargs.get('OrderJoins'):
+            rule_grps_sequence.insert(
+                rule_grps_sequence.index(cppcommon.clang_push_select) + 1,
+                [rules.OrderJoins(bushy=True, shuffles=False)])
+
         # set external indexing on (replacing strings with ints)
         if kwargs.get('external_indexing'):
             CBaseLanguage.set_external_indexing(True)
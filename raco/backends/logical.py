@@ -13,9 +13,6 @@ class OptLogicalAlgebra(Algebra):
                 rules.MergeSelects(),
                 rules.ProjectToDistinctColumnSelect(),
                 rules.JoinToProjectingJoin(),
-                rules.PushApply(),
-                rules.RemoveUnusedColumns(),
-                rules.PushApply(),
-                rules.RemoveUnusedColumns(),
-                rules.PushApply(),
+                rules.FixedPoint([rules.PushApply(),
+                                  rules.RemoveUnusedColumns()]),
                 rules.DeDupBroadcastInputs()]
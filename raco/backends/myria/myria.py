@@ -13,6 +13,7 @@ from raco.algebra import Shuffle
 from raco.algebra import convertcondition
 from raco.backends import Language, Algebra
 from raco.backends.sql.catalog import SQLCatalog, PostgresSQLFunctionProvider
+from raco.cascades import CostBasedSearch, CostModel, DEFAULT_TIME_BUDGET
 from raco.catalog import Catalog
 from raco.datastructure.UnionFind import UnionFind
 from raco.expression import AttributeRef, UnnamedAttributeRef
@@ -206,6 +207,10 @@ class MyriaFileScan(algebra.FileScan, MyriaOperator):
                 "source": self.get_source(self.path)
             }, **self.options)
 
+        elif self.format == 'BINARY':
+            raise NotImplementedError(
+                "Myria cannot read raco column files: {p}".format(p=self.path))
+
         elif self.format == 'TIPSY':
             encoding = {
                 "opType": "TipsyFileScan",
@@ -2166,6 +2171,7 @@ class MyriaLeftDeepTreeAlgebra(MyriaAlgebra):
                 rules.DedupGroupBy(),
             ],
             rules.push_select,
+            [rules.OrderJoins()],
             rules.push_project,
             rules.push_apply,
             left_deep_tree_shuffle_logic,
@@ -2275,6 +2281,94 @@ class MyriaHyperCubeAlgebra(MyriaAlgebra):
         self.catalog = catalog
 
 
+class MyriaCostBasedAlgebra(MyriaAlgebra):
+
+    """Myria physical algebra whose joins, cross products and groupings are
+    chosen by a cost-based search (see raco.cascades) among left deep trees
+    of shuffle and broadcast joins, HyperCube shuffles with LeapFrog joins,
+    one-phase and two-phase aggregates, and, with push_sql, SQL queries."""
+
+    def opt_rules(self, **kwargs):
+        if self.catalog is not None:
+            num_workers = self.catalog.get_num_servers()
+            nary_join_rules = [HCShuffleBeforeNaryJoin(self.catalog),
+                               OrderByBeforeNaryJoin()]
+        else:
+            # Without a catalog there are no HyperCube dimensions
+            num_workers = 1
+            nary_join_rules = []
+
+        pushdown = None
+        if kwargs.get('push_sql', False):
+            pushdown = PushIntoSQL(dialect=kwargs.get('dialect'),
+                                   push_grouping=kwargs.get(
+                                       'push_sql_grouping', False))
+
+        cost_based_search = CostBasedSearch(
+            cost_model=kwargs.get('cost_model') or CostModel(num_workers),
+            time_budget=kwargs.get('time_budget', DEFAULT_TIME_BUDGET),
+            groupby_class=MyriaGroupBy,
+            nary_join_rules=nary_join_rules,
+            transformations=[MergeToNaryJoin()],
+            pushdown=pushdown)
+
+        opt_grps_sequence = [
+            rules.remove_trivial_sequences,
+            [
+                rules.SimpleGroupBy(),
+                rules.CountToCountall(),  # TODO revisit when we have NULLs
+                rules.ProjectToDistinctColumnSelect(),
+                rules.DistinctToGroupBy(),
+                rules.DedupGroupBy(),
+            ],
+            rules.push_select,
+            [rules.OrderJoins()],
+            rules.push_project,
+            # Before push_apply, whose Applies between joins would keep
+            # them from merging into a multiway join
+            [cost_based_search],
+            rules.push_apply,
+            [ShuffleBeforeSetop(),
+             ShuffleBeforeIDBController(),
+             ShuffleAfterSingleton(),
+             LimitOrderBy(),
+             ShuffleAfterFileScan()],
+            [PushSelectThroughShuffle()],
+            rules.push_select,
+            distributed_group_by(MyriaGroupBy),
+            [rules.PushApply()],
+            [LogicalSampleToDistributedSample()],
+            [FlattenUnionAll()],
+            [rules.DeDupBroadcastInputs()],
+        ]
+
+        compile_grps_sequence = [
+            myriafy,
+            [AddAppendTemp()],
+            break_communication,
+            idb_until_convergence(kwargs.get('async_ft')),
+        ]
+
+        if kwargs.get('add_splits', True):
+            compile_grps_sequence.append([InsertSplit()])
+        # Even when false, plans may already include (manually added) Splits,
+        # so we always need BreakSplit
+        compile_grps_sequence.append([BreakSplit()])
+
+        rule_grps_sequence = opt_grps_sequence + compile_grps_sequence
+
+        # flatten the rules lists
+        rule_list = list(itertools.chain(*rule_grps_sequence))
+
+        # disable specified rules
+        rules.Rule.apply_disable_flags(rule_list, *kwargs.keys())
+
+        return rule_list
+
+    def __init__(self, catalog=None):
+        self.catalog = catalog
+
+
 class OpIdFactory(object):
 
     def __init__(self):
@@ -2470,6 +2470,7 @@ class GrappaAlgebra(Algebra):
                   scan_array_repr=_ARRAY_REPRESENTATION.GLOBAL_ARRAY,
                   compiler='push',
                   SwapJoinSides=False,
+                  OrderJoins=False,
                   external_indexing=False,
                   **kwargs):
 
@@ -2548,6 +2549,12 @@ class GrappaAlgebra(Algebra):
         if SwapJoinSides:
             rule_grps_sequence.insert(0, [rules.SwapJoinSides()])
 
+        # order the joins by cost, after the selections form them
+        if OrderJoins:
+            rule_grps_sequence.insert(
+                rule_grps_sequence.index(cppcommon.clang_push_select) + 1,
+                [rules.OrderJoins(bushy=True, shuffles=False)])
+
         # set external indexing on (replacing strings with ints)
         if external_indexing:
             CBaseLanguage.set_external_indexing(True)
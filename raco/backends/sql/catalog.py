@@ -4,14 +4,17 @@ A RACO language to compile expressions to SQL.
 
 from sqlalchemy import (Column, Table, MetaData, Integer, String,
                         Float, Boolean, LargeBinary, DateTime, select, func,
-                        literal, case)
+                        literal, case, text)
+from sqlalchemy.exc import SQLAlchemyError
 
 import raco.algebra as algebra
 from raco.catalog import Catalog
+from raco.dbconn import insert_tuples
 import raco.expression as expression
 import raco.scheme as scheme
 import raco.types as types
 from raco.representation import RepresentationProperties
+from raco.statistics import ColumnStats, Histogram
 import abc
 
 
@@ -74,6 +77,8 @@ class SQLCatalog(Catalog):
         self.push_grouping = push_grouping
         self.provider = provider
         self.metadata = MetaData()
+        # The statistics of the columns of tables, until they are written
+        self._column_stats = {}
 
     @staticmethod
     def get_num_servers():
@@ -88,6 +93,95 @@ class SQLCatalog(Catalog):
     def partitioning(self, rel_key):
         return RepresentationProperties()
 
+    def column_stats(self, rel_key):
+        """ Return the statistics of the columns of rel_key, as the database
+        keeps them for its own planner: pg_stats in Postgres, sqlite_stat1
+        in sqlite. None if the relation has not been analyzed, or the
+        database keeps no statistics that we can read """
+        if str(rel_key) not in self._column_stats:
+            table = self.metadata.tables[str(rel_key)]
+            readers = {'postgresql': self._postgres_stats,
+                       'sqlite': self._sqlite_stats}
+            reader = readers.get(self.engine.dialect.name)
+            try:
+                stats = reader(table) if reader else None
+            except SQLAlchemyError:
+                stats = None
+            self._column_stats[str(rel_key)] = stats
+        return self._column_stats[str(rel_key)]
+
+    def _postgres_stats(self, table):
+        rows = self.engine.execute(text(
+            "select reltuples from pg_class "
+            "where oid = to_regclass(quote_ident(:name))"),
+            name=table.name).scalar()
+        if not rows or rows < 0:
+            return None
+        query = text(
+            "select attname, null_frac, n_distinct, histogram_bounds::text "
+            "from pg_stats where schemaname = current_schema() "
+            "and tablename = :name")
+        by_name = {r[0]: r[1:] for r in
+                   self.engine.execute(query, name=table.name)}
+        if not by_name:
+            return None
+
+        stats = []
+        for c in table.columns:
+            if c.name not in by_name:
+                stats.append(None)
+                continue
+            null_frac, n_distinct, bounds = by_name[c.name]
+            count = rows * (1 - null_frac)
+            # A negative n_distinct is a fraction of the rows
+            ndv = n_distinct if n_distinct >= 0 else -n_distinct * rows
+            stats.append(ColumnStats(
+                ndv=int(round(ndv)), null_count=int(round(rows - count)),
+                histogram=self._parse_bounds(bounds, type(c.type)),
+                count=int(round(count))))
+        return stats
+
+    @staticmethod
+    def _parse_bounds(bounds, sql_type):
+        """ The histogram of a numeric column from the text of its
+        histogram_bounds, e.g. {1,5,9}; None for other columns """
+        parse = {Integer: int, Float: float}.get(sql_type)
+        if bounds is None or parse is None:
+            return None
+        try:
+            values = [parse(v) for v in bounds.strip('{}').split(',')]
+        except ValueError:
+            return None
+        if len(values) < 2:
+            return None
+        return Histogram(values)
+
+    def _sqlite_stats(self, table):
+        analyzed = self.engine.execute(text(
+            "select count(*) from sqlite_master "
+            "where type = 'table' and name = 'sqlite_stat1'")).scalar()
+        if not analyzed:
+            return None
+        rows = self.engine.execute(text(
+            "select idx, stat from sqlite_stat1 where tbl = :name"),
+            name=table.name).fetchall()
+
+        # stat is the number of rows, then the average number of rows per
+        # distinct value of each prefix of the columns of the index
+        ndvs = {}
+        for idx, stat in rows:
+            counts = [int(n) for n in stat.split()[:2]]
+            if idx is None or len(counts) < 2 or counts[1] == 0:
+                continue
+            first = self.engine.execute(
+                'pragma index_info("{i}")'.format(i=idx)).first()
+            if first is not None:
+                ndvs[first[2]] = int(round(float(counts[0]) / counts[1]))
+        if not ndvs:
+            return None
+        return [ColumnStats(ndv=ndvs[c.name]) if c.name in ndvs else None
+                for c in table.columns]
+
     def get_scheme(self, rel_key):
         table = self.metadata.tables[str(rel_key)]
         return scheme.Scheme((c.name, type_to_raco[type(c.type)])
@@ -98,14 +192,13 @@ class SQLCatalog(Catalog):
                    for n, t in schema.attributes]
         # Adds the table to the metadata
         Table(name, self.metadata, *columns)
+        self._column_stats.pop(str(name), None)
 
     def add_tuples(self, name, schema, tuples=None):
         table = self.metadata.tables[name]
         table.create(self.engine)
-        if tuples:
-            tuples = [{n: v for n, v in zip(schema.get_names(), tup)}
-                      for tup in tuples]
-            self.engine.execute(table.insert(), tuples)
+        self._column_stats.pop(str(name), None)
+        return insert_tuples(self.engine, table, tuples or [])
 
     def _convert_expr(self, cols, expr, input_scheme):
         if isinstance(expr, expression.AttributeRef):
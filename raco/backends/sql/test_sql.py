@@ -26,6 +26,21 @@ class TestQuery(SQLTestCase):
         self.assertEquals(len(self.emp_table),
                           self.db.num_tuples(self.emp_key))
 
+    def test_column_stats(self):
+        """The statistics are those of sqlite, which keeps the NDV of the
+        first column of each index once the table is analyzed."""
+        self.db.engine.execute(
+            'create index emp_salary on "{t}" (salary)'.format(
+                t=self.emp_key))
+        self.db.engine.execute('analyze')
+        stats = self.db.column_stats(self.emp_key)
+        self.assertEquals(len(stats), len(self.emp_schema))
+        self.assertEquals(stats[3].ndv, 4)
+        self.assertIsNone(stats[0])
+
+    def test_no_column_stats(self):
+        self.assertIsNone(self.db.column_stats(self.emp_key))
+
     def test_simple_scan(self):
         query = """x = scan({emp});
         store(x, OUTPUT);""".format(emp=self.emp_key)
@@ -0,0 +1,595 @@
+"""
+Search the physical plans of a logical plan for the cheapest one, in the
+manner of the Cascades optimizer.
+
+The rules of an algebra rewrite a plan greedily: each choice, e.g., whether
+a join shuffles or broadcasts its inputs, is made once, by a local
+heuristic. CostBasedSearch instead copies a region of the plan (the
+selections, applies, joins, cross products and groupings above its other
+operators) into a Memo, where:
+
+- each Group holds logically equivalent expressions, i.e., operators whose
+  children are groups. Transformation rules (e.g., merging a tree of joins
+  into a multiway join) add expressions to the group of the operator that
+  they rewrite;
+- each expression is implemented by alternative physical operators, which
+  may require a partitioning of their children: a hash join requires its
+  inputs to be hash partitioned on the join columns, a broadcast join
+  requires one of them to be broadcast, a grouping may be computed in one
+  phase after a shuffle or in two phases around one;
+- an input that does not have a required partitioning gets an enforcer: a
+  Shuffle, a Broadcast or a Collect.
+
+The cheapest plan of each group, for each required partitioning, is
+searched for top down and memoized. A CostModel estimates the network
+bytes, CPU (tuples processed) and memory (bytes held) of each operator from
+the cardinality estimates of the plan (see Operator.num_tuples), and
+weighs them into one number. When the time budget runs out, each group
+keeps the first plan found, which follows the usual heuristics of the
+rules. Last, the largest subplans of the winner without exchanges may be
+pushed into the database of each worker (e.g., as SQL), where the cost
+model deems it cheaper.
+"""
+
+import copy
+import math
+import time
+
+from raco import algebra, joinorder, memo, rules
+from raco.algebra import convertcondition
+from raco.expression import UnnamedAttributeRef
+from raco import types
+
+# The required partitionings of the tuples of a plan: any partitioning, a
+# copy of all tuples on each worker, all tuples on one worker, or
+# ('hash', positions) for a hash partitioning on the columns at positions
+ANY = None
+BROADCAST = ('broadcast',)
+SINGLE = ('single',)
+
+# The seconds that a search may take before it settles for the first plans
+# that it finds
+DEFAULT_TIME_BUDGET = 1.0
+
+# The bytes of a value of each type in the network and in memory
+TYPE_BYTES = {
+    types.LONG_TYPE: 8,
+    types.INT_TYPE: 4,
+    types.DOUBLE_TYPE: 8,
+    types.FLOAT_TYPE: 4,
+    types.BOOLEAN_TYPE: 1,
+    types.DATETIME_TYPE: 8,
+}
+DEFAULT_TYPE_BYTES = 16
+
+# The fields of operators that hold expressions
+EXPRESSION_FIELDS = ('condition', 'emitters', 'grouping_list',
+                     'aggregate_list', 'columnlist')
+
+EXCHANGES = (algebra.Shuffle, algebra.Broadcast, algebra.Collect,
+             algebra.HyperCubeShuffle)
+
+
+def hashed(positions):
+    """The requirement of a hash partitioning on the columns at
+    positions."""
+    return ('hash', tuple(positions))
+
+
+def satisfies(plan, required):
+    """Whether the tuples of plan have the required partitioning."""
+    if required is ANY:
+        return True
+    if required is BROADCAST:
+        return plan.partitioning().broadcasted
+    if required is SINGLE:
+        return isinstance(plan, algebra.Collect)
+    return rules.check_partition_equality(
+        plan, [UnnamedAttributeRef(i) for i in required[1]])
+
+
+def enforce(plan, required):
+    """An exchange that gives the tuples of plan the required partitioning,
+    or None if there is none."""
+    if required is BROADCAST:
+        return algebra.Broadcast(plan)
+    if required is SINGLE:
+        return algebra.Collect(plan)
+    if plan.partitioning().broadcasted:
+        # Shuffling a broadcast relation would duplicate its tuples
+        return None
+    return algebra.Shuffle(plan, [UnnamedAttributeRef(i)
+                                  for i in required[1]])
+
+
+def rebuild(template, children):
+    """A copy of the operator template with other children. The copy is
+    made without starting an epoch (see raco.memo), as the search builds
+    many plans that it does not keep."""
+    op = template.__class__.__new__(template.__class__)
+    op.__dict__.update(template.__dict__)
+    op.__dict__.pop('_memo', None)
+    if isinstance(template, algebra.UnaryOperator):
+        op.__dict__['input'], = children
+    elif isinstance(template, algebra.BinaryOperator):
+        op.__dict__['left'], op.__dict__['right'] = children
+    elif isinstance(template, algebra.NaryOperator):
+        op.__dict__['args'] = type(template.args)(children)
+    return op
+
+
+def copy_expressions(plan, inputs):
+    """Give the operators of plan above the plans of inputs copies of their
+    expressions, so that no two of them share an expression object: rules
+    such as RemoveUnusedColumns modify expressions in place."""
+    if id(plan) in inputs:
+        return
+    for field in EXPRESSION_FIELDS:
+        value = plan.__dict__.get(field)
+        if isinstance(value, list):
+            # A deep copy of the list would keep the elements' sharing
+            plan.__dict__[field] = [copy.deepcopy(v) for v in value]
+        elif value is not None:
+            plan.__dict__[field] = copy.deepcopy(value)
+    for child in plan.children():
+        copy_expressions(child, inputs)
+
+
+class Cost(object):
+    """The resources that a plan uses, summed over the workers.
+
+    :param network: The bytes sent between workers
+    :param cpu: The tuples processed
+    :param memory: The bytes held in memory
+    """
+
+    def __init__(self, network=0.0, cpu=0.0, memory=0.0):
+        self.network = network
+        self.cpu = cpu
+        self.memory = memory
+
+    def __add__(self, other):
+        return Cost(self.network + other.network, self.cpu + other.cpu,
+                    self.memory + other.memory)
+
+    def __sub__(self, other):
+        return Cost(self.network - other.network, self.cpu - other.cpu,
+                    self.memory - other.memory)
+
+    def __eq__(self, other):
+        return (isinstance(other, Cost) and
+                self.__dict__ == other.__dict__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Cost(network={n!r}, cpu={c!r}, memory={m!r})".format(
+            n=self.network, c=self.cpu, m=self.memory)
+
+
+class CostModel(object):
+    """Estimate the Cost of each operator of a physical plan, and weigh the
+    resources into one number. Subclasses may override cost, total, or
+    pushdown.
+
+    :param num_workers: The number of workers, to which a Broadcast sends
+                        its input
+    :param network_weight: The cost of sending one byte
+    :param cpu_weight: The cost of processing one tuple
+    :param memory_weight: The cost of holding one byte in memory
+    :param sql_cpu_factor: The cost of evaluating a plan in the database of
+                           a worker, relative to evaluating it in the
+                           engine
+    """
+
+    def __init__(self, num_workers=1, network_weight=1.0, cpu_weight=1.0,
+                 memory_weight=0.1, sql_cpu_factor=0.5):
+        self.num_workers = max(num_workers, 1)
+        self.network_weight = network_weight
+        self.cpu_weight = cpu_weight
+        self.memory_weight = memory_weight
+        self.sql_cpu_factor = sql_cpu_factor
+
+    @staticmethod
+    def tuple_bytes(scheme):
+        return sum(TYPE_BYTES.get(typ, DEFAULT_TYPE_BYTES)
+                   for typ in scheme.get_types())
+
+    def size(self, op):
+        """The bytes of the tuples of op."""
+        return joinorder.cardinality(op) * self.tuple_bytes(op.scheme())
+
+    def held(self, op):
+        """The bytes of the tuples of op held by all the workers."""
+        copies = self.num_workers if op.partitioning().broadcasted else 1
+        return self.size(op) * copies
+
+    def cost(self, op):
+        """The Cost of op itself, excluding its children."""
+        card = joinorder.cardinality(op)
+        inputs = [joinorder.cardinality(c) for c in op.children()]
+        if isinstance(op, algebra.Broadcast):
+            return Cost(network=self.size(op) * self.num_workers,
+                        cpu=card)
+        if isinstance(op, algebra.HyperCubeShuffle):
+            cells = reduce(lambda a, b: a * b, op.hyper_cube_dimensions, 1)
+            cube = reduce(lambda a, b: a * b,
+                          [op.hyper_cube_dimensions[d]
+                           for d in op.mapped_hc_dimensions], 1)
+            return Cost(network=float(self.size(op)) * cells / cube,
+                        cpu=card)
+        if isinstance(op, (algebra.Shuffle, algebra.Collect)):
+            return Cost(network=self.size(op), cpu=card)
+        if isinstance(op, (algebra.Join, algebra.CrossProduct,
+                           algebra.NaryJoin)):
+            # Hash joins and LeapFrog joins hold all of their inputs
+            return Cost(cpu=sum(inputs) + card,
+                        memory=sum(self.held(c) for c in op.children()))
+        if isinstance(op, algebra.GroupBy):
+            return Cost(cpu=sum(inputs), memory=self.size(op))
+        if isinstance(op, algebra.OrderBy):
+            n = sum(inputs)
+            return Cost(cpu=n * math.log(max(n, 2), 2),
+                        memory=sum(self.held(c) for c in op.children()))
+        if isinstance(op, algebra.ZeroaryOperator):
+            return Cost(cpu=card)
+        return Cost(cpu=sum(inputs))
+
+    def pushdown(self, cost):
+        """The Cost of evaluating a plan of the given cost in the database
+        of each worker, without exchanges."""
+        return Cost(cpu=cost.cpu * self.sql_cpu_factor)
+
+    def total(self, cost):
+        return (self.network_weight * cost.network +
+                self.cpu_weight * cost.cpu +
+                self.memory_weight * cost.memory)
+
+
+class Group(object):
+    """Logically equivalent expressions: (operator, child groups) pairs,
+    where the operator is a template whose children are ignored."""
+
+    def __init__(self, gid, op):
+        self.id = gid
+        # The operator that the group was made from
+        self.op = op
+        self.exprs = []
+        # Whether the group is an input of the region
+        self.leaf = False
+
+    def __repr__(self):
+        return "Group({i}, {op})".format(i=self.id, op=self.op.shortStr())
+
+
+class Winner(object):
+    """The cheapest plan found for a group and required partitioning."""
+
+    def __init__(self, plan, cost, total):
+        self.plan = plan
+        self.cost = cost
+        self.total = total
+
+
+class Memo(object):
+    """The groups of a region of a plan.
+
+    :param supported: A function that returns whether the optimizer
+                      implements an operator; the others are inputs of the
+                      region
+    :param transformations: Rules whose rewrites of an operator are added
+                            to its group
+    """
+
+    def __init__(self, supported, transformations=()):
+        self.supported = supported
+        self.transformations = transformations
+        self.groups = []
+        # id(op) -> the group of op
+        self._group_of = {}
+        # The operators that the memo was made from; their ids stay valid
+        self._ops = []
+
+    def insert(self, op):
+        """The group of op, inserting op and its descendants."""
+        group = self._group_of.get(id(op))
+        if group is not None:
+            return group
+        group = Group(len(self.groups), op)
+        self.groups.append(group)
+        self._group_of[id(op)] = group
+        self._ops.append(op)
+
+        if not self.supported(op):
+            group.leaf = True
+            group.exprs.append((op, []))
+            return group
+
+        self.add(group, op)
+        for rule in self.transformations:
+            alternative = rule(op)
+            if alternative is not op and self.supported(alternative):
+                self._ops.append(alternative)
+                self.add(group, alternative)
+        return group
+
+    def add(self, group, op):
+        group.exprs.append((op, [self.insert(c) for c in op.children()]))
+
+
+class Optimizer(object):
+    """Search a Memo for the cheapest plan of a region.
+
+    :param cost_model: The CostModel
+    :param time_budget: The seconds that a search may take before each
+                        group keeps the first plan found
+    :param groupby_class: The class of the groupings of the physical plans
+    :param nary_join_rules: The rules that implement a multiway join, e.g.,
+                            with HyperCube shuffles, in order; without them,
+                            multiway joins are not considered
+    :param transformations: Rules that add expressions to the groups
+    :param pushdown: A rule that pushes a plan without exchanges into the
+                     database of each worker (e.g., into SQL), or None
+    :param clock: A function that returns the current time, in seconds
+    """
+
+    # The operators of the regions, besides NaryJoin
+    SUPPORTED = (algebra.Select, algebra.Apply, algebra.Join,
+                 algebra.ProjectingJoin, algebra.CrossProduct,
+                 algebra.GroupBy)
+
+    def __init__(self, cost_model=None, time_budget=DEFAULT_TIME_BUDGET,
+                 groupby_class=algebra.GroupBy, nary_join_rules=(),
+                 transformations=(), pushdown=None, clock=time.time):
+        self.cost_model = cost_model or CostModel()
+        self.time_budget = time_budget
+        self.groupby_class = groupby_class
+        self.nary_join_rules = nary_join_rules
+        self.transformations = transformations if nary_join_rules else ()
+        self.pushdown = pushdown
+        self.clock = clock
+        self.deadline = None
+        self.memo = None
+        self.winners = {}
+
+    def supported(self, op):
+        if type(op) is algebra.NaryJoin:
+            return bool(self.nary_join_rules)
+        return type(op) in self.SUPPORTED
+
+    def optimize(self, op, required=ANY):
+        """The cheapest physical plan of the region rooted at op. The
+        inputs of the region are not changed."""
+        self.deadline = self.clock() + self.time_budget
+        self.winners = {}
+        self.memo = Memo(self.supported, self.transformations)
+        root = self.memo.insert(op)
+        winner = self.best(root, required)
+        assert winner is not None, "no plan for {op}".format(op=op)
+        if self.pushdown is not None:
+            winner = self.push_down(winner)
+        return winner
+
+    def out_of_time(self):
+        return self.clock() > self.deadline
+
+    def best(self, group, required):
+        """The Winner of group for the required partitioning, or None."""
+        key = (group.id, required)
+        if key in self.winners:
+            return self.winners[key]
+
+        best = None
+        for op, children in group.exprs:
+            for child_required, build in self.implementations(
+                    op, children, required):
+                inputs = []
+                for child, req in zip(children, child_required):
+                    winner = self.best(child, req)
+                    if winner is None:
+                        break
+                    inputs.append(winner)
+                else:
+                    plan = build([w.plan for w in inputs])
+                    candidate = self.candidate(plan, inputs, required)
+                    if (candidate is not None and
+                            (best is None or candidate.total < best.total)):
+                        best = candidate
+                if best is not None and self.out_of_time():
+                    break
+            if best is not None and self.out_of_time():
+                break
+
+        if best is None and required is not ANY:
+            # Exchange the tuples of the cheapest plan
+            winner = self.best(group, ANY)
+            if winner is not None:
+                best = self.candidate(winner.plan, [winner], required)
+
+        self.winners[key] = best
+        return best
+
+    def candidate(self, plan, inputs, required):
+        """The Winner for plan, built over the plans of inputs, with an
+        enforcer if it does not have the required partitioning; or None."""
+        if plan is None:
+            return None
+        if not satisfies(plan, required):
+            plan = enforce(plan, required)
+            if plan is None:
+                return None
+        cost = self.plan_cost(plan, set(id(w.plan) for w in inputs))
+        for winner in inputs:
+            cost += winner.cost
+        return Winner(plan, cost, self.cost_model.total(cost))
+
+    def plan_cost(self, plan, inputs):
+        """The cost of the operators of plan above the plans of inputs."""
+        if id(plan) in inputs:
+            return Cost()
+        cost = self.cost_model.cost(plan)
+        for child in plan.children():
+            cost += self.plan_cost(child, inputs)
+        return cost
+
+    def push_down(self, winner):
+        """Push the largest subplans of winner without exchanges into the
+        database of each worker, where that is cheaper."""
+        # The inputs of the region, other than scans, are not pushed
+        inputs = set(id(g.op) for g in self.memo.groups
+                     if g.leaf and not isinstance(g.op,
+                                                  algebra.ZeroaryOperator))
+        model = self.cost_model
+        changes = []
+
+        def local(plan):
+            return all(not isinstance(op, EXCHANGES) and id(op) not in inputs
+                       for op in plan.walk())
+
+        def push(plan):
+            if id(plan) in inputs or isinstance(plan,
+                                                algebra.ZeroaryOperator):
+                return plan
+            if local(plan):
+                cost = self.plan_cost(plan, set())
+                cheaper = model.pushdown(cost)
+                if model.total(cheaper) < model.total(cost):
+                    pushed = self.pushdown(plan)
+                    if pushed is not plan:
+                        changes.append((cost, cheaper))
+                        return pushed
+            children = plan.children()
+            pushed = [push(c) for c in children]
+            if memo.same(list(children), pushed):
+                return plan
+            return rebuild(plan, pushed)
+
+        plan = push(winner.plan)
+        if plan is winner.plan:
+            return winner
+        cost = winner.cost
+        for before, after in changes:
+            cost = cost - before + after
+        return Winner(plan, cost, model.total(cost))
+
+    def implementations(self, op, children, required):
+        """The physical alternatives for op: (the partitionings required of
+        the children, a function that builds the plan from the plans of the
+        children) pairs. The heuristic choice of the rules comes first."""
+        if not children:
+            return [([], lambda plans: op)]
+        if isinstance(op, algebra.Select):
+            build = lambda plans: rebuild(op, plans)
+            # Only hash partitionings pass through: the rules expect no
+            # Select above a Broadcast or a Collect
+            if required is ANY or required in (BROADCAST, SINGLE):
+                return [([ANY], build)]
+            return [([required], build), ([ANY], build)]
+        if isinstance(op, algebra.Apply):
+            alternatives = [([ANY], lambda plans: rebuild(op, plans))]
+            through = self.apply_requirement(op, required)
+            if through is not None:
+                alternatives.append(
+                    ([through], lambda plans: rebuild(op, plans)))
+            return alternatives
+        if isinstance(op, algebra.NaryJoin):
+            return [([ANY] * len(children),
+                     lambda plans: self.nary_join(op, plans))]
+        if isinstance(op, algebra.Join):
+            return self.join_implementations(op)
+        if isinstance(op, algebra.CrossProduct):
+            build = lambda plans: rebuild(op, plans)
+            return [([ANY, BROADCAST], build), ([BROADCAST, ANY], build)]
+        if isinstance(op, algebra.GroupBy):
+            return self.groupby_implementations(op)
+        assert False, "{op} in a Memo".format(op=op)
+
+    @staticmethod
+    def apply_requirement(op, required):
+        """The partitioning of the input of op that gives op the required
+        hash partitioning, or None."""
+        if required is ANY or required in (BROADCAST, SINGLE):
+            return None
+        emits = op.get_unnamed_emit_exprs()
+        positions = []
+        for i in required[1]:
+            if not isinstance(emits[i], UnnamedAttributeRef):
+                return None
+            positions.append(emits[i].position)
+        return hashed(positions)
+
+    def join_implementations(self, op):
+        left, right = op.left.scheme(), op.right.scheme()
+        build = lambda plans: rebuild(op, plans)
+        broadcasts = [([ANY, BROADCAST], build), ([BROADCAST, ANY], build)]
+        try:
+            left_cols, right_cols = convertcondition(
+                op.condition, len(left), left + right)
+        except NotImplementedError:
+            # Not an equijoin: only a broadcast sends each pair of tuples
+            # to one worker
+            return broadcasts
+        return [([hashed(left_cols), hashed(right_cols)], build)] + broadcasts
+
+    def groupby_implementations(self, op):
+        scheme = op.input.scheme()
+        group_cols = [ref.get_position(scheme) for ref in op.grouping_list]
+
+        def one_phase(plans):
+            gb = self.groupby_class()
+            gb.copy(op)
+            gb.input, = plans
+            return gb
+
+        def two_phase(plans):
+            template = rebuild(op, plans)
+            plan = rules.DecomposeGroupBy(self.groupby_class).fire(template)
+            # The local and remote aggregates of an aggregate, e.g., the
+            # SUM and COUNT of an AVG, share its arguments
+            copy_expressions(plan, set(id(p) for p in plans))
+            return plan
+
+        return [([ANY], two_phase),
+                ([hashed(group_cols) if group_cols else SINGLE], one_phase)]
+
+    def nary_join(self, op, plans):
+        plan = rebuild(op, plans)
+        for rule in self.nary_join_rules:
+            plan = rule(plan)
+        return plan
+
+
+class CostBasedSearch(rules.Rule):
+    """Replace each region of a plan (see Optimizer.SUPPORTED) by its
+    cheapest physical plan; the optimizer is fired again on the inputs of
+    the region, which may hold other regions.
+
+    :param kwargs: The arguments of the Optimizer
+    """
+
+    matches = Optimizer.SUPPORTED + (algebra.NaryJoin,)
+
+    def __init__(self, **kwargs):
+        self.optimizer = Optimizer(**kwargs)
+        # The ids of the operators that the search has placed
+        self._placed = set()
+        super(CostBasedSearch, self).__init__()
+
+    def fire(self, expr):
+        if id(expr) in self._placed or not self.optimizer.supported(expr):
+            return expr
+        winner = self.optimizer.optimize(expr)
+        inputs = set(id(g.op) for g in self.optimizer.memo.groups if g.leaf)
+
+        def place(op):
+            if id(op) in inputs:
+                return
+            self._placed.add(id(op))
+            for child in op.children():
+                place(child)
+        place(winner.plan)
+        return winner.plan
+
+    def __str__(self):
+        return "Logical plan => cheapest physical plan"
@@ -0,0 +1,312 @@
+import collections
+import itertools
+import random
+import unittest
+
+from raco import cascades, types
+from raco.algebra import (Broadcast, Collect, CrossProduct, EmptyRelation,
+                          GroupBy, HyperCubeShuffle, ProjectingJoin, Scan,
+                          Select, Shuffle)
+from raco.backends.myria import (HCShuffleBeforeNaryJoin, MergeToNaryJoin,
+                                 MyriaCostBasedAlgebra, MyriaGroupBy,
+                                 MyriaLeapFrogJoin, MyriaLeftDeepTreeAlgebra,
+                                 OrderByBeforeNaryJoin)
+from raco.cascades import CostModel, Optimizer
+from raco.catalog import FakeCatalog
+from raco.compile import optimize
+from raco.expression import (AND, EQ, GT, COUNTALL, MAX, NumericLiteral,
+                             UnnamedAttributeRef)
+from raco.partitioneddb import PartitionedDatabase
+from raco.myrial import interpreter, parser
+from raco.relation_key import RelationKey
+from raco.representation import RepresentationProperties
+from raco.scheme import Scheme
+from raco.statistics import ColumnStats
+
+
+def col(i):
+    return UnnamedAttributeRef(i)
+
+
+def count(plan, cls):
+    return sum(1 for op in plan.walk() if isinstance(op, cls))
+
+
+class OptimizerTest(unittest.TestCase):
+    """Searches of plans over relations R(a, b) on 4 workers."""
+
+    scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE)])
+
+    def scan(self, name, size, partitioning=RepresentationProperties(),
+             column_stats=None):
+        return Scan(RelationKey.from_string('public:adhoc:' + name),
+                    self.scheme, size, partitioning,
+                    column_stats=column_stats)
+
+    def join(self, left, right):
+        return ProjectingJoin(EQ(col(1), col(2)), left, right,
+                              [col(0), col(3)])
+
+    def search(self, plan, **kwargs):
+        kwargs.setdefault('cost_model', CostModel(num_workers=4))
+        return Optimizer(**kwargs).optimize(plan).plan
+
+    def test_shuffle_or_broadcast(self):
+        plan = self.search(self.join(self.scan('R', 10000),
+                                     self.scan('S', 10)))
+        self.assertEquals(count(plan, Shuffle), 0)
+        self.assertIsInstance(plan.right, Broadcast)
+
+        plan = self.search(self.join(self.scan('R', 10),
+                                     self.scan('S', 10000)))
+        self.assertIsInstance(plan.left, Broadcast)
+
+        plan = self.search(self.join(self.scan('R', 1000),
+                                     self.scan('S', 1000)))
+        self.assertEquals(count(plan, Broadcast), 0)
+        self.assertEquals(plan.left.columnlist, [col(1)])
+        self.assertEquals(plan.right.columnlist, [col(0)])
+
+    def test_partitioned_input(self):
+        """An input that is hash partitioned on the join column stays in
+        place."""
+        partitioning = RepresentationProperties(hash_partitioned=(col(1),))
+        plan = self.search(self.join(self.scan('R', 1000, partitioning),
+                                     self.scan('S', 1000)))
+        self.assertIsInstance(plan.left, Scan)
+        self.assertIsInstance(plan.right, Shuffle)
+
+    def test_select_keeps_partitioning(self):
+        """A hash join of selections shuffles below them or above them."""
+        select = Select(GT(col(0), NumericLiteral(5)), self.scan('R', 1000))
+        plan = self.search(self.join(select, self.scan('S', 1000)))
+        self.assertEquals(count(plan, Shuffle), 2)
+        self.assertIsInstance(plan.left, (Select, Shuffle))
+
+    def test_cross_product(self):
+        plan = self.search(CrossProduct(self.scan('R', 10),
+                                        self.scan('S', 1000)))
+        self.assertIsInstance(plan.left, Broadcast)
+
+    def test_group_by(self):
+        """Few groups are aggregated before the shuffle, groups of a
+        partitioned input without a shuffle."""
+        few = [ColumnStats(ndv=10), None]
+        gb = GroupBy([col(0)], [COUNTALL()],
+                     self.scan('R', 10000, column_stats=few))
+        plan = self.search(gb, groupby_class=MyriaGroupBy)
+        self.assertEquals(count(plan, MyriaGroupBy), 2)
+        self.assertEquals(count(plan, Shuffle), 1)
+
+        # Each tuple its own group
+        many = [ColumnStats(ndv=10000), None]
+        gb = GroupBy([col(0)], [COUNTALL()],
+                     self.scan('R', 10000, column_stats=many))
+        plan = self.search(gb, groupby_class=MyriaGroupBy)
+        self.assertEquals(count(plan, MyriaGroupBy), 1)
+        self.assertEquals(count(plan, Shuffle), 1)
+
+        partitioning = RepresentationProperties(hash_partitioned=(col(0),))
+        gb = GroupBy([col(0)], [COUNTALL()],
+                     self.scan('R', 10000, partitioning))
+        plan = self.search(gb, groupby_class=MyriaGroupBy)
+        self.assertEquals(count(plan, MyriaGroupBy), 1)
+        self.assertEquals(count(plan, Shuffle), 0)
+
+        gb = GroupBy([], [MAX(col(1))], self.scan('R', 10000))
+        plan = self.search(gb, groupby_class=MyriaGroupBy)
+        self.assertEquals(count(plan, Collect), 1)
+
+    def test_required_partitioning(self):
+        """A group wins a plan per required partitioning, and enforcers
+        give plans the partitionings that they lack."""
+        scan = self.scan('R', 1000)
+        optimizer = Optimizer(cost_model=CostModel(num_workers=4))
+        winner = optimizer.optimize(scan, cascades.hashed([1]))
+        self.assertIsInstance(winner.plan, Shuffle)
+        self.assertTrue(cascades.satisfies(winner.plan, cascades.hashed([1])))
+        winner = optimizer.optimize(scan, cascades.BROADCAST)
+        self.assertIsInstance(winner.plan, Broadcast)
+        winner = optimizer.optimize(scan, cascades.SINGLE)
+        self.assertIsInstance(winner.plan, Collect)
+
+        # A broadcast relation cannot be shuffled
+        broadcast = RepresentationProperties(broadcasted=True)
+        self.assertIsNone(cascades.enforce(self.scan('R', 10, broadcast),
+                                           cascades.hashed([0])))
+
+    def test_time_budget(self):
+        """Out of time, each group keeps the first plan found, which
+        shuffles both inputs of a join."""
+        clock = itertools.count()
+        plan = self.search(self.join(self.scan('R', 10000),
+                                     self.scan('S', 10)),
+                           time_budget=0, clock=lambda: next(clock))
+        self.assertEquals(count(plan, Shuffle), 2)
+        self.assertEquals(count(plan, Broadcast), 0)
+
+    def test_cost_model(self):
+        """A cost model under which broadcasts are too expensive."""
+        class NoBroadcasts(CostModel):
+            def cost(self, op):
+                cost = super(NoBroadcasts, self).cost(op)
+                if isinstance(op, Broadcast):
+                    cost.network = float('inf')
+                return cost
+
+        join = self.join(self.scan('R', 10000), self.scan('S', 10))
+        plan = self.search(join, cost_model=NoBroadcasts(num_workers=4))
+        self.assertEquals(count(plan, Broadcast), 0)
+
+        # The costs add up over the plan
+        winner = Optimizer(cost_model=CostModel(num_workers=4)).optimize(join)
+        model = CostModel(num_workers=4)
+        total = sum(model.total(model.cost(op)) for op in winner.plan.walk())
+        self.assertAlmostEquals(winner.total, total)
+
+    def test_multiway_join(self):
+        """A triangle of large relations is joined with HyperCube shuffles
+        on 64 workers, not with a left deep tree."""
+        r, s, t = [self.scan(name, 100000) for name in 'RST']
+        rs = ProjectingJoin(EQ(col(1), col(2)), r, s,
+                            [col(0), col(1), col(2), col(3)])
+        rst = ProjectingJoin(AND(EQ(col(3), col(4)), EQ(col(5), col(0))),
+                             rs, t, [col(0), col(1), col(3)])
+        catalog = FakeCatalog(64)
+        kwargs = dict(cost_model=CostModel(num_workers=64),
+                      nary_join_rules=[HCShuffleBeforeNaryJoin(catalog),
+                                       OrderByBeforeNaryJoin()],
+                      transformations=[MergeToNaryJoin()])
+        plan = self.search(rst, **kwargs)
+        self.assertEquals(count(plan, HyperCubeShuffle), 3)
+
+        # Without them, multiway joins are not considered
+        plan = self.search(rst)
+        self.assertEquals(count(plan, HyperCubeShuffle), 0)
+
+    def test_pushdown(self):
+        """The largest subplans without exchanges are pushed down."""
+        partitioning = RepresentationProperties(hash_partitioned=(col(1),))
+        select = Select(GT(col(0), NumericLiteral(5)),
+                        self.scan('R', 1000, partitioning))
+        join = self.join(select, self.scan('S', 1000))
+        pushed = []
+
+        def pushdown(plan):
+            pushed.append(plan)
+            return EmptyRelation(plan.scheme())
+        plan = self.search(join, pushdown=pushdown)
+        self.assertEquals(pushed, [select])
+        self.assertIsInstance(plan.left, EmptyRelation)
+        self.assertIsInstance(plan.right, Shuffle)
+
+
+class CostBasedAlgebraTest(unittest.TestCase):
+    """MyriaL queries compiled by MyriaCostBasedAlgebra return the results
+    of MyriaLeftDeepTreeAlgebra, evaluated with their shuffles and
+    broadcasts on a PartitionedDatabase."""
+
+    scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE),
+                     ('c', types.LONG_TYPE)])
+
+    def setUp(self):
+        self.db = PartitionedDatabase()
+        random.seed(17)
+        for name in 'XYZ':
+            self.db.ingest(
+                RelationKey.from_string('public:adhoc:' + name),
+                collections.Counter(
+                    tuple(random.randrange(10) for _ in range(3))
+                    for _ in range(40)),
+                self.scheme)
+
+    def logical_plan(self, query):
+        processor = interpreter.StatementProcessor(self.db)
+        processor.evaluate(parser.Parser().parse(query))
+        return processor.get_logical_plan()
+
+    def check(self, query, catalog=None):
+        results = []
+        for algebra in (MyriaLeftDeepTreeAlgebra(),
+                        MyriaCostBasedAlgebra(catalog)):
+            plan = optimize(self.logical_plan(query), algebra)
+            self.db.evaluate(plan)
+            results.append(self.db.get_table('OUTPUT'))
+        self.assertEquals(results[0], results[1])
+        return plan
+
+    def test_join(self):
+        self.check("""x = scan(X); y = scan(Y);
+            j = [from x, y where x.b = y.a emit x.a, y.c];
+            store(j, OUTPUT);""")
+
+    def test_group_by(self):
+        self.check("""x = scan(X);
+            g = [from x emit x.a, count(*), sum(x.c)];
+            store(g, OUTPUT);""")
+        self.check("""x = scan(X);
+            g = [from x where x.b > 3 emit count(*) as n, max(x.c)];
+            store(g, OUTPUT);""")
+
+    def test_avg(self):
+        """The SUM and COUNT of a two-phase AVG do not share their
+        argument, which later rules reindex in place."""
+        self.check("""x = scan(X);
+            g = [from x emit x.b, avg(x.c)];
+            store(g, OUTPUT);""")
+
+    def test_broadcast_select(self):
+        """A broadcast input of a cross product is selected before it is
+        broadcast."""
+        self.check("""t = [true as t, 1 as one];
+            x = scan(X);
+            j = [from x, t where t.t emit x.a, t.one];
+            store(j, OUTPUT);""")
+
+    def test_cross_product(self):
+        self.check("""x = scan(X); y = scan(Y);
+            j = [from x, y emit x.a, y.c];
+            g = [from j emit j.a, count(*)];
+            store(g, OUTPUT);""")
+
+    def test_regions(self):
+        """The joins below and above a distinct are searched apart."""
+        self.check("""x = scan(X); y = scan(Y); z = scan(Z);
+            j = [from x, y where x.b = y.a emit x.a, y.c];
+            d = distinct(j);
+            k = [from d, z where d.a = z.a emit d.c, z.b];
+            store(k, OUTPUT);""")
+
+    def test_triangle(self):
+        """On 64 workers, a triangle of large relations is joined with
+        HyperCube shuffles."""
+        relations = {name: collections.Counter(
+            (random.randrange(300), random.randrange(300), 0)
+            for _ in range(3000)) for name in 'RST'}
+
+        def ingest():
+            for name, contents in relations.items():
+                self.db.ingest(
+                    RelationKey.from_string('public:adhoc:' + name),
+                    contents, self.scheme)
+        ingest()
+        query = """r = scan(R); s = scan(S); t = scan(T);
+            j = [from r, s, t where r.b = s.a and s.b = t.a and t.b = r.a
+                 emit r.a, s.a, t.a];
+            store(j, OUTPUT);"""
+        plan = self.check(query)
+        self.assertEquals(count(plan, MyriaLeapFrogJoin), 0)
+        # The plan for 64 workers runs on 64 workers
+        self.db = PartitionedDatabase(num_workers=64)
+        ingest()
+        plan = self.check(query, FakeCatalog(64))
+        self.assertEquals(count(plan, MyriaLeapFrogJoin), 1)
+
+    def test_interpreter(self):
+        processor = interpreter.StatementProcessor(self.db)
+        processor.evaluate(parser.Parser().parse("""x = scan(X);
+            g = [from x emit x.a, count(*)];
+            store(g, OUTPUT);"""))
+        plan = processor.get_physical_plan(cost_based=True)
+        self.db.evaluate(plan)
+        self.assertEquals(len(self.db.get_table('OUTPUT')), 10)
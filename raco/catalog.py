@@ -7,6 +7,7 @@ from raco.algebra import DEFAULT_CARDINALITY
 from raco.representation import RepresentationProperties
 from raco.relation_key import RelationKey
 from raco.scheme import Scheme
+from raco.statistics import ColumnStats
 
 
 class Relation(object):
@@ -57,6 +58,14 @@ class Catalog(object):
         # default is to return no information
         return RepresentationProperties()
 
+    def column_stats(self, rel_key):
+        """
+        Return the statistics of the columns of rel_key, a list with a
+        raco.statistics.ColumnStats or None per column, or None
+        """
+        # default is to return no information
+        return None
+
 
 # Some useful Catalog implementations
 class FakeCatalog(Catalog):
@@ -117,6 +126,12 @@ class FromFileCatalog(Catalog):
     {'relation1' : ([('a', 'LONG_TYPE'), ('b', 'STRING_TYPE')], 10),
      'relation2' : [('y', 'STRING_TYPE'), ('z', 'DATETIME_TYPE')]}
 
+     And optional column statistics after the cardinality, by column name
+     (see raco.statistics.ColumnStats.from_dict)
+    {'relation1' : ([('a', 'LONG_TYPE'), ('b', 'STRING_TYPE')], 10,
+                    {'a': {'ndv': 5, 'nulls': 0, 'min': 1, 'max': 9,
+                           'histogram': [1, 3, 9]}})}
+
      Or it can be a single relation, using filename as basename
      [('a', 'LONG_TYPE'), ('b', 'STRING_TYPE')]
 
@@ -215,3 +230,11 @@ class FromFileCatalog(Catalog):
     def partitioning(self, rel_key):
         # TODO allow specifying an optional list of attributes
         return RepresentationProperties()
+
+    def column_stats(self, rel_key):
+        entry = self.__get_catalog_entry__(rel_key)
+        if len(entry) < 3:
+            return None
+        stats = entry[2]
+        return [ColumnStats.from_dict(stats[name]) if name in stats else None
+                for name, _ in entry[0]]
@@ -0,0 +1,6 @@
+{'A': [('b', 'STRING_TYPE')],
+ 'C': ([('a', 'LONG_TYPE'), ('b', 'STRING_TYPE'), ('c', 'LONG_TYPE')], 100,
+       {'a': {'ndv': 10, 'nulls': 0, 'min': 1, 'max': 10},
+        'c': {'ndv': 100, 'min': 0, 'max': 99,
+              'histogram': [0, 10, 50, 99]}})
+ }
@@ -105,3 +105,15 @@ class TestFromFileCatalog(unittest.TestCase):
                 rel_to_add,
                 "{'columnNames': ['grpID'], 'columnTypes': ['LONG_TYPE']}",
                 append=False)
+
+    def test_column_stats(self):
+        cut = FromFileCatalog.load_from_file(
+            "{p}/column_stats_relation.py".format(p=test_file_path))
+
+        self.assertIsNone(cut.column_stats('A'))
+        a, b, c = cut.column_stats('C')
+        self.assertEqual(cut.num_tuples('C'), 100)
+        self.assertEqual((a.ndv, a.null_count, a.min, a.max),
+                         (10, 0, 1, 10))
+        self.assertIsNone(b)
+        self.assertEqual(c.histogram.bounds, [0, 10, 50, 99])
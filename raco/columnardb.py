@@ -0,0 +1,483 @@
+"""
+A column-at-a-time implementation of the relational algebra operators.
+
+The ColumnarDatabase evaluates plans like the FakeDatabase, but represents
+intermediate relations as one NumPy array per column. Selections,
+projections, grouping with builtin aggregates, equijoins, duplicate
+elimination and sorting are computed with vectorized NumPy operations over
+whole columns. Operators and expressions that have no vectorized
+implementation (e.g., user-defined aggregates, Python UDFs, stateful apply)
+are evaluated a tuple at a time by the FakeDatabase code.
+"""
+
+from raco.expression import (Literal, UnnamedAttributeRef, COUNTALL, COUNT,
+                             SUM, AVG, STDEV, MIN, MAX)
+from raco.expression.evaluator import compile_evaluator
+from raco.fakedb import FakeDatabase, split_equijoin_condition
+from raco import columnfile, types
+
+# Optional raco dependency: numpy
+# Without it, the ColumnarDatabase cannot be used
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def to_column(values):
+    """Convert a list of python values into a NumPy array.
+
+    Numbers and booleans are stored in typed arrays; anything else
+    (strings, None, mixed types) is kept as python objects.
+    """
+    arr = np.array(values)
+    if arr.ndim == 1 and arr.dtype.kind in 'biuf':
+        return arr
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+def factorize(column):
+    """Map the values of a column to dense ids that respect their order.
+
+    :returns: a tuple (ids, number of distinct values)
+    """
+    try:
+        uniques, ids = np.unique(column, return_inverse=True)
+        return ids, len(uniques)
+    except TypeError:
+        values = column.tolist()
+        rank = {v: i for i, v in enumerate(sorted(set(values)))}
+        return (np.fromiter((rank[v] for v in values), dtype=np.int64,
+                            count=len(values)),
+                len(rank))
+
+
+def row_ids(columns, length):
+    """Map the rows of a list of columns to dense ids; equal rows get equal
+    ids, and ids follow the lexicographic order of the rows.
+
+    :returns: a tuple (ids, number of distinct rows)
+    """
+    if not columns:
+        return np.zeros(length, dtype=np.int64), min(length, 1)
+    ids, count = factorize(columns[0])
+    for column in columns[1:]:
+        col_ids, col_count = factorize(column)
+        ids, count = factorize(ids * col_count + col_ids)
+    return ids, count
+
+
+class Columns(object):
+    """A relation stored as one NumPy array per attribute."""
+
+    def __init__(self, scheme, columns, length):
+        self.scheme = scheme
+        self.columns = columns
+        self.length = length
+
+    @classmethod
+    def from_tuples(cls, scheme, tuples):
+        tuples = list(tuples)
+        if tuples:
+            columns = [to_column(list(c)) for c in zip(*tuples)]
+        else:
+            columns = [to_column([]) for _ in range(len(scheme))]
+        return cls(scheme, columns, len(tuples))
+
+    def __len__(self):
+        return self.length
+
+    def tuples(self):
+        """Return an iterator over the rows, as tuples of python values."""
+        if not self.columns:
+            return iter([()] * self.length)
+        return iter(zip(*[c.tolist() for c in self.columns]))
+
+    def take(self, indices, scheme=None):
+        """Select (and possibly repeat or reorder) rows by position or by a
+        boolean mask."""
+        columns = [c[indices] for c in self.columns]
+        if indices.dtype == bool:
+            length = int(np.count_nonzero(indices))
+        else:
+            length = len(indices)
+        return Columns(scheme or self.scheme, columns, length)
+
+
+# The NumPy ufuncs that compute scalar expressions
+BINARY_FUNCTIONS = {
+    'PLUS': 'add',
+    'MINUS': 'subtract',
+    'TIMES': 'multiply',
+    'DIVIDE': 'true_divide',
+    'AND': 'logical_and',
+    'OR': 'logical_or',
+    'EQ': 'equal',
+    'NEQ': 'not_equal',
+    'LT': 'less',
+    'GT': 'greater',
+    'LTEQ': 'less_equal',
+    'GTEQ': 'greater_equal',
+    'POW': 'power',
+    'LESSER': 'minimum',
+    'GREATER': 'maximum',
+}
+
+UNARY_FUNCTIONS = {
+    'NOT': 'logical_not',
+    'NEG': 'negative',
+    'ABS': 'absolute',
+    'CEIL': 'ceil',
+    'FLOOR': 'floor',
+    'COS': 'cos',
+    'SIN': 'sin',
+    'TAN': 'tan',
+    'SQRT': 'sqrt',
+    'LOG': 'log',
+}
+
+CAST_TYPES = {
+    types.LONG_TYPE: 'int64',
+    types.DOUBLE_TYPE: 'float64',
+    types.BOOLEAN_TYPE: 'bool',
+}
+
+
+class VectorEvaluator(object):
+    """Evaluate scalar expressions over all rows of a Columns at once."""
+
+    def __init__(self, relation):
+        self.relation = relation
+        self._tuples = None
+
+    def column(self, expr):
+        """Evaluate expr to an array with one value per row."""
+        value = self.evaluate(expr)
+        if isinstance(value, np.ndarray):
+            return value
+        return to_column([value] * len(self.relation))
+
+    def evaluate(self, expr):
+        """Evaluate expr to an array, or to a python scalar if it does not
+        depend on the input.
+
+        When NumPy cannot compute the expression (or computes an error), it
+        is evaluated tuple-at-a-time so that the semantics, including the
+        exceptions raised, are the ones of Expression.evaluate.
+        """
+        try:
+            with np.errstate(divide='raise', invalid='raise'):
+                return self.vectorize(expr)
+        except (TypeError, ValueError, ArithmeticError):
+            return self.evaluate_rows(expr)
+
+    def vectorize(self, expr):
+        name = type(expr).__name__
+        if isinstance(expr, Literal):
+            return expr.value
+        elif isinstance(expr, UnnamedAttributeRef):
+            return self.relation.columns[expr.position]
+        elif name == 'NamedAttributeRef':
+            position = self.relation.scheme.getPosition(expr.name)
+            return self.relation.columns[position]
+        elif name in BINARY_FUNCTIONS:
+            return self.apply_ufunc(BINARY_FUNCTIONS[name],
+                                    self.evaluate(expr.left),
+                                    self.evaluate(expr.right))
+        elif name in UNARY_FUNCTIONS:
+            return self.apply_ufunc(UNARY_FUNCTIONS[name],
+                                    self.evaluate(expr.input))
+        elif name == 'IDIVIDE':
+            left, right = self.evaluate(expr.left), self.evaluate(expr.right)
+            # Python 2 divides integers with floor division; int() truncates
+            if (np.asarray(left).dtype.kind in 'biu' and
+                    np.asarray(right).dtype.kind in 'biu'):
+                return np.floor_divide(left, right)
+            return np.trunc(np.true_divide(left, right)).astype(np.int64)
+        elif name == 'MOD':
+            return np.mod(self.evaluate(expr.left),
+                          self.evaluate(expr.right)).astype(np.int64)
+        elif name == 'CAST' and expr.typeof(None, None) in CAST_TYPES:
+            inp = self.column(expr.input)
+            if inp.dtype.kind not in 'biuf':
+                return self.evaluate_rows(expr)
+            return inp.astype(CAST_TYPES[expr.typeof(None, None)])
+        elif name == 'Case':
+            return np.select(
+                [self.column(t).astype(bool) for t, _ in expr.when_tuples],
+                [self.column(r) for _, r in expr.when_tuples],
+                self.column(expr.else_expr))
+        return self.evaluate_rows(expr)
+
+    @staticmethod
+    def apply_ufunc(name, *args):
+        result = getattr(np, name)(*args)
+        if (any(isinstance(a, np.ndarray) for a in args) and
+                not isinstance(result, np.ndarray)):
+            # NumPy gave up on an elementwise operation
+            raise TypeError("{f} is not elementwise".format(f=name))
+        return result
+
+    def evaluate_rows(self, expr):
+        """Evaluate expr one tuple at a time."""
+        if self._tuples is None:
+            self._tuples = list(self.relation.tuples())
+        func = compile_evaluator(expr, self.relation.scheme)
+        return to_column([func(t) for t in self._tuples])
+
+
+# The aggregates that are computed over columns
+VECTOR_AGGREGATES = (COUNTALL, COUNT, SUM, AVG, STDEV, MIN, MAX)
+
+
+def _segment_reduce(ufunc, values, starts):
+    return ufunc.reduceat(values, starts) if len(values) else values
+
+
+class ColumnarDatabase(FakeDatabase):
+    """An in-memory, vectorized implementation of relational algebra
+    operators.
+
+    Operators with a columnar_<opname> method are evaluated over NumPy
+    columns; the others use the tuple-at-a-time FakeDatabase
+    implementation.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("the ColumnarDatabase requires numpy")
+        super(ColumnarDatabase, self).__init__()
+
+    def evaluate(self, op):
+        method = getattr(self, 'columnar_' + op.opname().lower(), None)
+        if method is None:
+            return super(ColumnarDatabase, self).evaluate(op)
+        return method(op).tuples()
+
+    def evaluate_columns(self, op):
+        """Evaluate a query operator to a Columns instance."""
+        method = getattr(self, 'columnar_' + op.opname().lower(), None)
+        if method is None:
+            return Columns.from_tuples(
+                op.scheme(), super(ColumnarDatabase, self).evaluate(op))
+        return method(op)
+
+    def columnar_scan(self, op):
+        return Columns.from_tuples(op.scheme(), self.scan(op))
+
+    def columnar_filescan(self, op):
+        if op.format == 'BINARY':
+            # Memory-map the columns instead of reading the tuples
+            count, columns = columnfile.read_columns(op.path)
+            return Columns(op.scheme(), columns, count)
+        return Columns.from_tuples(op.scheme(), self.filescan(op))
+
+    def columnar_select(self, op):
+        inp = self.evaluate_columns(op.input)
+        mask = VectorEvaluator(inp).column(op.condition).astype(bool)
+        return inp.take(mask)
+
+    def columnar_apply(self, op):
+        inp = self.evaluate_columns(op.input)
+        evaluator = VectorEvaluator(inp)
+        columns = [evaluator.column(e) for _, e in op.emitters]
+        return Columns(op.scheme(), columns, len(inp))
+
+    def columnar_project(self, op):
+        inp = self.evaluate_columns(op.input)
+        if op.columnlist:
+            inp = Columns(op.scheme(),
+                          [inp.columns[x.position] for x in op.columnlist],
+                          len(inp))
+        return self._distinct(inp)
+
+    def columnar_distinct(self, op):
+        return self._distinct(self.evaluate_columns(op.input))
+
+    @staticmethod
+    def _distinct(inp):
+        ids, _ = row_ids(inp.columns, len(inp))
+        _, first = np.unique(ids, return_index=True)
+        return inp.take(first)
+
+    def columnar_limit(self, op):
+        inp = self.evaluate_columns(op.input)
+        return inp.take(np.arange(min(op.count, len(inp))))
+
+    def columnar_orderby(self, op):
+        inp = self.evaluate_columns(op.input)
+        # lexsort sorts by the last key first
+        keys = []
+        for col, ascending in reversed(zip(op.sort_columns, op.ascending)):
+            ranks, _ = factorize(inp.columns[col])
+            keys.append(ranks if ascending else -ranks)
+        if not keys:
+            return inp
+        return inp.take(np.lexsort(keys))
+
+    def columnar_crossproduct(self, op):
+        left = self.evaluate_columns(op.left)
+        right = self.evaluate_columns(op.right)
+        return self._combine(
+            left, np.repeat(np.arange(len(left)), len(right)),
+            right, np.tile(np.arange(len(right)), len(left)), op.scheme())
+
+    def columnar_join(self, op):
+        left = self.evaluate_columns(op.left)
+        right = self.evaluate_columns(op.right)
+        # The condition refers to the columns of both inputs, which a
+        # ProjectingJoin does not output
+        combined = left.scheme + right.scheme
+        left_cols, right_cols, residual = split_equijoin_condition(
+            op.condition, len(left.scheme), combined)
+
+        if not left_cols:
+            left_idx = np.repeat(np.arange(len(left)), len(right))
+            right_idx = np.tile(np.arange(len(right)), len(left))
+            residual = op.condition
+        else:
+            # Give matching keys of both inputs the same dense id, then
+            # find the matching rows of the right input for each left row.
+            keys = [np.concatenate([left.columns[lc], right.columns[rc]])
+                    for lc, rc in zip(left_cols, right_cols)]
+            ids, _ = row_ids(keys, len(left) + len(right))
+            left_ids, right_ids = ids[:len(left)], ids[len(left):]
+
+            order = np.argsort(right_ids, kind='mergesort')
+            sorted_ids = right_ids[order]
+            starts = np.searchsorted(sorted_ids, left_ids, 'left')
+            counts = np.searchsorted(sorted_ids, left_ids, 'right') - starts
+
+            left_idx = np.repeat(np.arange(len(left)), counts)
+            offsets = (np.arange(counts.sum()) -
+                       np.repeat(np.cumsum(counts) - counts, counts))
+            right_idx = order[np.repeat(starts, counts) + offsets]
+
+        result = self._combine(left, left_idx, right, right_idx, combined)
+        if residual is not None:
+            mask = VectorEvaluator(result).column(residual).astype(bool)
+            result = result.take(mask)
+        return result
+
+    def columnar_projectingjoin(self, op):
+        result = self.columnar_join(op)
+        return Columns(op.scheme(),
+                       [result.columns[x.position]
+                        for x in op.output_columns],
+                       len(result))
+
+    @staticmethod
+    def _combine(left, left_idx, right, right_idx, scheme):
+        columns = ([c[left_idx] for c in left.columns] +
+                   [c[right_idx] for c in right.columns])
+        return Columns(scheme, columns, len(left_idx))
+
+    def columnar_groupby(self, op):
+        if op.inits or not all(isinstance(agg, VECTOR_AGGREGATES)
+                               for agg in op.aggregate_list):
+            # User-defined aggregates are evaluated tuple-at-a-time
+            return Columns.from_tuples(op.scheme(), self.groupby(op))
+
+        inp = self.evaluate_columns(op.input)
+        if not len(inp):
+            if op.grouping_list:
+                return Columns.from_tuples(op.scheme(), [])
+            # A single group over no tuples
+            return Columns.from_tuples(op.scheme(), self.groupby(op))
+
+        evaluator = VectorEvaluator(inp)
+        keys = [evaluator.column(e) for e in op.grouping_list]
+        ids, _ = row_ids(keys, len(inp))
+        order = np.argsort(ids, kind='mergesort')
+        sorted_ids = ids[order]
+        starts = np.flatnonzero(np.diff(np.concatenate(([-1], sorted_ids))))
+        counts = np.diff(np.append(starts, len(inp)))
+        first = order[starts]
+
+        columns = [k[first] for k in keys]
+        for agg in op.aggregate_list:
+            columns.append(self._aggregate(agg, evaluator, order, starts,
+                                           counts))
+        return Columns(op.scheme(), columns, len(starts))
+
+    @staticmethod
+    def _aggregate(agg, evaluator, order, starts, counts):
+        """Evaluate a builtin aggregate for every group. The input rows of
+        the groups are order[starts[i]:starts[i] + counts[i]]."""
+        if isinstance(agg, COUNTALL):
+            return counts
+        values = evaluator.column(agg.input)[order]
+
+        if values.dtype.kind in 'biuf':
+            if values.dtype.kind == 'b' and not isinstance(agg, (MIN, MAX)):
+                values = values.astype(np.int64)
+            if isinstance(agg, COUNT):
+                return counts
+            elif isinstance(agg, SUM):
+                return _segment_reduce(np.add, values, starts)
+            elif isinstance(agg, MIN):
+                return _segment_reduce(np.minimum, values, starts)
+            elif isinstance(agg, MAX):
+                return _segment_reduce(np.maximum, values, starts)
+            elif isinstance(agg, AVG):
+                sums = _segment_reduce(np.add, values, starts)
+                if values.dtype.kind in 'iu':
+                    # Python 2 integer division, like AVG.evaluate_aggregate
+                    return np.floor_divide(sums, counts)
+                return np.true_divide(sums, counts)
+            elif isinstance(agg, STDEV):
+                means = _segment_reduce(np.add, values, starts) / \
+                    counts.astype(np.float64)
+                deviations = values - np.repeat(means, counts)
+                squares = _segment_reduce(np.add, deviations ** 2, starts)
+                return np.where(counts < 2, 0.0, np.sqrt(squares / counts))
+
+        # Non-numeric inputs: evaluate each group with the aggregate's own
+        # implementation.
+        row_agg = type(agg)(UnnamedAttributeRef(0))
+        groups = np.split(values, starts[1:])
+        return to_column([row_agg.evaluate_aggregate([(v,) for v in g], None)
+                          for g in groups])
+
+    def columnar_myriascan(self, op):
+        return self.columnar_scan(op)
+
+    def columnar_myriaselect(self, op):
+        return self.columnar_select(op)
+
+    def columnar_myriaapply(self, op):
+        return self.columnar_apply(op)
+
+    def columnar_myriadupelim(self, op):
+        return self.columnar_distinct(op)
+
+    def columnar_myrialimit(self, op):
+        return self.columnar_limit(op)
+
+    def columnar_myriainmemoryorderby(self, op):
+        return self.columnar_orderby(op)
+
+    def columnar_myriacrossproduct(self, op):
+        return self.columnar_crossproduct(op)
+
+    def columnar_myriasymmetrichashjoin(self, op):
+        return self.columnar_projectingjoin(op)
+
+    def columnar_myriagroupby(self, op):
+        return self.columnar_groupby(op)
+
+    def columnar_debroadcast(self, op):
+        return self.evaluate_columns(op.input)
+
+    columnar_myriashuffleconsumer = columnar_debroadcast
+    columnar_myriashuffleproducer = columnar_debroadcast
+    columnar_myriacollectconsumer = columnar_debroadcast
+    columnar_myriacollectproducer = columnar_debroadcast
+    columnar_myriabroadcastconsumer = columnar_debroadcast
+    columnar_myriabroadcastproducer = columnar_debroadcast
+    columnar_myriasplitconsumer = columnar_debroadcast
+    columnar_myriasplitproducer = columnar_debroadcast
+    columnar_myriahypercubeshuffleconsumer = columnar_debroadcast
+    columnar_myriahypercubeshuffleproducer = columnar_debroadcast
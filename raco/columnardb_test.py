@@ -0,0 +1,117 @@
+import collections
+import unittest
+
+from nose.plugins.skip import SkipTest
+
+import raco.columnardb
+import raco.fakedb
+from raco import scheme, types
+from raco.algebra import *
+from raco.expression import *
+from raco.relation_key import RelationKey
+
+
+class ColumnarDatabaseTest(unittest.TestCase):
+    """Compare the ColumnarDatabase to the FakeDatabase"""
+
+    emp_key = RelationKey.from_string("public:adhoc:employee")
+    emp_schema = scheme.Scheme([("id", types.LONG_TYPE),
+                                ("dept_id", types.LONG_TYPE),
+                                ("name", types.STRING_TYPE),
+                                ("salary", types.DOUBLE_TYPE)])
+    emp_table = collections.Counter([
+        (1, 2, "Bill Howe", 25000.0),
+        (2, 1, "Dan Halperin", 90000.0),
+        (3, 1, "Andrew Whitaker", 5000.0),
+        (4, 2, "Shumo Chu", 5000.0),
+        (5, 1, "Victor Almeida", 25000.0),
+        (6, 3, "Dan Suciu", 90000.0),
+        (7, 1, "Magdalena Balazinska", 25000.0),
+        (8, 4, "Jeremy Hyrkas", 12.5)])
+
+    def setUp(self):
+        if raco.columnardb.np is None:
+            raise SkipTest("numpy is not installed")
+        self.fake = raco.fakedb.FakeDatabase()
+        self.columnar = raco.columnardb.ColumnarDatabase()
+        for db in (self.fake, self.columnar):
+            db.ingest(self.emp_key, self.emp_table, self.emp_schema)
+        self.scan = Scan(self.emp_key, self.emp_schema)
+
+    def check(self, op):
+        expected = self.fake.evaluate_to_bag(op)
+        self.assertEqual(self.columnar.evaluate_to_bag(op), expected)
+        return expected
+
+    def test_select_apply(self):
+        cond = AND(GT(NamedAttributeRef("salary"), NumericLiteral(10000)),
+                   NEQ(NamedAttributeRef("dept_id"), NumericLiteral(3)))
+        emitters = [("x", IDIVIDE(NamedAttributeRef("id"), NumericLiteral(2))),
+                    ("y", MOD(NamedAttributeRef("id"), NumericLiteral(3))),
+                    ("z", DIVIDE(NamedAttributeRef("salary"),
+                                 NamedAttributeRef("id"))),
+                    ("n", NamedAttributeRef("name"))]
+        result = self.check(Apply(emitters, Select(cond, self.scan)))
+        self.assertEqual(len(result), 4)
+
+    def test_row_fallback(self):
+        """Expressions NumPy cannot evaluate use Expression.evaluate"""
+        self.check(Apply([("n", CONCAT(CAST(types.STRING_TYPE,
+                                            NamedAttributeRef("id")),
+                                       StringLiteral("!")))],
+                         self.scan))
+        self.check(Select(EQ(NamedAttributeRef("name"),
+                             StringLiteral("Dan Suciu")), self.scan))
+
+    def test_groupby(self):
+        aggs = [COUNTALL(), COUNT(NamedAttributeRef("name")),
+                SUM(NamedAttributeRef("salary")),
+                AVG(NamedAttributeRef("id")),
+                STDEV(NamedAttributeRef("salary")),
+                MIN(NamedAttributeRef("name")),
+                MAX(NamedAttributeRef("salary"))]
+        result = self.check(GroupBy([NamedAttributeRef("dept_id")], aggs,
+                                    self.scan))
+        self.assertEqual(len(result), 4)
+        self.check(GroupBy([], aggs[:3], self.scan))
+        self.check(GroupBy([], aggs[:3],
+                           Select(BooleanLiteral(False), self.scan)))
+
+    def test_join(self):
+        cond = EQ(UnnamedAttributeRef(1), UnnamedAttributeRef(5))
+        self.check(Join(cond, self.scan, self.scan))
+
+        cond = AND(cond, LT(UnnamedAttributeRef(0), UnnamedAttributeRef(4)))
+        result = self.check(Join(cond, self.scan, self.scan))
+        self.assertEqual(len(result), 7)
+
+        cond = LT(UnnamedAttributeRef(3), UnnamedAttributeRef(7))
+        self.check(Join(cond, self.scan, self.scan))
+
+    def test_projecting_join(self):
+        """Named references in the condition refer to the columns of both
+        inputs, not to the output columns."""
+        dept_key = RelationKey.from_string("public:adhoc:dept")
+        dept_schema = scheme.Scheme([("did", types.LONG_TYPE),
+                                     ("budget", types.DOUBLE_TYPE)])
+        for db in (self.fake, self.columnar):
+            db.ingest(dept_key,
+                      collections.Counter([(1, 10000.0), (2, 50000.0)]),
+                      dept_schema)
+        cond = AND(EQ(NamedAttributeRef("dept_id"), NamedAttributeRef("did")),
+                   LT(NamedAttributeRef("salary"),
+                      NamedAttributeRef("budget")))
+        join = ProjectingJoin(cond, self.scan, Scan(dept_key, dept_schema),
+                              [UnnamedAttributeRef(2), UnnamedAttributeRef(5)])
+        result = self.check(join)
+        self.assertEqual(len(result), 3)
+
+    def test_distinct_orderby(self):
+        proj = Project([UnnamedAttributeRef(1), UnnamedAttributeRef(3)],
+                       self.scan)
+        self.assertEqual(len(self.check(proj)), 7)
+
+        orderby = OrderBy(self.scan, sort_columns=[3, 2],
+                          ascending=[False, True])
+        self.assertEqual(list(self.columnar.evaluate(orderby)),
+                         list(self.fake.evaluate(orderby)))
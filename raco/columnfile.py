@@ -0,0 +1,372 @@
+"""
+Store relations on disk as binary column files.
+
+A relation is a directory with one file per attribute and a header,
+header.json, that holds the scheme, the number of tuples and the minimum
+and maximum value of each attribute. Longs, doubles and booleans are
+stored as little-endian fixed-width values. Strings are stored as the
+concatenation of their bytes (UTF-8 for unicode strings) and a file of the
+offsets where each string ends.
+
+Readers memory-map the column files, so a scan only reads the bytes of the
+attributes that it needs; with numpy, read_columns returns arrays that
+share the pages of the files. FakeDatabase reads the attributes that the
+Apply, Join or ProjectingJoin above a binary FileScan uses, through any
+Selects in between, and leaves the others None.
+
+To convert a CSV file:
+
+    python -m raco.columnfile input.csv output_dir id:int,name:string
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+
+from raco import types
+from raco.fastcsv import read_csv
+from raco.memorystore import MemoryStore
+from raco.scheme import Scheme
+
+# Optional raco dependency: numpy
+# Without it, read_columns is not available
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HEADER = 'header.json'
+FORMAT = 'raco-columns'
+VERSION = 1
+
+# The struct format of the values of fixed-width types
+FIXED_WIDTH = {
+    types.LONG_TYPE: 'q',
+    types.DOUBLE_TYPE: 'd',
+    types.BOOLEAN_TYPE: '?',
+}
+
+# The number of values that are packed or unpacked at once
+BATCH_SIZE = 65536
+
+
+def column_file(path, index):
+    return os.path.join(path, '{i}.col'.format(i=index))
+
+
+def offsets_file(path, index):
+    return os.path.join(path, '{i}.off'.format(i=index))
+
+
+def is_relation(path):
+    return os.path.isfile(os.path.join(path, HEADER))
+
+
+def read_header(path):
+    """Read the header of the relation stored in the directory path."""
+    with open(os.path.join(path, HEADER)) as fh:
+        header = json.load(fh)
+    if header.get('format') != FORMAT or header.get('version') != VERSION:
+        raise ValueError('{p} is not a relation in {f} format version {v}'
+                         .format(p=path, f=FORMAT, v=VERSION))
+    return header
+
+
+def read_scheme(path):
+    header = read_header(path)
+    return Scheme([(str(c['name']), str(c['type']))
+                   for c in header['columns']])
+
+
+class ColumnWriter(object):
+    """Append the values of one attribute to its column file."""
+
+    def __init__(self, path, index, _type):
+        self.type = types.map_type(_type)
+        if self.type not in FIXED_WIDTH and self.type != types.STRING_TYPE:
+            raise ValueError('cannot store {t} in a column file'
+                             .format(t=_type))
+        self.data = open(column_file(path, index), 'wb')
+        self.offsets = None
+        self.end = 0
+        if self.type == types.STRING_TYPE:
+            self.offsets = open(offsets_file(path, index), 'wb')
+        self.min = self.max = None
+
+    def write(self, values):
+        if any(v is None for v in values):
+            raise ValueError('cannot store null values in a column file')
+        if values:
+            low, high = min(values), max(values)
+            if self.min is None or low < self.min:
+                self.min = low
+            if self.max is None or high > self.max:
+                self.max = high
+
+        if self.offsets is None:
+            fmt = '<{n}{c}'.format(n=len(values), c=FIXED_WIDTH[self.type])
+            self.data.write(struct.pack(fmt, *values))
+            return
+        ends = []
+        for value in values:
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            self.data.write(value)
+            self.end += len(value)
+            ends.append(self.end)
+        self.offsets.write(struct.pack('<{n}q'.format(n=len(ends)), *ends))
+
+    def stats(self):
+        stats = {'min': self.min, 'max': self.max}
+        if self.type == types.STRING_TYPE:
+            try:
+                stats = {k: v.decode('utf-8') if isinstance(v, str) else v
+                         for k, v in stats.iteritems()}
+            except UnicodeDecodeError:
+                # The header is JSON; leave out binary strings
+                stats = {'min': None, 'max': None}
+        return stats
+
+    def close(self):
+        self.data.close()
+        if self.offsets is not None:
+            self.offsets.close()
+
+
+def write_relation(path, scheme, tuples):
+    """Store a relation in the directory path, replacing its contents.
+
+    :returns: the number of tuples written
+    """
+    # Write to a new directory, since the tuples may be read from the old
+    # contents of path.
+    final_path, path = path, path.rstrip(os.sep) + '.tmp'
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    writers = [ColumnWriter(path, i, t)
+               for i, t in enumerate(scheme.get_types())]
+    count = 0
+    try:
+        batch = []
+        for tpl in tuples:
+            batch.append(tpl)
+            if len(batch) == BATCH_SIZE:
+                for writer, values in zip(writers, zip(*batch)):
+                    writer.write(values)
+                count += len(batch)
+                batch = []
+        if batch:
+            for writer, values in zip(writers, zip(*batch)):
+                writer.write(values)
+            count += len(batch)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    header = {
+        'format': FORMAT,
+        'version': VERSION,
+        'num_tuples': count,
+        'columns': [dict(name=name, type=writer.type, **writer.stats())
+                    for name, writer in zip(scheme.get_names(), writers)]
+    }
+    with open(os.path.join(path, HEADER), 'w') as fh:
+        json.dump(header, fh, indent=2)
+    if os.path.isdir(final_path):
+        shutil.rmtree(final_path)
+    os.rename(path, final_path)
+    return count
+
+
+def _map(path):
+    """Memory-map a file, or return '' for an empty file."""
+    if os.path.getsize(path) == 0:
+        return ''
+    with open(path, 'rb') as fh:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ColumnReader(object):
+    """Read ranges of the values of one attribute from its column file."""
+
+    def __init__(self, path, index, _type):
+        self.type = _type
+        self.data = _map(column_file(path, index))
+        self.offsets = None
+        if self.type == types.STRING_TYPE:
+            self.offsets = _map(offsets_file(path, index))
+
+    def read(self, start, stop):
+        """Return the values of the rows in [start, stop)."""
+        if self.offsets is None:
+            code = FIXED_WIDTH[self.type]
+            fmt = '<{n}{c}'.format(n=stop - start, c=code)
+            return struct.unpack_from(fmt, self.data,
+                                      start * struct.calcsize(code))
+        ends = struct.unpack_from('<{n}q'.format(n=stop - start),
+                                  self.offsets, start * 8)
+        begin = struct.unpack_from('<q', self.offsets,
+                                   (start - 1) * 8)[0] if start else 0
+        values = []
+        for end in ends:
+            values.append(self.data[begin:end])
+            begin = end
+        return values
+
+
+def read_relation(path, columns=None):
+    """Iterate over the tuples of a relation stored in the directory path.
+
+    :param columns: The positions of the attributes to read; by default,
+    all of them
+    """
+    header = read_header(path)
+    if columns is None:
+        columns = range(len(header['columns']))
+    readers = [ColumnReader(path, i, header['columns'][i]['type'])
+               for i in columns]
+    count = header['num_tuples']
+    for start in xrange(0, count, BATCH_SIZE):
+        stop = min(start + BATCH_SIZE, count)
+        if readers:
+            for tpl in zip(*[r.read(start, stop) for r in readers]):
+                yield tpl
+        else:
+            for _ in xrange(start, stop):
+                yield ()
+
+
+NUMPY_TYPES = {
+    types.LONG_TYPE: '<i8',
+    types.DOUBLE_TYPE: '<f8',
+    types.BOOLEAN_TYPE: '?',
+}
+
+
+def read_columns(path, columns=None):
+    """Read the attributes of a relation as numpy arrays.
+
+    Fixed-width attributes are memory-mapped without copying; strings are
+    read into arrays of python objects.
+
+    :returns: a tuple (number of tuples, list of arrays)
+    """
+    header = read_header(path)
+    count = header['num_tuples']
+    if columns is None:
+        columns = range(len(header['columns']))
+    arrays = []
+    for i in columns:
+        _type = header['columns'][i]['type']
+        if _type in NUMPY_TYPES:
+            if count == 0:
+                arrays.append(np.empty(0, dtype=NUMPY_TYPES[_type]))
+            else:
+                arrays.append(np.memmap(column_file(path, i), mode='r',
+                                        dtype=NUMPY_TYPES[_type]))
+        else:
+            values = np.empty(count, dtype=object)
+            values[:] = ColumnReader(path, i, _type).read(0, count)
+            arrays.append(values)
+    return count, arrays
+
+
+class ColumnFileStore(MemoryStore):
+    """A MemoryStore that keeps the relations as column files in a
+    directory, where they persist across runs."""
+
+    def __init__(self, directory):
+        super(ColumnFileStore, self).__init__()
+        self.directory = directory
+
+    def relation_path(self, rel_key):
+        return os.path.join(self.directory, str(rel_key).replace(':', '/'))
+
+    def _relation_keys(self):
+        for root, _, files in os.walk(self.directory):
+            if HEADER in files:
+                name = os.path.relpath(root, self.directory)
+                yield name.replace(os.sep, ':')
+
+    def get_scheme(self, rel_key):
+        path = self.relation_path(rel_key)
+        if not is_relation(path):
+            raise KeyError(str(rel_key))
+        return read_scheme(path)
+
+    def add_table(self, rel_key, schema, tuples=None):
+        write_relation(self.relation_path(rel_key), schema, tuples or [])
+
+    def append_table(self, rel_key, tuples):
+        write_relation(self.relation_path(rel_key), self.get_scheme(rel_key),
+                       itertools.chain(self.scan(rel_key), tuples))
+
+    def num_tuples(self, rel_key):
+        self.get_scheme(rel_key)
+        return read_header(self.relation_path(rel_key))['num_tuples']
+
+    def scan(self, rel_key):
+        self.get_scheme(rel_key)
+        return read_relation(self.relation_path(rel_key))
+
+    def get_table(self, rel_key):
+        return collections.Counter(self.scan(rel_key))
+
+    def delete_table(self, rel_key, ignore_failure=False):
+        path = self.relation_path(rel_key)
+        if is_relation(path):
+            shutil.rmtree(path)
+        elif not ignore_failure:
+            raise KeyError(str(rel_key))
+
+    def iteritems(self):
+        for key in self._relation_keys():
+            yield key, self.get_table(key)
+
+    def get_sql_output(self, sql):
+        store = MemoryStore()
+        for key in self._relation_keys():
+            store.add_table(key, self.get_scheme(key), self.scan(key))
+        return store.get_sql_output(sql)
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(
+        description='Convert a CSV file into binary column files')
+    arg_parser.add_argument('input', help='the CSV file')
+    arg_parser.add_argument('output', help='the output directory')
+    arg_parser.add_argument('schema',
+                            help='the attributes, as name:type,...')
+    arg_parser.add_argument('--delimiter', default=None)
+    arg_parser.add_argument('--quote', default=None)
+    arg_parser.add_argument('--escape', default=None)
+    arg_parser.add_argument('--skip', type=int, default=None)
+    opts = arg_parser.parse_args(args)
+
+    attributes = []
+    for attribute in opts.schema.split(','):
+        name, _type = attribute.split(':')
+        type_name = _type.upper()
+        if not type_name.endswith('_TYPE'):
+            type_name += '_TYPE'
+        attributes.append((name, types.map_type(type_name)))
+    scheme = Scheme(attributes)
+
+    options = {k: getattr(opts, k)
+               for k in ('delimiter', 'quote', 'escape', 'skip')
+               if getattr(opts, k) is not None}
+    count = write_relation(opts.output, scheme,
+                           read_csv(opts.input, scheme.get_types(), options))
+    print '{n} tuples written to {o}'.format(n=count, o=opts.output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,213 @@
+import collections
+import os
+import shutil
+import tempfile
+import unittest
+
+from nose.plugins.skip import SkipTest
+
+from raco import columnfile, types
+from raco.algebra import (Apply, FileScan, ProjectingJoin, Scan, Select,
+                          Store)
+from raco.columnardb import ColumnarDatabase
+from raco.expression import EQ, GT, NumericLiteral, UnnamedAttributeRef
+from raco.fakedb import FakeDatabase
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+from raco.myrial.exceptions import (MyrialCompileException,
+                                    NoSuchFunctionException)
+import raco.myrial.interpreter as interpreter
+import raco.myrial.parser as parser
+
+
+class ColumnFileTest(unittest.TestCase):
+
+    scheme = Scheme([('id', types.LONG_TYPE), ('name', types.STRING_TYPE),
+                     ('salary', types.DOUBLE_TYPE),
+                     ('manager', types.BOOLEAN_TYPE)])
+    tuples = [(1, 'Bill', 10.5, True), (2, 'Dan', 20.0, False),
+              (3, '', -3.25, True), (4, u'J\xe9r\xf4me', 0.0, False)]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'emp')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        count = columnfile.write_relation(self.path, self.scheme, self.tuples)
+        self.assertEquals(count, 4)
+        self.assertEquals(columnfile.read_scheme(self.path), self.scheme)
+
+        expected = [t[:3] + (t[3],) for t in self.tuples]
+        expected[3] = (4, u'J\xe9r\xf4me'.encode('utf-8'), 0.0, False)
+        self.assertEquals(list(columnfile.read_relation(self.path)),
+                          expected)
+        self.assertEquals(list(columnfile.read_relation(self.path, [2, 0])),
+                          [(t[2], t[0]) for t in expected])
+
+        header = columnfile.read_header(self.path)
+        self.assertEquals(header['num_tuples'], 4)
+        self.assertEquals([(c['min'], c['max']) for c in header['columns']],
+                          [(1, 4), ('', u'J\xe9r\xf4me'), (-3.25, 20.0),
+                           (False, True)])
+
+    def test_batches(self):
+        tuples = [(i, str(i), i / 2.0, i % 2 == 0) for i in range(1000)]
+        old_size = columnfile.BATCH_SIZE
+        columnfile.BATCH_SIZE = 64
+        try:
+            columnfile.write_relation(self.path, self.scheme, tuples)
+            self.assertEquals(list(columnfile.read_relation(self.path)),
+                              tuples)
+        finally:
+            columnfile.BATCH_SIZE = old_size
+
+    def test_empty_relation(self):
+        columnfile.write_relation(self.path, self.scheme, [])
+        self.assertEquals(list(columnfile.read_relation(self.path)), [])
+        self.assertEquals(columnfile.read_header(self.path)['num_tuples'], 0)
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            columnfile.write_relation(self.path, self.scheme,
+                                      [(1, None, 1.0, True)])
+        with self.assertRaises(ValueError):
+            columnfile.write_relation(
+                self.path, Scheme([('b', types.BLOB_TYPE)]), [])
+
+    def test_store(self):
+        """Tables written by one FakeDatabase are read by the next one."""
+        key = RelationKey.from_string('public:adhoc:emp')
+        db = FakeDatabase(data_dir=self.dir)
+        db.ingest(key, collections.Counter(self.tuples[:3]), self.scheme)
+        db.evaluate(Store(RelationKey.from_string('public:adhoc:emp2'),
+                          Scan(key, self.scheme)))
+        db.tables.append_table(key, self.tuples[:1])
+
+        db = FakeDatabase(data_dir=self.dir)
+        self.assertEquals(db.num_tuples(key), 4)
+        self.assertEquals(db.get_table(key),
+                          collections.Counter(self.tuples[:3] +
+                                              self.tuples[:1]))
+        self.assertEquals(db.get_table('public:adhoc:emp2'),
+                          collections.Counter(self.tuples[:3]))
+        self.assertEquals(sorted(k for k, _ in db.tables.iteritems()),
+                          ['public:adhoc:emp', 'public:adhoc:emp2'])
+
+        db.tables.delete_table(key)
+        self.assertRaises(KeyError, db.get_scheme, key)
+
+    def test_convert_csv(self):
+        csv_path = os.path.join(self.dir, 'emp.csv')
+        with open(csv_path, 'w') as fh:
+            fh.write('id|name\n1|Bill\n2|Dan\n')
+        columnfile.main([csv_path, self.path, 'id:long,name:string',
+                         '--delimiter', '|', '--skip', '1'])
+        self.assertEquals(columnfile.read_scheme(self.path),
+                          Scheme([('id', types.LONG_TYPE),
+                                  ('name', types.STRING_TYPE)]))
+        self.assertEquals(list(columnfile.read_relation(self.path)),
+                          [(1, 'Bill'), (2, 'Dan')])
+
+    def test_load_binary(self):
+        """MyriaL reads the scheme of a column file from its header."""
+        columnfile.write_relation(self.path, self.scheme, self.tuples[:3])
+        query = """
+        emp = load("{p}", binary());
+        rich = [from emp where salary > 10 emit id, name];
+        store(rich, OUTPUT);
+        """.format(p=self.path)
+
+        db = FakeDatabase()
+        processor = interpreter.StatementProcessor(db)
+        processor.evaluate(parser.Parser().parse(query))
+        db.evaluate(processor.get_logical_plan())
+        self.assertEquals(db.get_table('OUTPUT'),
+                          collections.Counter([(1, 'Bill'), (2, 'Dan')]))
+
+    def load(self, load_args):
+        query = """
+        emp = load("{p}", {a});
+        store(emp, OUTPUT);
+        """.format(p=self.path, a=load_args)
+        processor = interpreter.StatementProcessor(FakeDatabase())
+        processor.evaluate(parser.Parser().parse(query))
+        return processor.get_logical_plan()
+
+    def test_load_schema(self):
+        """A schema given to binary() must match the header."""
+        columnfile.write_relation(self.path, self.scheme, self.tuples)
+        plan = self.load('BINARY(schema(i:int, n:string, s:float, '
+                         'm:boolean))')
+        scan, = [op for op in plan.walk() if isinstance(op, FileScan)]
+        self.assertEquals(scan.scheme().get_names(),
+                          ['i', 'n', 's', 'm'])
+        with self.assertRaises(MyrialCompileException):
+            self.load('binary(schema(id:int, name:string))')
+        with self.assertRaises(MyrialCompileException):
+            self.load('binary(schema(id:int, name:string, salary:int, '
+                      'manager:boolean))')
+        with self.assertRaises(NoSuchFunctionException):
+            self.load('parquet()')
+
+    def test_load_missing_header(self):
+        with self.assertRaises(MyrialCompileException):
+            self.load('binary()')
+
+    def test_needed_columns(self):
+        """A FakeDatabase reads only the attributes of a column file that
+        the operators above the scan use."""
+        columnfile.write_relation(self.path, self.scheme, self.tuples[:3])
+        read = []
+        read_relation = columnfile.read_relation
+
+        def record(path, columns=None):
+            read.append(columns)
+            return read_relation(path, columns)
+        columnfile.read_relation = record
+        try:
+            db = FakeDatabase()
+            scan = FileScan(self.path, 'BINARY', self.scheme)
+            salary = UnnamedAttributeRef(2)
+            plan = Apply([('id', UnnamedAttributeRef(0))],
+                         Select(GT(salary, NumericLiteral(10)), scan))
+            self.assertEquals(db.evaluate_to_bag(plan),
+                              collections.Counter([(1,), (2,)]))
+            self.assertEquals(read, [[0, 2]])
+
+            del read[:]
+            other_path = os.path.join(self.dir, 'emp2')
+            columnfile.write_relation(other_path, self.scheme,
+                                      self.tuples[:3])
+            other = FileScan(other_path, 'BINARY', self.scheme)
+            plan = ProjectingJoin(
+                EQ(UnnamedAttributeRef(0), UnnamedAttributeRef(4)),
+                scan, other, [UnnamedAttributeRef(5)])
+            self.assertEquals(db.evaluate_to_bag(plan),
+                              collections.Counter([('Bill',), ('Dan',),
+                                                   ('',)]))
+            self.assertEquals(sorted(read), [[0], [0, 1]])
+
+            # Without a consumer, all the attributes are read
+            del read[:]
+            self.assertEquals(len(list(db.evaluate(scan))), 3)
+            self.assertEquals(read, [None])
+        finally:
+            columnfile.read_relation = read_relation
+
+    def test_read_columns(self):
+        if columnfile.np is None:
+            raise SkipTest("numpy is not installed")
+        columnfile.write_relation(self.path, self.scheme, self.tuples[:3])
+        count, columns = columnfile.read_columns(self.path)
+        self.assertEquals(count, 3)
+        self.assertIsInstance(columns[0], columnfile.np.memmap)
+        self.assertEquals(columns[0].tolist(), [1, 2, 3])
+        self.assertEquals(columns[1].tolist(), ['Bill', 'Dan', ''])
+
+        db = ColumnarDatabase()
+        scan = FileScan(self.path, 'BINARY', self.scheme)
+        self.assertEquals(list(db.evaluate_columns(scan).tuples()),
+                          self.tuples[:3])
@@ -1,4 +1,9 @@
-from raco import algebra
+import collections
+import json
+import time
+
+from raco import algebra, memo
+from raco.rules import FixedPoint
 import raco.backends as language
 from .pipelines import Pipelined
 from raco.utility import emit
@@ -35,41 +40,160 @@ class PlanWriter():
         self.ind += 1
 
 
-def optimize_by_rules(expr, rules):
+class RuleStats(object):
+    """The statistics of one rule."""
+
+    def __init__(self, name):
+        self.name = name
+        self.invocations = 0
+        self.nodes = 0
+        self.rewrites = 0
+        self.time = 0.0
+
+    def to_dict(self):
+        return {'rule': self.name,
+                'invocations': self.invocations,
+                'nodes': self.nodes,
+                'rewrites': self.rewrites,
+                'time': self.time}
+
+
+class RuleProfiler(object):
+    """Record, for each rule that optimize_by_rules fires, the number of
+    times that it was run over a plan (invocations), the number of
+    operators that it visited, the number of them that it rewrote, and the
+    time spent in the rule itself. Rules of the same class are counted
+    together.
+
+    :param clock: A function that returns the current time, in seconds
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        # rule name -> RuleStats, in the order of their first invocation
+        self.stats = collections.OrderedDict()
+
+    def rule(self, rule):
+        name = rule.__class__.__name__
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = RuleStats(name)
+        return stats
+
+    def report(self):
+        return RuleProfileReport(self.stats.values())
+
+
+class RuleProfileReport(object):
+    """The statistics of the rules, the most expensive first."""
+
+    def __init__(self, stats):
+        self.rules = sorted(stats, key=lambda s: s.time, reverse=True)
+
+    def total_time(self):
+        return sum(s.time for s in self.rules)
+
+    def to_dict(self):
+        return {'rules': [s.to_dict() for s in self.rules],
+                'time': self.total_time()}
+
+    def json(self):
+        return json.dumps(self.to_dict())
+
+    def text(self):
+        lines = ['{r:<40} {i:>6} {n:>8} {w:>8} {t:>10}'.format(
+            r='rule', i='calls', n='nodes', w='rewrites', t='time(s)')]
+        for s in self.rules:
+            lines.append('{r:<40} {i:>6} {n:>8} {w:>8} {t:>10.6f}'.format(
+                r=s.name, i=s.invocations, n=s.nodes, w=s.rewrites,
+                t=s.time))
+        lines.append('Total time: {t:.6f}s'.format(t=self.total_time()))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.text()
+
+
+def optimize_by_rules(expr, rules, profiler=None):
+    """Fire each rule on every operator of expr that it matches, top down.
+    A FixedPoint group of rules rewrites the plan until it converges.
+
+    :param profiler: A RuleProfiler that records the statistics of the
+                     rules, or None
+    """
     writer = PlanWriter()
     writer.write_if_enabled(expr, "before rules")
+    debug = LOG.isEnabledFor(logging.DEBUG)
 
     for rule in rules:
+        if isinstance(rule, FixedPoint):
+            # A group of rules rewrites the whole plan at once
+            if not rule._disabled:
+                expr = rule.optimize(expr, profiler)
+                if writer.enabled:
+                    writer.write_if_enabled(expr, str(rule))
+            continue
+
+        stats = profiler.rule(rule) if profiler is not None else None
+
         def recursiverule(e):
-            newe = rule(e)
-            writer.write_if_enabled(newe, str(rule))
+            if not rule.match(e):
+                if not e.stop_recursion:
+                    e.apply(recursiverule)
+                return e
+
+            # A rule either returns a new operator or modifies e in place,
+            # which starts a new epoch (see raco.memo)
+            before = memo.epoch()
+            if debug:
+                old = str(e)
+            if stats is not None:
+                start = profiler.clock()
+                newe = rule(e)
+                stats.time += profiler.clock() - start
+                stats.nodes += 1
+            else:
+                newe = rule(e)
+            changed = newe is not e or memo.epoch() is not before
+            if changed and stats is not None:
+                stats.rewrites += 1
+
+            if writer.enabled:
+                writer.write_if_enabled(newe, str(rule))
             if newe.stop_recursion:
                 return newe
 
             # log the optimizer step
-            if str(e) == str(newe):
+            if debug and not changed:
                 LOG.debug("apply rule %s (no effect)\n" +
-                          " %s \n", rule, e)
-            else:
+                          " %s \n", rule, old)
+            elif debug:
                 LOG.debug("apply rule %s\n" +
                           colored("  -", "red") + " %s" + "\n" +
-                          colored("  +", "green") + " %s", rule, e, newe)
+                          colored("  +", "green") + " %s", rule, old, newe)
 
             newe.apply(recursiverule)
 
             return newe
+        if stats is not None:
+            stats.invocations += 1
         expr = recursiverule(expr)
 
     return expr
 
 
-def optimize(expr, target, **kwargs):
+def optimize(expr, target, rule_profiler=None, **kwargs):
     """Fire the rule-based optimizer on an expression.  Fire all rules in the
-    target algebra."""
+    target algebra.
+
+    :param rule_profiler: A RuleProfiler that records the statistics of the
+                          rules, or None
+    """
     assert isinstance(expr, algebra.Operator)
     assert isinstance(target, language.Algebra), type(target)
 
-    return optimize_by_rules(expr, target.opt_rules(**kwargs))
+    return optimize_by_rules(expr, target.opt_rules(**kwargs),
+                             profiler=rule_profiler)
 
 
 def compile(expr, **kwargs):
@@ -0,0 +1,166 @@
+import collections
+import logging
+import unittest
+
+from raco import compile, rules, types
+from raco.algebra import Apply, GroupBy, Scan, Select
+from raco.compile import RuleProfiler, optimize_by_rules
+from raco.expression import EQ, NumericLiteral, UnnamedAttributeRef
+from raco.fakedb import FakeDatabase
+from raco.myrial import interpreter, parser
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+
+
+class UnprintableScan(Scan):
+
+    def __str__(self):
+        raise AssertionError("the plan was printed")
+
+
+class Renumber(rules.Rule):
+    """Modify the literals of selections in place."""
+
+    def fire(self, expr):
+        if isinstance(expr, Select):
+            expr.condition.right = NumericLiteral(2)
+        return expr
+
+
+class Nothing(rules.Rule):
+
+    def fire(self, expr):
+        return expr
+
+
+class RuleProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        key = RelationKey.from_string('public:adhoc:R')
+        scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE)])
+        self.scan = UnprintableScan(key, scheme, 100)
+        self.select = Select(EQ(UnnamedAttributeRef(0), NumericLiteral(1)),
+                             self.scan)
+        self.plan = Apply([('a', UnnamedAttributeRef(0))], self.select)
+        # At DEBUG, the rules print the plans; test runners may enable it
+        self.level = compile.LOG.level
+        compile.LOG.setLevel(logging.WARN)
+
+    def tearDown(self):
+        compile.LOG.setLevel(self.level)
+
+    def test_counts(self):
+        profiler = RuleProfiler()
+        plan = optimize_by_rules(
+            self.plan, [rules.RemoveTrivialSequences(), Renumber(),
+                        Nothing(), rules.PushApply(), Nothing()],
+            profiler=profiler)
+        stats = profiler.stats
+        self.assertEquals(stats.keys(), ['RemoveTrivialSequences',
+                                         'Renumber', 'Nothing', 'PushApply'])
+        self.assertEquals((stats['Renumber'].invocations,
+                           stats['Renumber'].nodes,
+                           stats['Renumber'].rewrites), (1, 3, 1))
+        # Rules of the same class are counted together
+        self.assertEquals((stats['Nothing'].invocations,
+                           stats['Nothing'].rewrites), (2, 0))
+        self.assertEquals(stats['RemoveTrivialSequences'].rewrites, 0)
+        # Renumber rewrote the plan in place
+        self.assertIs(plan, self.plan)
+        self.assertEquals(plan.input.condition.right.value, 2)
+
+        report = profiler.report()
+        self.assertEquals(len(report.to_dict()['rules']), 4)
+        self.assertIn('Renumber', report.text())
+        self.assertIn('"rewrites": 1', report.json())
+
+    def test_clock(self):
+        ticks = iter(range(100))
+        profiler = RuleProfiler(clock=lambda: next(ticks))
+        optimize_by_rules(self.plan, [Nothing()], profiler=profiler)
+        self.assertEquals(profiler.stats['Nothing'].time, 3)
+
+    def test_no_printing(self):
+        """Without DEBUG logging, the rules do not print the plans."""
+        optimize_by_rules(self.plan, [Renumber(), Nothing()])
+
+
+class Counting(rules.Rule):
+    """Count the operators that the rule is fired on."""
+
+    matches = Select
+
+    def __init__(self):
+        self.fired = []
+        super(Counting, self).__init__()
+
+    def fire(self, expr):
+        self.fired.append(expr)
+        return expr
+
+
+class FixedPointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        self.db.ingest('public:adhoc:R',
+                       collections.Counter((i, i % 3) for i in range(10)),
+                       Scheme([('a', types.LONG_TYPE),
+                               ('b', types.LONG_TYPE)]))
+
+    def logical_plan(self, depth):
+        """A chain of groupings, each of which aggregates the aggregates of
+        the one below; only the grouping column is stored."""
+        lines = ['x0 = scan(public:adhoc:R);']
+        for i in range(1, depth + 1):
+            lines.append('x{i} = [from x{p} emit a, count(*) as b, '
+                         'max(b) as c];'.format(i=i, p=i - 1))
+        lines.append('y = [from x{d} emit a];'.format(d=depth))
+        lines.append('store(y, OUTPUT);')
+        processor = interpreter.StatementProcessor(self.db)
+        processor.evaluate(parser.Parser().parse('\n'.join(lines)))
+        return processor.get_logical_plan()
+
+    def aggregates(self, plan):
+        return sum(len(op.aggregate_list) for op in plan.walk()
+                   if isinstance(op, GroupBy))
+
+    def test_convergence(self):
+        group = rules.FixedPoint([rules.PushApply(),
+                                  rules.RemoveUnusedColumns()])
+        plan = self.logical_plan(6)
+        expected = self.db.evaluate_to_bag(plan)
+        self.assertEquals(self.aggregates(plan), 12)
+        plan = optimize_by_rules(plan, [group])
+        self.assertEquals(self.aggregates(plan), 0)
+        self.assertEquals(self.db.evaluate_to_bag(plan), expected)
+
+    def test_dispatch(self):
+        """Rules are fired only on the operators that they match."""
+        plan = self.logical_plan(2)
+        counting = Counting()
+        optimize_by_rules(plan, [counting])
+        self.assertEquals(counting.fired, [])
+
+        plan = Select(EQ(UnnamedAttributeRef(0), NumericLiteral(1)), plan)
+        group = rules.FixedPoint([counting])
+        profiler = RuleProfiler()
+        optimize_by_rules(plan, [group], profiler=profiler)
+        self.assertEquals(counting.fired, [plan])
+        self.assertEquals(profiler.stats['Counting'].nodes, 1)
+
+    def test_bound(self):
+        """Rules that never converge stop after max_rewrites."""
+        class Flip(rules.Rule):
+            matches = Select
+
+            def fire(self, expr):
+                return Select(expr.condition, expr.input)
+
+        plan = Select(EQ(UnnamedAttributeRef(0), NumericLiteral(1)),
+                      self.logical_plan(1))
+        size = len(list(plan.walk()))
+        profiler = RuleProfiler()
+        optimize_by_rules(plan, [rules.FixedPoint([Flip()], max_rewrites=2)],
+                          profiler=profiler)
+        self.assertEquals(profiler.stats['Flip'].rewrites, 2 * size)
@@ -5,14 +5,26 @@ representation.
 """
 
 import collections
+import itertools
+import logging
+import time
 
 from sqlalchemy import (Column, Table, MetaData, Integer, String, DateTime,
                         Float, Boolean, LargeBinary, create_engine, select,
-                        text)
+                        text, event)
 
 from raco.scheme import Scheme
 import raco.types as types
 
+LOG = logging.getLogger(__name__)
+
+# The number of tuples sent to the database in one executemany call
+DEFAULT_BATCH_SIZE = 10000
+
+# sqlite settings for scratch databases, which need not survive a crash
+SCRATCH_PRAGMAS = ['PRAGMA journal_mode = OFF',
+                   'PRAGMA synchronous = OFF']
+
 type_to_raco = {Integer: types.LONG_TYPE,
                 String: types.STRING_TYPE,
                 Float: types.FLOAT_TYPE,
@@ -31,11 +43,93 @@ raco_to_type = {types.LONG_TYPE: Integer,
                 types.BLOB_TYPE: LargeBinary}
 
 
+class IngestStats(collections.namedtuple('IngestStats', 'rows seconds')):
+    """The number of tuples inserted by insert_tuples, and how long it
+    took."""
+
+    @property
+    def rows_per_second(self):
+        if self.seconds == 0:
+            return float(self.rows)
+        return self.rows / self.seconds
+
+
+def insert_tuples(engine, table, tuples, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream tuples into a table.
+
+    The tuples are consumed in batches of batch_size, and each batch is
+    inserted with one DBAPI executemany call. Only one batch is held in
+    memory at a time.
+
+    :param engine: The sqlalchemy engine of the database
+    :param table: The sqlalchemy Table to insert into
+    :param tuples: An iterable of tuples, in the column order of table
+    :returns: an IngestStats instance
+    """
+    dialect = engine.dialect
+    statement = table.insert().compile(dialect=dialect)
+    names = [c.name for c in table.columns]
+    processors = [(i, c.type.bind_processor(dialect))
+                  for i, c in enumerate(table.columns)]
+    processors = [(i, p) for i, p in processors if p is not None]
+
+    def prepare(tup):
+        if processors:
+            tup = list(tup)
+            for i, process in processors:
+                tup[i] = process(tup[i])
+        if dialect.positional:
+            return tuple(tup)
+        return dict(zip(names, tup))
+
+    start = time.time()
+    rows = 0
+    it = iter(tuples)
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        while True:
+            batch = [prepare(tup) for tup in itertools.islice(it, batch_size)]
+            if not batch:
+                break
+            cursor.executemany(str(statement), batch)
+            rows += len(batch)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    stats = IngestStats(rows, time.time() - start)
+    LOG.info("inserted %d tuples into %s in %.3fs (%.0f tuples/s)",
+             stats.rows, table.name, stats.seconds, stats.rows_per_second)
+    return stats
+
+
+def use_scratch_pragmas(engine):
+    """Make a sqlite engine skip journaling and syncing to disk."""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SCRATCH_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+    event.listen(engine, 'connect', set_pragmas)
+
+
 class DBConnection(object):
 
-    def __init__(self, connection_string='sqlite:///:memory:', echo=False):
-        """Initialize a database connection."""
+    def __init__(self, connection_string='sqlite:///:memory:', echo=False,
+                 scratch=False, batch_size=DEFAULT_BATCH_SIZE):
+        """Initialize a database connection.
+
+        :param scratch: For sqlite, trade durability for faster loading
+        :param batch_size: The number of tuples to insert at once
+        """
         self.engine = create_engine(connection_string, echo=echo)
+        if scratch and self.engine.dialect.name == 'sqlite':
+            use_scratch_pragmas(self.engine)
+        self.batch_size = batch_size
         self.metadata = MetaData()
         self.metadata.bind = self.engine
         self.__add_function_registry__()
@@ -60,7 +154,10 @@ class DBConnection(object):
                       for c in table.columns)
 
     def add_table(self, rel_key, schema, tuples=None):
-        """Add a table to the database."""
+        """Add a table to the database.
+
+        :returns: an IngestStats instance
+        """
         self.delete_table(rel_key, ignore_failure=True)
         assert str(rel_key) not in self.metadata.tables
 
@@ -68,27 +165,32 @@ class DBConnection(object):
                    for n, t in schema.attributes]
         table = Table(str(rel_key), self.metadata, *columns)
         table.create(self.engine)
-        if tuples:
-            tuples = [{n: v for n, v in zip(schema.get_names(), tup)}
-                      for tup in tuples]
-            if tuples:
-                self.engine.execute(table.insert(), tuples)
+        return insert_tuples(self.engine, table, tuples or [],
+                             self.batch_size)
 
     def append_table(self, rel_key, tuples):
-        """Append tuples to an existing relation."""
-        scheme = self.get_scheme(rel_key)
+        """Append tuples to an existing relation.
 
+        :returns: an IngestStats instance
+        """
         table = self.metadata.tables[str(rel_key)]
-        tuples = [{n: v for n, v in zip(scheme.get_names(), tup)}
-                  for tup in tuples]
-        if tuples:
-            self.engine.execute(table.insert(), tuples)
+        return insert_tuples(self.engine, table, tuples, self.batch_size)
 
     def num_tuples(self, rel_key):
         """Return number of tuples of rel_key """
         table = self.metadata.tables[str(rel_key)]
         return self.engine.execute(table.count()).scalar()
 
+    def scan(self, rel_key):
+        """Iterate over the tuples of a table."""
+        return self.get_table(rel_key).elements()
+
+    def iteritems(self):
+        """Iterate over (relation name, bag) pairs."""
+        for key in self.metadata.tables:
+            if key != 'registered_functions':
+                yield key, self.get_table(key)
+
     def get_table(self, rel_key):
         """Retrieve the contents of a table as a bag (Counter)."""
         table = self.metadata.tables[str(rel_key)]
@@ -121,3 +223,8 @@ class DBConnection(object):
         scheme = self.get_scheme('registered_functions')
         func = [{n: v for n, v in zip(scheme.get_names(), tup)}]
         self.engine.execute(table.insert(), func)
+
+    def registered_functions(self):
+        """Return the registered functions, as tuples of their scheme."""
+        table = self.metadata.tables['registered_functions']
+        return [tuple(t) for t in self.engine.execute(select([table]))]
@@ -0,0 +1,218 @@
+"""
+Profile the operators of a plan evaluated by the FakeDatabase, in the
+manner of EXPLAIN ANALYZE.
+
+A Profiler wraps the tuple iterator of each operator that the database
+evaluates, and records:
+
+- the number of tuples that the operator produces (the number that it
+  consumes is the sum over its children);
+- the wall-clock time spent in the operator itself, excluding the time
+  spent in its children: the clock of a parent stops while one of its
+  children produces a tuple;
+- the peak number of tuples or groups that a set, grouping, join or sort
+  operator holds in memory, as reported by its MemoryBudget.
+
+The report annotates the evaluated plans with these numbers, as text,
+JSON, or a dot graph.
+"""
+
+import json
+import time
+
+from raco import viz
+
+
+class OperatorStats(object):
+    """The statistics of one operator."""
+
+    def __init__(self, op):
+        self.op = op
+        self.tuples_out = 0
+        self.time = 0.0
+        self.peak_state = None
+
+    def hold(self, count):
+        self.peak_state = max(self.peak_state, count)
+
+
+class Profiler(object):
+    """Record the statistics of the operators that a database evaluates.
+
+    :param clock: A function that returns the current time, in seconds
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        # id(op) -> OperatorStats, and the ids in the order of evaluation
+        self.stats = {}
+        self.order = []
+        # The statistics of the operators whose code is running, innermost
+        # last, and the time at which the innermost one started running
+        self._stack = []
+        self._last = None
+        # id(op) -> the copy of op that was evaluated in its place
+        self.substitutes = {}
+
+    def substitute(self, op, plan):
+        """Record that plan, a rewritten copy of op, is evaluated instead
+        of op."""
+        if plan is not op:
+            self.substitutes[id(op)] = plan
+
+    def _enter(self, stats):
+        now = self.clock()
+        if self._stack:
+            self._stack[-1].time += now - self._last
+        self._stack.append(stats)
+        self._last = now
+
+    def _exit(self):
+        now = self.clock()
+        self._stack.pop().time += now - self._last
+        self._last = now
+
+    def observe(self, count):
+        """Record that the running operator holds count tuples or groups in
+        memory."""
+        if self._stack:
+            self._stack[-1].hold(count)
+
+    def call(self, op, method):
+        """Evaluate op with method, recording its statistics.
+
+        :returns: the result of method(op), an iterator or None
+        """
+        stats = self.stats.get(id(op))
+        if stats is None:
+            stats = self.stats[id(op)] = OperatorStats(op)
+            self.order.append(id(op))
+        self._enter(stats)
+        try:
+            result = method(op)
+        finally:
+            self._exit()
+        if result is None:
+            return None
+        return self._iterate(stats, iter(result))
+
+    def _iterate(self, stats, it):
+        while True:
+            self._enter(stats)
+            try:
+                tpl = next(it)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            stats.tuples_out += 1
+            yield tpl
+
+    def report(self):
+        return ProfileReport(self)
+
+
+class ProfileReport(object):
+    """The evaluated plans, annotated with the statistics of their
+    operators."""
+
+    def __init__(self, profiler):
+        self.stats = profiler.stats
+        self.substitutes = profiler.substitutes
+        children = set(id(child)
+                       for stats in self.stats.itervalues()
+                       for child in self.children(stats.op))
+        self.roots = [self.stats[i].op for i in profiler.order
+                      if i not in children]
+
+    def children(self, op):
+        """The children of op as they were evaluated; recursive plans stop
+        at the recursion."""
+        if op.stop_recursion:
+            return []
+        return [self.substitutes.get(id(child), child)
+                for child in op.children() if child is not None]
+
+    def tuples_in(self, op):
+        """The number of tuples that op consumed, or None if it did not
+        read its inputs."""
+        inputs = [self.stats[id(c)].tuples_out for c in self.children(op)
+                  if id(c) in self.stats]
+        if not inputs:
+            return None
+        return sum(inputs)
+
+    def annotation(self, op):
+        """Describe the statistics of op, e.g., 'in=10 out=2 time=0.001s'."""
+        stats = self.stats.get(id(op))
+        if stats is None:
+            return 'never executed'
+        parts = []
+        tuples_in = self.tuples_in(op)
+        if tuples_in is not None:
+            parts.append('in={n}'.format(n=tuples_in))
+        parts.append('out={n}'.format(n=stats.tuples_out))
+        parts.append('time={t:.6f}s'.format(t=stats.time))
+        if stats.peak_state is not None:
+            parts.append('peak_state={n}'.format(n=stats.peak_state))
+        return ' '.join(parts)
+
+    def total_time(self):
+        return sum(stats.time for stats in self.stats.itervalues())
+
+    def text(self):
+        lines = []
+
+        def visit(op, depth):
+            lines.append('{i}{op}  ({a})'.format(i='  ' * depth,
+                                                 op=op.shortStr(),
+                                                 a=self.annotation(op)))
+            for child in self.children(op):
+                visit(child, depth + 1)
+
+        for root in self.roots:
+            visit(root, 0)
+        lines.append('Total time: {t:.6f}s'.format(t=self.total_time()))
+        return '\n'.join(lines)
+
+    def to_dict(self, op):
+        stats = self.stats.get(id(op))
+        d = {'operator': op.opname(),
+             'description': op.shortStr(),
+             'executed': stats is not None,
+             'children': [self.to_dict(c) for c in self.children(op)]}
+        if stats is not None:
+            d.update({'tuples_in': self.tuples_in(op),
+                      'tuples_out': stats.tuples_out,
+                      'time': stats.time,
+                      'peak_state': stats.peak_state})
+        return d
+
+    def json(self):
+        return json.dumps({'plans': [self.to_dict(root)
+                                     for root in self.roots],
+                           'time': self.total_time()})
+
+    def dot(self, **kwargs):
+        """The evaluated plans as a viz.graph_to_dot graph, with the
+        statistics of each operator under its name."""
+        graph = {'nodes': [], 'edges': []}
+        seen = set()
+
+        def visit(op):
+            if id(op) in seen:
+                return
+            seen.add(id(op))
+            graph['nodes'].append(op)
+            for child in self.children(op):
+                graph['edges'].append((child, op))
+                visit(child)
+
+        for root in self.roots:
+            visit(root)
+        annotations = {id(node): self.annotation(node)
+                       for node in graph['nodes']}
+        return viz.graph_to_dot(graph, annotations=annotations, **kwargs)
+
+    def __str__(self):
+        return self.text()
@@ -0,0 +1,82 @@
+import collections
+import itertools
+import json
+import unittest
+
+from raco import explain, types
+from raco.algebra import Distinct, Scan, Select, Store
+from raco.expression import GT, NumericLiteral, UnnamedAttributeRef
+from raco.fakedb import FakeDatabase
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+
+
+class ExplainAnalyzeTest(unittest.TestCase):
+
+    scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE)])
+    key = RelationKey.from_string('public:adhoc:R')
+
+    def setUp(self):
+        self.db = FakeDatabase(profile=True)
+        # Each reading of the clock advances it by one second
+        self.db.profiler.clock = itertools.count().next
+        self.db.ingest(self.key,
+                       collections.Counter([(1, 1), (1, 1), (2, 1), (3, 2)]),
+                       self.scheme)
+        self.scan = Scan(self.key, self.scheme)
+        self.select = Select(GT(UnnamedAttributeRef(0), NumericLiteral(1)),
+                             self.scan)
+        self.distinct = Distinct(self.scan)
+
+    def test_tuples(self):
+        plan = Store(RelationKey.from_string('OUTPUT'), self.select)
+        self.db.evaluate(plan)
+        report = self.db.profiler.report()
+        self.assertEquals(report.roots, [plan])
+        stats = report.stats
+        self.assertEquals(stats[id(self.scan)].tuples_out, 4)
+        self.assertEquals(stats[id(self.select)].tuples_out, 2)
+        self.assertEquals(report.tuples_in(self.select), 4)
+        self.assertEquals(report.tuples_in(plan), 2)
+
+    def test_exclusive_time(self):
+        readings = []
+        clock = self.db.profiler.clock
+        self.db.profiler.clock = lambda: readings.append(clock()) or \
+            readings[-1]
+        list(self.db.evaluate(self.select))
+        stats = self.db.profiler.stats
+        # Every second is attributed to exactly one operator, except for
+        # the 3 that the caller spends before each next() of the select
+        self.assertEquals(stats[id(self.select)].time +
+                          stats[id(self.scan)].time,
+                          readings[-1] - readings[0] - 3)
+
+    def test_peak_state(self):
+        self.assertEquals(len(list(self.db.evaluate(self.distinct))), 3)
+        stats = self.db.profiler.stats
+        self.assertEquals(stats[id(self.distinct)].peak_state, 3)
+        self.assertIsNone(stats[id(self.scan)].peak_state)
+
+    def test_formats(self):
+        list(self.db.evaluate(self.distinct))
+        report = self.db.profiler.report()
+        text = report.text()
+        self.assertIn('Distinct  (in=4 out=3', text)
+        self.assertIn('peak_state=3', text)
+
+        plans = json.loads(report.json())['plans']
+        self.assertEquals(plans[0]['operator'], 'Distinct')
+        self.assertEquals(plans[0]['tuples_in'], 4)
+        self.assertEquals(plans[0]['children'][0]['tuples_out'], 4)
+
+        self.assertIn(r'\nin=4 out=3', report.dot())
+
+    def test_never_executed(self):
+        op = Select(GT(UnnamedAttributeRef(0), NumericLiteral(1)),
+                    self.distinct)
+        report = explain.Profiler().report()
+        self.assertEquals(report.annotation(op), 'never executed')
+
+    def test_off(self):
+        self.assertIsNone(FakeDatabase().profiler)
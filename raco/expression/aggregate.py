@@ -64,6 +64,103 @@ class AggregateExpression(Expression):
         pass
 
 
+class Accumulator(object):
+    """The state of an aggregate over one group, updated one input value at
+    a time."""
+
+    def add(self, value):
+        raise NotImplementedError("{acc}.add".format(acc=type(self)))
+
+    def result(self):
+        raise NotImplementedError("{acc}.result".format(acc=type(self)))
+
+
+class CountAllAccumulator(Accumulator):
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+
+    def result(self):
+        return self.count
+
+
+class CountAccumulator(CountAllAccumulator):
+    def add(self, value):
+        if value is not None:
+            self.count += 1
+
+
+class SumAccumulator(Accumulator):
+    def __init__(self):
+        self.total = 0
+
+    def add(self, value):
+        if value is not None:
+            self.total += value
+
+    def result(self):
+        return self.total
+
+
+class ExtremumAccumulator(Accumulator):
+    """Computes min or max, depending on func."""
+
+    def __init__(self, func):
+        self.func = func
+        self.empty = True
+        self.value = None
+
+    def add(self, value):
+        if self.empty:
+            self.value = value
+            self.empty = False
+        else:
+            self.value = self.func(self.value, value)
+
+    def result(self):
+        if self.empty:
+            raise ValueError("{f}() arg is an empty sequence".format(
+                f=self.func.__name__))
+        return self.value
+
+
+class AverageAccumulator(SumAccumulator):
+    def __init__(self):
+        SumAccumulator.__init__(self)
+        self.count = 0
+
+    def add(self, value):
+        if value is not None:
+            self.total += value
+            self.count += 1
+
+    def result(self):
+        return self.total / self.count
+
+
+class StdevAccumulator(Accumulator):
+    """Population standard deviation, using Welford's online algorithm."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        if value is not None:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+
+    def result(self):
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.m2 / self.count)
+
+
 class BuiltinAggregateExpression(AggregateExpression):
     def evaluate(self, _tuple, scheme, state=None):
         raise NotImplementedError("{expr}.evaluate".format(expr=type(self)))
@@ -72,8 +169,16 @@ class BuiltinAggregateExpression(AggregateExpression):
         return None
 
     @abstractmethod
+    def accumulator(self):
+        """Return an Accumulator that computes the aggregate over the values
+        of its input"""
+
     def evaluate_aggregate(self, tuple_iterator, scheme):
         """Evaluate an aggregate over a bag of tuples"""
+        acc = self.accumulator()
+        for t in tuple_iterator:
+            acc.add(self.input.evaluate(t, scheme))
+        return acc.result()
 
 
 class UdaAggregateExpression(AggregateExpression, UnaryOperator):
@@ -186,18 +291,16 @@ class TrivialAggregateExpression(BuiltinAggregateExpression):
 
 class MAX(UnaryFunction, TrivialAggregateExpression):
 
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        return max(inputs)
+    def accumulator(self):
+        return ExtremumAccumulator(max)
 
     def typeof(self, scheme, state_scheme):
         return self.input.typeof(scheme, state_scheme)
 
 
 class MIN(UnaryFunction, TrivialAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        return min(inputs)
+    def accumulator(self):
+        return ExtremumAccumulator(min)
 
     def typeof(self, scheme, state_scheme):
         return self.input.typeof(scheme, state_scheme)
@@ -205,6 +308,9 @@ class MIN(UnaryFunction, TrivialAggregateExpression):
 
 class LEXMIN(NaryFunction, TrivialAggregateExpression):
     # TODO: support for fakedb
+    def accumulator(self):
+        raise NotImplementedError()
+
     def evaluate_aggregate(self, tuple_iterator, scheme):
         raise NotImplementedError()
 
@@ -213,6 +319,9 @@ class LEXMIN(NaryFunction, TrivialAggregateExpression):
 
 
 class COUNTALL(ZeroaryOperator, BuiltinAggregateExpression):
+    def accumulator(self):
+        return CountAllAccumulator()
+
     def evaluate_aggregate(self, tuple_iterator, scheme):
         return len(tuple_iterator)
 
@@ -228,13 +337,8 @@ class COUNTALL(ZeroaryOperator, BuiltinAggregateExpression):
 
 
 class COUNT(UnaryFunction, BuiltinAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        count = 0
-        for t in inputs:
-            if t is not None:
-                count += 1
-        return count
+    def accumulator(self):
+        return CountAccumulator()
 
     def typeof(self, scheme, state_scheme):
         return types.LONG_TYPE
@@ -248,10 +352,8 @@ class COUNT(UnaryFunction, BuiltinAggregateExpression):
 
 
 class SUM(UnaryFunction, TrivialAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-
-        return sum(x for x in inputs if x is not None)
+    def accumulator(self):
+        return SumAccumulator()
 
     def typeof(self, scheme, state_scheme):
         input_type = self.input.typeof(scheme, state_scheme)
@@ -260,10 +362,8 @@ class SUM(UnaryFunction, TrivialAggregateExpression):
 
 
 class AVG(UnaryFunction, BuiltinAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        filtered = list(x for x in inputs if x is not None)
-        return sum(filtered) / len(filtered)
+    def accumulator(self):
+        return AverageAccumulator()
 
     def typeof(self, scheme, state_scheme):
         input_type = self.input.typeof(scheme, state_scheme)
@@ -281,16 +381,8 @@ class AVG(UnaryFunction, BuiltinAggregateExpression):
 
 
 class STDEV(UnaryFunction, BuiltinAggregateExpression):
-    def evaluate_aggregate(self, tuple_iterator, scheme):
-        inputs = (self.input.evaluate(t, scheme) for t in tuple_iterator)
-        filtered = [x for x in inputs if x is not None]
-
-        n = len(filtered)
-        if n < 2:
-            return 0.0
-
-        mean = float(sum(filtered)) / n
-        return math.sqrt(sum((a - mean) ** 2 for a in filtered) / n)
+    def accumulator(self):
+        return StdevAccumulator()
 
     def typeof(self, scheme, state_scheme):
         input_type = self.input.typeof(scheme, state_scheme)
@@ -0,0 +1,216 @@
+"""
+Compile scalar expressions into Python functions for fast evaluation.
+
+Expression.evaluate walks the expression tree for every tuple, resolving
+named column references through the scheme each time. The functions built
+here are generated (with compile()) once per operator instead: column and
+state references are resolved to positions, casts are bound to their Python
+types and constant subexpressions are folded ahead of time.
+
+Expressions that the code generator does not know about are embedded as calls
+to their own evaluate method, so any expression tree can be compiled.
+"""
+
+import math
+import random
+
+from raco import types
+from .expression import Literal
+from .function import RANDOM, PYUDF
+
+# Templates for operators that map directly onto Python syntax or builtins
+BINARY_TEMPLATES = {
+    'PLUS': '({l} + {r})',
+    'MINUS': '({l} - {r})',
+    'TIMES': '({l} * {r})',
+    'DIVIDE': '(float({l}) / {r})',
+    'IDIVIDE': 'int({l} / {r})',
+    'MOD': 'int({l} % {r})',
+    'AND': '({l} and {r})',
+    'OR': '({l} or {r})',
+    'EQ': '({l} == {r})',
+    'NEQ': '({l} != {r})',
+    'LT': '({l} < {r})',
+    'GT': '({l} > {r})',
+    'LTEQ': '({l} <= {r})',
+    'GTEQ': '({l} >= {r})',
+    'POW': 'pow({l}, {r})',
+    'LESSER': 'min({l}, {r})',
+    'GREATER': 'max({l}, {r})',
+    'CONCAT': '({l} + {r})',
+}
+
+UNARY_TEMPLATES = {
+    'NOT': '(not {i})',
+    'NEG': '(-1 * {i})',
+    'ABS': 'abs({i})',
+    'CEIL': 'math.ceil({i})',
+    'COS': 'math.cos({i})',
+    'FLOOR': 'math.floor({i})',
+    'LOG': 'math.log({i})',
+    'SIN': 'math.sin({i})',
+    'SQRT': 'math.sqrt({i})',
+    'TAN': 'math.tan({i})',
+    'LEN': 'len({i})',
+}
+
+NARY_TEMPLATES = {
+    'SUBSTR': '{0}[{1}:{2}]',
+    'BYTERANGE': '{0}[{1}:{2}]',
+}
+
+# Expressions that must be evaluated once per tuple even if their inputs are
+# constant.
+NONDETERMINISTIC = (RANDOM, PYUDF)
+
+
+class ExpressionCodeGenerator(object):
+    """Translate an expression tree into the source of a Python expression
+    over the free variables _tuple and state."""
+
+    def __init__(self, scheme, state_scheme=None):
+        self.scheme = scheme
+        self.state_scheme = state_scheme
+        # The globals of the generated code
+        self.env = {'math': math, 'random': random}
+        # The ids of the subexpressions that were folded into constants
+        self.folded = set()
+
+    def bind(self, value, prefix='v'):
+        """Make value available to the generated code; return its name."""
+        name = '_{p}{n}'.format(p=prefix, n=len(self.env))
+        self.env[name] = value
+        return name
+
+    def constant(self, expr, value):
+        self.folded.add(id(expr))
+        return self.bind(value, 'c')
+
+    def fallback(self, expr):
+        """Evaluate expr with the interpreter."""
+        return '{e}.evaluate(_tuple, {s}, state)'.format(
+            e=self.bind(expr, 'e'), s=self.bind(self.scheme, 's'))
+
+    def generate(self, expr):
+        name = type(expr).__name__
+        if isinstance(expr, Literal):
+            return self.constant(expr, expr.value)
+        elif name in BINARY_TEMPLATES:
+            src = BINARY_TEMPLATES[name].format(l=self.generate(expr.left),
+                                                r=self.generate(expr.right))
+        elif name in UNARY_TEMPLATES:
+            src = UNARY_TEMPLATES[name].format(i=self.generate(expr.input))
+        elif name in NARY_TEMPLATES:
+            src = NARY_TEMPLATES[name].format(
+                *[self.generate(op) for op in expr.operands])
+        else:
+            method = getattr(self, 'generate_' + name, self.fallback)
+            return method(expr)
+        return self.fold(expr, src)
+
+    def fold(self, expr, src):
+        """Replace src by a constant if all of the inputs of expr are
+        constants."""
+        children = expr.get_children()
+        if (not children or isinstance(expr, NONDETERMINISTIC) or
+                not all(id(c) in self.folded for c in children)):
+            return src
+        try:
+            value = eval(src, self.env)
+        except Exception:
+            # Leave the error to be raised when (if) a tuple is evaluated
+            return src
+        return self.constant(expr, value)
+
+    def generate_UnnamedAttributeRef(self, expr):
+        return '_tuple[{p}]'.format(p=expr.position)
+
+    def generate_NamedAttributeRef(self, expr):
+        if self.scheme is None or expr.name not in self.scheme:
+            return self.fallback(expr)
+        return '_tuple[{p}]'.format(p=self.scheme.getPosition(expr.name))
+
+    def generate_UnnamedStateAttributeRef(self, expr):
+        return 'state.values[{p}]'.format(p=expr.position)
+
+    def generate_NamedStateAttributeRef(self, expr):
+        if (self.state_scheme is None or
+                expr.name not in self.state_scheme):
+            return self.fallback(expr)
+        return 'state.values[{p}]'.format(
+            p=self.state_scheme.getPosition(expr.name))
+
+    def generate_CAST(self, expr):
+        pytype = types.reverse_python_type_map[expr.typeof(None, None)]
+        src = '{t}({i})'.format(t=self.bind(pytype, 't'),
+                                i=self.generate(expr.input))
+        return self.fold(expr, src)
+
+    def generate_Case(self, expr):
+        src = self.generate(expr.else_expr)
+        for test_expr, result_expr in reversed(expr.when_tuples):
+            src = '({r} if {t} else {e})'.format(
+                r=self.generate(result_expr), t=self.generate(test_expr),
+                e=src)
+        return self.fold(expr, src)
+
+    def generate_RANDOM(self, expr):
+        return 'random.random()'
+
+    def generate_PYUDF(self, expr):
+        if not expr.func:
+            return self.fallback(expr)
+        args = ', '.join(self.generate(a) for a in expr.arguments)
+        return '{f}({a})'.format(f=self.bind(expr.func, 'f'), a=args)
+
+    def generate_UdaAggregateExpression(self, expr):
+        # The emitter of a UDA only references the state
+        scheme = self.scheme
+        self.scheme = None
+        try:
+            return self.generate(expr.input)
+        finally:
+            self.scheme = scheme
+
+
+def compile_source(src, env, default):
+    """Compile the body of a function of (_tuple, state). If the Python
+    parser cannot handle the source (e.g., it is too deeply nested), return
+    default instead."""
+    try:
+        code = compile('lambda _tuple, state=None: ' + src,
+                       '<compiled expression>', 'eval', 0, True)
+    except (SyntaxError, MemoryError, RuntimeError):
+        return default
+    return eval(code, env)
+
+
+def compile_evaluator(expr, scheme, state_scheme=None):
+    """Compile an expression into a function f(_tuple, state=None) that
+    returns the same value as expr.evaluate(_tuple, scheme, state).
+
+    :param expr: The expression to compile
+    :param scheme: The scheme of the tuples the function will be applied to
+    :param state_scheme: The scheme of the state, if any
+    """
+    gen = ExpressionCodeGenerator(scheme, state_scheme)
+    src = gen.generate(expr)
+    return compile_source(
+        src, gen.env, lambda _tuple, state=None: expr.evaluate(
+            _tuple, scheme, state))
+
+
+def compile_tuple_evaluator(exprs, scheme, state_scheme=None):
+    """Compile a list of expressions into a single function f(_tuple,
+    state=None) that returns the tuple of their values.
+
+    :param exprs: The expressions to compile
+    :param scheme: The scheme of the tuples the function will be applied to
+    :param state_scheme: The scheme of the state, if any
+    """
+    gen = ExpressionCodeGenerator(scheme, state_scheme)
+    srcs = [gen.generate(expr) for expr in exprs]
+    src = '({s},)'.format(s=', '.join(srcs)) if srcs else '()'
+    return compile_source(
+        src, gen.env, lambda _tuple, state=None: tuple(
+            expr.evaluate(_tuple, scheme, state) for expr in exprs))
@@ -7,7 +7,7 @@ from abc import ABCMeta, abstractmethod
 import logging
 
 from raco.utility import Printable
-from raco import types
+from raco import memo, types
 
 LOG = logging.getLogger(__name__)
 
@@ -30,6 +30,14 @@ class Expression(Printable):
     __metaclass__ = ABCMeta
     literals = None
 
+    def __setattr__(self, name, value):
+        # Rewriting an expression in place changes the memoized properties
+        # of the operators that hold it; building one does not
+        if name in self.__dict__ and not memo.same(self.__dict__[name],
+                                                   value):
+            memo.new_epoch()
+        object.__setattr__(self, name, value)
+
     @abstractmethod
     def typeof(self, scheme, state_scheme):
         """Returns a string describing the expression's return type.
@@ -0,0 +1,78 @@
+import unittest
+
+from raco import scheme, types
+from raco.expression import *
+from raco.expression.evaluator import (compile_evaluator,
+                                       compile_tuple_evaluator)
+from raco.fakedb import State
+
+
+class ExpressionEvaluatorTest(unittest.TestCase):
+
+    sch = scheme.Scheme([("a", types.LONG_TYPE),
+                         ("b", types.DOUBLE_TYPE),
+                         ("s", types.STRING_TYPE)])
+
+    tuples = [(1, 2.5, "hello"), (-4, 0.5, "world"), (7, -3.0, "")]
+
+    def check(self, expr, state=None, state_scheme=None):
+        func = compile_evaluator(expr, self.sch, state_scheme)
+        for tpl in self.tuples:
+            self.assertEqual(func(tpl, state),
+                             expr.evaluate(tpl, self.sch, state))
+
+    def test_arithmetic(self):
+        a = NamedAttributeRef("a")
+        b = UnnamedAttributeRef(1)
+        self.check(PLUS(a, TIMES(b, NumericLiteral(3))))
+        self.check(DIVIDE(a, NumericLiteral(3)))
+        self.check(IDIVIDE(a, NumericLiteral(3)))
+        self.check(MOD(a, NumericLiteral(3)))
+        self.check(NEG(MINUS(b, a)))
+        self.check(ABS(a))
+
+    def test_boolean(self):
+        a = NamedAttributeRef("a")
+        self.check(AND(GT(a, NumericLiteral(0)),
+                       LTEQ(UnnamedAttributeRef(1), NumericLiteral(2.5))))
+        self.check(OR(EQ(a, NumericLiteral(7)), NOT(NEQ(a, a))))
+
+    def test_strings(self):
+        s = NamedAttributeRef("s")
+        self.check(LEN(s))
+        self.check(SUBSTR([s, NumericLiteral(1), NumericLiteral(3)]))
+        self.check(CONCAT(s, StringLiteral("!")))
+
+    def test_cast_and_case(self):
+        a = NamedAttributeRef("a")
+        self.check(CAST(types.STRING_TYPE, a))
+        self.check(CAST(types.DOUBLE_TYPE, a))
+        self.check(Case([(GT(a, NumericLiteral(0)), StringLiteral("pos")),
+                         (LT(a, NumericLiteral(0)), StringLiteral("neg"))],
+                        StringLiteral("zero")))
+
+    def test_constant_folding(self):
+        expr = TIMES(PLUS(NumericLiteral(2), NumericLiteral(3)),
+                     NumericLiteral(4))
+        func = compile_evaluator(expr, self.sch)
+        self.assertEqual(len(func.func_code.co_names), 1)
+        self.assertEqual(func(self.tuples[0]), 20)
+
+    def test_state(self):
+        state_sch = scheme.Scheme([("cnt", types.LONG_TYPE)])
+        state = State(self.sch, state_sch, [("cnt", NumericLiteral(5))])
+        self.check(PLUS(NamedStateAttributeRef("cnt"),
+                        NamedAttributeRef("a")), state, state_sch)
+        self.check(UnnamedStateAttributeRef(0), state, state_sch)
+
+    def test_fallback(self):
+        """Expressions without a code generator use their evaluate"""
+        self.check(PLUS(NamedAttributeRef("a"), WORKERID()))
+
+    def test_tuple_evaluator(self):
+        exprs = [NamedAttributeRef("s"), PLUS(NamedAttributeRef("a"),
+                                              NumericLiteral(1))]
+        func = compile_tuple_evaluator(exprs, self.sch)
+        self.assertEqual([func(t) for t in self.tuples],
+                         [("hello", 2), ("world", -3), ("", 8)])
+        self.assertEqual(compile_tuple_evaluator([], self.sch)((1,)), ())
@@ -1,18 +1,249 @@
 
 import collections
+import copy
 import itertools
-import csv
-import random
+import heapq
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import operator
+import pickle
+import time
+import uuid
+import weakref
 
 from raco.dbconn import DBConnection
-from raco import relation_key, types
-from raco.algebra import StoreTemp, DEFAULT_CARDINALITY
+from raco.memorystore import MemoryStore
+from raco import columnfile, fastcsv, relation_key
+from raco import algebra
+from raco.algebra import StoreTemp, OrderBy, DEFAULT_CARDINALITY
 from raco.catalog import Catalog
-from raco.expression import AND, EQ, BuiltinAggregateExpression
+from raco.expression import (AND, AttributeRef, BuiltinAggregateExpression,
+                             extract_conjuncs, to_unnamed_recursive)
+from raco.expression.evaluator import (compile_evaluator,
+                                       compile_tuple_evaluator)
 from raco.representation import RepresentationProperties
+from raco.rules import PushSelects
+from raco import (explain, resultcache, sampling, seminaive, sharing, spill,
+                  statistics)
 
 debug = False
 
+# The operators that do not return tuples
+CONTROL_OPERATORS = (algebra.Sequence, algebra.Parallel, algebra.DoWhile,
+                     algebra.UntilConvergence, algebra.Store,
+                     algebra.StoreTemp, algebra.AppendTemp, algebra.Sink,
+                     algebra.Dump)
+
+# The statements that write the result of a query; independent statements
+# may evaluate their queries concurrently
+WRITE_OPERATORS = (algebra.Store, algebra.StoreTemp, algebra.AppendTemp,
+                   algebra.Sink)
+
+# The operators that read a persistent relation, by its relation key
+RELATION_READERS = (algebra.Scan, algebra.SampleScan)
+
+
+def _writes(statement):
+    """The relation that a statement of WRITE_OPERATORS writes."""
+    if isinstance(statement, (algebra.StoreTemp, algebra.AppendTemp)):
+        return ('temp', statement.name)
+    if isinstance(statement, algebra.Sink):
+        return ('relation', str(relation_key.RelationKey('OUTPUT')))
+    return ('relation', str(statement.relation_key))
+
+
+def _reads(op):
+    """The relations that the plan rooted at op reads."""
+    reads = set()
+    for node in op.walk():
+        if isinstance(node, RELATION_READERS):
+            reads.add(('relation', str(node.relation_key)))
+        elif isinstance(node, algebra.ScanTemp):
+            reads.add(('temp', node.name))
+    return reads
+
+
+def statement_batches(statements):
+    """Group consecutive statements whose queries may be evaluated at the
+    same time: statements of WRITE_OPERATORS that do not read a relation
+    that an earlier statement of their group writes. Other statements are
+    in groups of their own.
+
+    Within a group, the queries only read relations written before the
+    group, so their writes can be applied in order once they are all
+    evaluated.
+    """
+    batch = []
+    written = set()
+    for statement in statements:
+        if (not isinstance(statement, WRITE_OPERATORS) or
+                _reads(statement.input) & written):
+            if batch:
+                yield batch
+            batch, written = [], set()
+        if not isinstance(statement, WRITE_OPERATORS):
+            yield [statement]
+            continue
+        batch.append(statement)
+        written.add(_writes(statement))
+    if batch:
+        yield batch
+
+
+def evaluate_remote(task):
+    """Evaluate a query in a new FakeDatabase, e.g., in another process.
+
+    :param task: a tuple (query, tables, temp_tables, functions,
+    memory_budget, spill_dir), where tables and temp_tables map the
+    relations that the query reads to their (scheme, tuples), and functions
+    is the list of registered functions
+    :returns: the list of tuples output by the query
+    """
+    query, tables, temp_tables, functions, memory_budget, spill_dir = task
+    db = FakeDatabase(memory_budget=memory_budget, spill_dir=spill_dir)
+    for rel_key, (scheme, tuples) in tables.iteritems():
+        db.tables.add_table(rel_key, scheme, tuples)
+    for name, (scheme, tuples) in temp_tables.iteritems():
+        db.temp_tables.add_table(name, scheme, tuples)
+    for function in functions:
+        db.tables.register_function(function)
+    return list(db.evaluate(query))
+
+
+def split_equijoin_condition(condition, left_len, combined_scheme):
+    """Split a join condition into equijoin keys and a residual predicate.
+
+    :param condition: The join condition
+    :param left_len: The number of columns in the left input
+    :param combined_scheme: The concatenation of the input schemes
+    :returns: A tuple (left_cols, right_cols, residual). The column lists are
+    positions relative to each input; residual is an expression over the
+    combined scheme, or None if every conjunct is an equijoin term.
+    """
+    condition = to_unnamed_recursive(copy.deepcopy(condition),
+                                     combined_scheme)
+
+    left_cols = []
+    right_cols = []
+    residual = []
+    for conjunc in extract_conjuncs(condition):
+        cols = PushSelects.is_column_equality_comparison(conjunc)
+        if cols is not None:
+            lcol, rcol = min(cols), max(cols)
+            if lcol < left_len <= rcol:
+                left_cols.append(lcol)
+                right_cols.append(rcol - left_len)
+                continue
+        residual.append(conjunc)
+
+    if residual:
+        residual = reduce(AND, residual)
+    else:
+        residual = None
+    return left_cols, right_cols, residual
+
+
+def estimate_num_tuples(op):
+    """Return the optimizer's cardinality estimate for an operator, falling
+    back to DEFAULT_CARDINALITY when it cannot be computed."""
+    try:
+        return op.num_tuples()
+    except NotImplementedError:
+        return DEFAULT_CARDINALITY
+
+
+def generic_join(relations, join_vars):
+    """Worst-case optimal multiway equijoin (the "generic join" of Ngo et al.,
+    the algorithm behind Myria's LeapFrogJoin).
+
+    Each relation is indexed by a hash trie on its join variables, in variable
+    order. Variables are then bound one at a time by intersecting the keys of
+    the tries of every relation that contains that variable.
+
+    :param relations: A list of materialized inputs (lists of tuples)
+    :param join_vars: A list of join variables in the order they are bound.
+    Each is a list of (relation index, column index) pairs that must be equal.
+    :returns: An iterator over the concatenation of matching input tuples
+    """
+    # For each relation, the columns that bind each of its variables
+    var_cols = [collections.defaultdict(list) for _ in relations]
+    for v, attrs in enumerate(join_vars):
+        for rel, col in attrs:
+            var_cols[rel][v].append(col)
+
+    tries = []
+    for rel, tuples in enumerate(relations):
+        cols = [var_cols[rel][v] for v in sorted(var_cols[rel])]
+        if not cols:
+            # Not constrained by any variable: a cross product
+            tries.append(tuples)
+            continue
+        root = {}
+        for tpl in tuples:
+            # A variable bound by several columns of one relation
+            if any(tpl[c] != tpl[cs[0]] for cs in cols for c in cs[1:]):
+                continue
+            node = root
+            for cs in cols[:-1]:
+                node = node.setdefault(tpl[cs[0]], {})
+            node.setdefault(tpl[cols[-1][0]], []).append(tpl)
+        tries.append(root)
+
+    participants = [[rel for rel in range(len(relations))
+                     if v in var_cols[rel]]
+                    for v in range(len(join_vars))]
+
+    def bind(v, nodes):
+        if v == len(join_vars):
+            # Every remaining node is a list of tuples agreeing on all vars
+            for combo in itertools.product(*nodes):
+                yield sum(combo, ())
+            return
+
+        rels = participants[v]
+        smallest = nodes[min(rels, key=lambda r: len(nodes[r]))]
+        for key in smallest:
+            if not all(key in nodes[r] for r in rels):
+                continue
+            children = list(nodes)
+            for r in rels:
+                children[r] = nodes[r][key]
+            for tpl in bind(v + 1, children):
+                yield tpl
+
+    return bind(0, tries)
+
+
+class Descending(object):
+    """Wrap a value so that it sorts in the opposite order."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+
+def sort_key(sort_columns, ascending):
+    """Build a composite sort key for OrderBy.
+
+    :returns: a tuple (key, reverse) to pass to sorted() or heapq
+    """
+    if all(ascending):
+        return operator.itemgetter(*sort_columns), False
+    if not any(ascending):
+        return operator.itemgetter(*sort_columns), True
+    directions = zip(sort_columns, ascending)
+    return (lambda tpl: tuple(tpl[col] if asc else Descending(tpl[col])
+                              for col, asc in directions)), False
+
 
 class State(object):
     def __init__(self, op_scheme, state_scheme, init_exprs):
@@ -21,10 +252,10 @@ class State(object):
         self.values = [x.evaluate(None, op_scheme, None)
                        for (_, x) in init_exprs]
 
-    def update(self, tpl, update_exprs):
-        new_vals = [expr.evaluate(tpl, self.op_scheme, self)
-                    for (_, expr) in update_exprs]
-        self.values = new_vals
+    def update(self, tpl, updater):
+        """Replace the state values; updater is a function compiled by
+        compile_tuple_evaluator from the update expressions."""
+        self.values = list(updater(tpl, self))
 
     def __str__(self):
         return 'State(%s)' % self.values
@@ -33,16 +264,91 @@ class State(object):
 class FakeDatabase(Catalog):
     """An in-memory implementation of relational algebra operators"""
 
-    def __init__(self):
+    def __init__(self, connection_string=None, data_dir=None,
+                 memory_budget=None, spill_dir=None, cache_dir=None,
+                 cache_size=resultcache.DEFAULT_MAX_BYTES, profile=False,
+                 parallelism=None, parallel_processes=False):
+        """Initialize the database.
+
+        :param connection_string: If given, store the persistent tables in
+        the SQL database at this (sqlalchemy) URL instead of in memory
+        :param data_dir: If given, store the persistent tables as binary
+        column files in this directory (see raco.columnfile)
+        :param memory_budget: If given, the number of bytes that the state
+        of an operator may use before it spills to disk (see raco.spill)
+        :param spill_dir: The directory of the spill files
+        :param cache_dir: If given, cache the results of the statements in
+        this directory, across runs (see raco.resultcache)
+        :param cache_size: The size cap of the result cache, in bytes
+        :param profile: If True, record the statistics of the operators
+        that are evaluated in self.profiler (see raco.explain)
+        :param parallelism: If given, evaluate the queries of up to this
+        many independent statements of a Sequence or Parallel at the same
+        time (see statement_batches)
+        :param parallel_processes: If True, evaluate them in a
+        multiprocessing pool rather than in threads
+        """
         # Persistent tables, identified by RelationKey
-        self.tables = DBConnection()
+        if connection_string is not None:
+            self.tables = DBConnection(connection_string)
+        elif data_dir is not None:
+            self.tables = columnfile.ColumnFileStore(data_dir)
+        else:
+            self.tables = MemoryStore()
 
         # Temporary tables, identified by string name
-        self.temp_tables = DBConnection()
+        self.temp_tables = MemoryStore()
 
         # partitionings
         self.partitionings = {}
 
+        # IterationStats of the last do/until convergence loop
+        self.iteration_stats = []
+
+        # Sorts, joins, groupings and duplicate elimination
+        self.memory = spill.MemoryBudget(memory_budget, spill_dir)
+
+        # The operators of queries without shared subplans, by id
+        self._unshared = weakref.WeakValueDictionary()
+        self._shared_names = itertools.count()
+
+        # Results of statements, and the versions of the relations that
+        # they read, by relation key or temporary relation name
+        self.result_cache = None
+        if cache_dir is not None:
+            self.result_cache = resultcache.ResultCache(cache_dir, cache_size)
+        self._versions = {}
+        self._temp_versions = {}
+        # The statistics of the columns of relations, and their versions
+        self._column_stats = {}
+        self._session = uuid.uuid4().hex
+        self._version_counter = itertools.count()
+
+        self.parallelism = parallelism
+        self.parallel_processes = parallel_processes
+        self._statement_pool = None
+        # The results of queries evaluated ahead of their statements, by id
+        self._precomputed = {}
+        # The attributes that the consumers of binary FileScans, and of the
+        # Selects above them, use, by id of the operator
+        self._needed_columns = {}
+
+        self.profiler = None
+        if profile:
+            self.profiler = explain.Profiler()
+            self.memory.observer = self.profiler.observe
+
+    def close(self):
+        """Shut down the pool of the concurrent statements, if any."""
+        if self._statement_pool is not None:
+            self._statement_pool.close()
+            self._statement_pool.join()
+            self._statement_pool = None
+
+    @property
+    def spill_stats(self):
+        return self.memory.stats
+
     def get_num_servers(self):
         return 1
 
@@ -58,15 +364,121 @@ class FakeDatabase(Catalog):
         in the FakeDatabase"""
         return self.partitionings[rel_key]
 
+    def column_stats(self, rel_key):
+        """Compute the statistics of the columns of a relation from its
+        contents, once per version of the relation."""
+        key = str(rel_key)
+        version = self._versions.get(key)
+        cached = self._column_stats.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        try:
+            width = len(self.tables.get_scheme(rel_key))
+        except KeyError:
+            return None
+        stats = statistics.analyze(self.tables.scan(rel_key), width)
+        if version is not None:
+            self._column_stats[key] = (version, stats)
+        return stats
+
     def evaluate(self, op):
         """Evaluate a relational algebra operation.
 
         For "query-type" operators, return a tuple iterator.
         For store queries, the return value is None.
         """
+        if self._precomputed and id(op) in self._precomputed:
+            return iter(self._precomputed.pop(id(op)))
+        if (not isinstance(op, CONTROL_OPERATORS) and
+                self._unshared.get(id(op)) is not op):
+            return self._evaluate_query(op)
         method = getattr(self, op.opname().lower())
+        if self.profiler is not None:
+            return self.profiler.call(op, method)
         return method(op)
 
+    def _evaluate_query(self, op):
+        """Evaluate the subplans of a query that occur more than once into
+        temporary relations, then evaluate the query over them.
+
+        With a memory budget, subplans are not shared: the temporary
+        relations would hold their results in memory."""
+        if self.memory.budget is None:
+            plan, subplans = sharing.share_subplans(op, self._shared_name)
+        else:
+            plan, subplans = op, []
+        if self.profiler is not None:
+            self.profiler.substitute(op, plan)
+        plans = [plan] + [subplan for _, subplan in subplans]
+        for node in itertools.chain.from_iterable(p.walk() for p in plans):
+            self._unshared[id(node)] = node
+        if not subplans:
+            return self.evaluate(plan)
+
+        for name, subplan in subplans:
+            self._set_temp_table(name, subplan.scheme(),
+                                 self.evaluate(subplan))
+        return self._drop_after(self.evaluate(plan),
+                                [name for name, _ in subplans])
+
+    def _evaluate_cached(self, op):
+        """Evaluate a query, or read its result from the result cache.
+
+        :returns: a tuple (tuples, version), where version is the version
+        of a relation that stores the tuples
+        """
+        if self.result_cache is None or not resultcache.is_cacheable(op):
+            return self.evaluate(op), self._new_version()
+        key = self.result_cache.key(op, self._input_versions(op))
+        tuples = self.result_cache.get(key)
+        if tuples is None:
+            tuples = self.result_cache.put(key, self.evaluate(op))
+        return tuples, 'result:' + key
+
+    def _new_version(self):
+        return '{s}:{n}'.format(s=self._session,
+                                n=next(self._version_counter))
+
+    def _input_versions(self, op):
+        versions = set()
+        for node in op.walk():
+            if isinstance(node, algebra.Scan):
+                key = str(node.relation_key)
+                if key not in self._versions:
+                    self._versions[key] = self._stored_version(
+                        node.relation_key)
+                versions.add((key, self._versions[key]))
+            elif isinstance(node, algebra.ScanTemp):
+                if node.name not in self._temp_versions:
+                    self._temp_versions[node.name] = self._new_version()
+                versions.add(('temp:' + node.name,
+                              self._temp_versions[node.name]))
+            elif isinstance(node, algebra.FileScan):
+                versions.add((node.path, resultcache.file_version(node.path)))
+        return versions
+
+    def _stored_version(self, rel_key):
+        """The version of a relation that was not written by this
+        database."""
+        if isinstance(self.tables, columnfile.ColumnFileStore):
+            path = self.tables.relation_path(rel_key)
+            if columnfile.is_relation(path):
+                # Written by an earlier run
+                return resultcache.file_version(path)
+        return self._new_version()
+
+    def _shared_name(self):
+        return '__shared{i}'.format(i=next(self._shared_names))
+
+    def _drop_after(self, tuples, temp_names):
+        """Iterate over tuples, then delete the temporary relations."""
+        try:
+            for tpl in tuples:
+                yield tpl
+        finally:
+            for name in temp_names:
+                self.delete_temp_table(name)
+
     def evaluate_to_bag(self, op):
         """Return a bag (collections.Counter instance) for the operation"""
         return collections.Counter(self.evaluate(op))
@@ -78,6 +490,8 @@ class FakeDatabase(Catalog):
             rel_key = relation_key.RelationKey.from_string(rel_key)
         assert isinstance(rel_key, relation_key.RelationKey)
         self.tables.add_table(rel_key, scheme, contents.elements())
+        self._versions[str(rel_key)] = self._new_version()
+        self._column_stats.pop(str(rel_key), None)
         self.partitionings[rel_key] = partitioning
 
     def add_function(self, tup):
@@ -114,10 +528,10 @@ class FakeDatabase(Catalog):
 
     def delete_temp_table(self, key):
         self.temp_tables.delete_table(key)
+        self._temp_versions.pop(key, None)
 
     def dump_all(self):
-        for key, val in self.tables.iteritems():
-            bag = val[0]
+        for key, bag in self.tables.iteritems():
             print '%s: (%s)' % (key, bag)
 
         for key, bag in self.temp_tables.iteritems():
@@ -125,80 +539,115 @@ class FakeDatabase(Catalog):
 
     def scan(self, op):
         assert isinstance(op.relation_key, relation_key.RelationKey)
-        return self.tables.get_table(op.relation_key).elements()
+        return self.tables.scan(op.relation_key)
 
     def calculatesamplingdistribution(self, op):
-        if op.is_pct:
-            tup_cnt = sum(t[1] for t in list(self.evaluate(op.input)))
-            sample_size = int(round(tup_cnt * (op.sample_size / 100.0)))
+        tuples = self.evaluate(op.input)
+        if not op.is_pct:
+            return (t + (op.sample_size, op.sample_type) for t in tuples)
+        # One tuple per worker: (WorkerID, WorkerCount)
+        tuples = list(tuples)
+        tup_cnt = sum(t[1] for t in tuples)
+        sample_size = int(round(tup_cnt * (op.sample_size / 100.0)))
+        return (t + (sample_size, op.sample_type) for t in tuples)
+
+    @staticmethod
+    def _sample(tuples, sample_size, is_pct, sample_type):
+        """Sample a stream of tuples in one pass. Percentages are sampled
+        tuple by tuple, so that the input need not be counted first."""
+        if sample_type not in ('WR', 'WoR'):
+            raise ValueError("Invalid sample type")
+        if is_pct:
+            fraction = sample_size / 100.0
+            if sample_type == 'WR':
+                sample = sampling.poisson_sample(tuples, fraction)
+            else:
+                sample = sampling.bernoulli_sample(tuples, fraction)
+        elif sample_type == 'WR':
+            sample = sampling.reservoir_sample_with_replacement(
+                tuples, sample_size)
         else:
-            sample_size = op.sample_size
-        return (t + (sample_size, op.sample_type) for t in
-                self.evaluate(op.input))
+            sample = sampling.reservoir_sample(tuples, sample_size)
+        if sample_type == 'WR':
+            # Add unique index to make them appear like different tuples.
+            return ((i,) + t for i, t in enumerate(sample))
+        return iter(sample)
 
     def sample(self, op):
+        if op.is_pct:
+            # The sampling distribution of a single worker is the
+            # percentage itself
+            return self._sample(self.evaluate(op.right), op.sample_size,
+                                True, op.sample_type)
         sample_info = list(self.evaluate(op.left))
         assert len(sample_info) == 1
         sample_type = sample_info[0][3]
         sample_size = sample_info[0][2]
-        tuples = list(self.evaluate(op.right))
-        if sample_type == 'WR':
-            # Add unique index to make them appear like different tuples.
-            sample = [(i,) + random.choice(tuples) for i in range(sample_size)]
-        elif sample_type == 'WoR':
-            sample = random.sample(tuples, sample_size)
-        else:
-            raise ValueError("Invalid sample type")
-        return iter(sample)
+        return self._sample(self.evaluate(op.right), sample_size, False,
+                            sample_type)
+
+    def samplescan(self, op):
+        return self._sample(self.tables.scan(op.relation_key),
+                            op.sample_size, op.is_pct, op.sample_type)
 
     def filescan(self, op):
-        type_list = op.scheme().get_types()
-
-        with open(op.path, 'r') as fh:
-            if not op.options:
-                sample = fh.read(1024)
-                dialect = csv.Sniffer().sniff(sample)
-                fh.seek(0)
-                reader = csv.reader(fh, dialect)
-            else:
-                options = {
-                    'delimiter': ",",
-                    'quote': '"',
-                    'escape': None,
-                    'skip': 0}
-                options.update(op.options)
-                reader = csv.reader(
-                    fh,
-                    delimiter=options['delimiter'],
-                    quotechar=options['quote'],
-                    escapechar=options['escape'])
-                if options['skip']:
-                    for _ in xrange(options['skip']):
-                        next(fh)
-            for row in reader:
-                pairs = zip(row, type_list)
-                cols = [types.parse_string(s, t) for s, t in pairs]
-                yield tuple(cols)
+        if op.format == 'BINARY':
+            columns = self._needed_columns.pop(id(op), None)
+            if columns is None:
+                return columnfile.read_relation(op.path)
+            # Read only the attributes that are used; the others are None
+            width = len(op.scheme())
+
+            def widen(tpl):
+                full = [None] * width
+                for col, value in zip(columns, tpl):
+                    full[col] = value
+                return tuple(full)
+            return itertools.imap(
+                widen, columnfile.read_relation(op.path, columns))
+        return fastcsv.read_csv(op.path, op.scheme().get_types(), op.options)
+
+    def _evaluate_columns(self, op, columns):
+        """Evaluate op, of which the consumer only uses the attributes at
+        the given positions: a binary FileScan, or a Select over one, does
+        not read the others."""
+        scan = op
+        while isinstance(scan, algebra.Select):
+            scan = scan.input
+        if not (isinstance(scan, algebra.FileScan) and
+                scan.format == 'BINARY'):
+            return self.evaluate(op)
+        self._needed_columns[id(op)] = sorted(columns)
+        try:
+            return self.evaluate(op)
+        finally:
+            self._needed_columns.pop(id(op), None)
 
     def select(self, op):
-        child_it = self.evaluate(op.input)
+        columns = self._needed_columns.pop(id(op), None)
+        if columns is None:
+            child_it = self.evaluate(op.input)
+        else:
+            scheme = op.input.scheme()
+            child_it = self._evaluate_columns(op.input, set(columns).union(
+                ref.get_position(scheme) for ref in op.condition.walk()
+                if isinstance(ref, AttributeRef)))
 
-        def filter_func(_tuple):
-            # Note: this implicitly uses python truthiness rules for
-            # interpreting non-boolean expressions.
-            # TODO: Is this the the right semantics here?
-            return op.condition.evaluate(_tuple, op.scheme())
+        # Note: this implicitly uses python truthiness rules for
+        # interpreting non-boolean expressions.
+        # TODO: Is this the the right semantics here?
+        filter_func = compile_evaluator(op.condition, op.scheme())
 
         return itertools.ifilter(filter_func, child_it)
 
     def apply(self, op):
-        child_it = self.evaluate(op.input)
         scheme = op.input.scheme()
+        child_it = self._evaluate_columns(op.input, set(
+            ref.get_position(scheme) for _, colexpr in op.emitters
+            for ref in colexpr.walk() if isinstance(ref, AttributeRef)))
 
-        def make_tuple(input_tuple):
-            ls = [colexpr.evaluate(input_tuple, scheme)
-                  for (_, colexpr) in op.emitters]
-            return tuple(ls)
+        make_tuple = compile_tuple_evaluator(
+            [colexpr for (_, colexpr) in op.emitters], scheme)
         return (make_tuple(t) for t in child_it)
 
     def statefulapply(self, op):
@@ -206,46 +655,101 @@ class FakeDatabase(Catalog):
         scheme = op.input.scheme()
 
         state = State(scheme, op.state_scheme, op.inits)
+        updater = compile_tuple_evaluator(
+            [expr for (_, expr) in op.updaters], scheme, op.state_scheme)
+        emitter = compile_tuple_evaluator(
+            [colexpr for (_, colexpr) in op.emitters], scheme,
+            op.state_scheme)
 
         def make_tuple(input_tuple, state):
             # Update state variables
-            state.update(input_tuple, op.updaters)
+            state.update(input_tuple, updater)
 
             # Extract a result for each emit expression
-            return tuple([colexpr.evaluate(input_tuple, scheme, state)
-                          for (_, colexpr) in op.emitters])
+            return emitter(input_tuple, state)
 
         return (make_tuple(t, state) for t in child_it)
 
-    def join(self, op):
-        # Compute the cross product of the children and flatten
-        left_it = self.evaluate(op.left)
-        right_it = self.evaluate(op.right)
-        p1 = itertools.product(left_it, right_it)
-        p2 = (x + y for (x, y) in p1)
+    def join(self, op, columns=None):
+        """Join the children of op.
 
-        # Return tuples that match on the join conditions
-        return (tpl for tpl in p2 if op.condition.evaluate(tpl, op.scheme()))
+        :param columns: The positions of the attributes of the output that
+        are used, in addition to those of the condition; by default, all of
+        them
+        """
+        left_scheme = op.left.scheme()
+        combined_scheme = left_scheme + op.right.scheme()
+        left_cols, right_cols, residual = split_equijoin_condition(
+            op.condition, len(left_scheme), combined_scheme)
+
+        if columns is None:
+            columns = range(len(combined_scheme))
+        columns = set(columns)
+        columns.update(ref.get_position(combined_scheme)
+                       for ref in op.condition.walk()
+                       if isinstance(ref, AttributeRef))
+        width = len(left_scheme)
+        left_it = self._evaluate_columns(
+            op.left, [c for c in columns if c < width])
+        right_it = self._evaluate_columns(
+            op.right, [c - width for c in columns if c >= width])
+
+        if not left_cols:
+            # Cross products and theta joins: compute the cross product of
+            # the children, flatten, and filter on the join condition
+            p1 = itertools.product(left_it, right_it)
+            p2 = (x + y for (x, y) in p1)
+            return (tpl for tpl in p2
+                    if op.condition.evaluate(tpl, combined_scheme))
+
+        # Equijoin: build a hash table on the (estimated) smaller input and
+        # probe it with the other one.
+        build_left = (estimate_num_tuples(op.left) <
+                      estimate_num_tuples(op.right))
+        if build_left:
+            return self._hash_join(left_it, left_cols, right_it, right_cols,
+                                   residual, combined_scheme, False)
+        return self._hash_join(right_it, right_cols, left_it, left_cols,
+                               residual, combined_scheme, True)
+
+    def _hash_join(self, build_it, build_cols, probe_it, probe_cols,
+                   residual, combined_scheme, probe_is_left):
+        build_key = operator.itemgetter(*build_cols)
+        probe_key = operator.itemgetter(*probe_cols)
+
+        def probe(table, probe_it):
+            for probe_tpl in probe_it:
+                for build_tpl in table.get(probe_key(probe_tpl), ()):
+                    if probe_is_left:
+                        tpl = probe_tpl + build_tpl
+                    else:
+                        tpl = build_tpl + probe_tpl
+                    if residual is None or residual.evaluate(
+                            tpl, combined_scheme):
+                        yield tpl
+
+        return self.memory.hash_join(build_it, build_key, probe_it,
+                                     probe_key, probe)
 
     def projectingjoin(self, op):
         # standard join, projecting the output columns
-        return (tuple(t[x.position] for x in op.output_columns)
-                for t in self.join(op))
+        positions = [x.position for x in op.output_columns]
+        return (tuple(t[pos] for pos in positions)
+                for t in self.join(op, positions))
 
     def naryjoin(self, op):
-        def eval_conditions(conditions, tpl):
-            """Turns the weird NaryJoin condition set into a proper
-            expression, then evaluates it."""
-            cond = reduce(lambda a, b: AND(a, b),
-                          map(lambda (a, b): EQ(a, b), conditions))
-            return cond.evaluate(tpl, op.scheme())
-
-        # Elements of prod are tuples of tuples like ((1, 2), (3, 4))
-        prod = itertools.product(*(self.evaluate(child)
-                                   for child in op.children()))
-        # Elements of tuples have been flattened like (1, 2, 3, 4)
-        tuples = (sum(x, ()) for x in prod)
-        return (tpl for tpl in tuples if eval_conditions(op.conditions, tpl))
+        # Materialize the children, then intersect them variable by variable
+        child_schemes = [child.scheme() for child in op.children()]
+        relations = [list(self.evaluate(child)) for child in op.children()]
+
+        # Map each global column position to (child index, local column)
+        rel_cols = [(i, j) for i, sch in enumerate(child_schemes)
+                    for j in range(len(sch))]
+        combined_scheme = reduce(operator.add, child_schemes)
+        join_vars = [[rel_cols[attr.get_position(combined_scheme)]
+                      for attr in cond]
+                     for cond in op.conditions]
+        return generic_join(relations, join_vars)
 
     def crossproduct(self, op):
         left_it = self.evaluate(op.left)
@@ -254,29 +758,38 @@ class FakeDatabase(Catalog):
         return (x + y for (x, y) in p1)
 
     def distinct(self, op):
-        it = self.evaluate(op.input)
-        s = set(it)
-        return iter(s)
+        return self.memory.distinct(self.evaluate(op.input))
 
     def project(self, op):
         if not op.columnlist:
             return self.distinct(op)
 
-        return set(tuple(t[x.position] for x in op.columnlist)
-                   for t in self.evaluate(op.input))
+        return self.memory.distinct(tuple(t[x.position] for x in op.columnlist)
+                                    for t in self.evaluate(op.input))
 
     def limit(self, op):
+        if isinstance(op.input, OrderBy) and op.input.sort_columns:
+            # Top-K: keep only the first op.count tuples in a bounded heap
+            # instead of sorting the whole input.
+            it = self.evaluate(op.input.input)
+            key, reverse = sort_key(op.input.sort_columns,
+                                    op.input.ascending)
+            top = heapq.nlargest if reverse else heapq.nsmallest
+            return iter(top(op.count, it, key=key))
+
         it = self.evaluate(op.input)
         return itertools.islice(it, op.count)
 
     def orderby(self, op):
         it = self.evaluate(op.input)
-        oList = reversed(zip(op.sort_columns, op.ascending))
-        sortedList = list(it)
-        for o in oList:
-            sortedList = sorted(
-                sortedList, key=lambda x: x[o[0]], reverse=not o[1])
-        return iter(sortedList)
+        if not op.sort_columns:
+            return iter(list(it))
+        key, reverse = sort_key(op.sort_columns, op.ascending)
+        if reverse:
+            # A stable sort in descending order, as sorted(reverse=True)
+            ascending_key = key
+            key = lambda tpl: Descending(ascending_key(tpl))
+        return self.memory.sort(it, key)
 
     @staticmethod
     def singletonrelation(op):
@@ -287,74 +800,140 @@ class FakeDatabase(Catalog):
         return iter([])
 
     def union(self, op):
-        return set(self.evaluate(op.left)).union(set(self.evaluate(op.right)))
+        return self.memory.distinct(itertools.chain(self.evaluate(op.left),
+                                                    self.evaluate(op.right)))
 
     def unionall(self, op):
         return itertools.chain.from_iterable(
             self.evaluate(arg) for arg in op.args)
 
     def difference(self, op):
-        its = [self.evaluate(op.left), self.evaluate(op.right)]
-        sets = [set(it) for it in its]
-        return sets[0].difference(sets[1])
+        return self.memory.difference(self.evaluate(op.left),
+                                      self.evaluate(op.right))
 
     def intersection(self, op):
-        its = [self.evaluate(op.left), self.evaluate(op.right)]
-        sets = [set(it) for it in its]
-        return sets[0].intersection(sets[1])
+        return self.memory.intersection(self.evaluate(op.left),
+                                        self.evaluate(op.right))
 
     def groupby(self, op):
         child_it = self.evaluate(op.input)
         input_scheme = op.input.scheme()
 
-        def process_grouping_columns(_tuple):
-            ls = [sexpr.evaluate(_tuple, input_scheme) for
-                  sexpr in op.grouping_list]
-            return tuple(ls)
-
-        # Calculate groups of matching input tuples.
-        # If there are no grouping terms, then all tuples are added
-        # to a single bin.
-        results = collections.defaultdict(list)
-
-        if len(op.grouping_list) == 0:
-            results[()] = list(child_it)
-        else:
-            for input_tuple in child_it:
-                grouped_tuple = process_grouping_columns(input_tuple)
-                results[grouped_tuple].append(input_tuple)
+        process_grouping_columns = compile_tuple_evaluator(
+            op.grouping_list, input_scheme)
+        updater = compile_tuple_evaluator(
+            [expr for (_, expr) in op.updaters], input_scheme,
+            op.state_scheme)
+        uda_emitters = {
+            i: compile_evaluator(expr, None, op.state_scheme)
+            for i, expr in enumerate(op.aggregate_list)
+            if not isinstance(expr, BuiltinAggregateExpression)}
+        # Builtin aggregates are computed by accumulators over the values of
+        # their input (COUNTALL has none).
+        builtin_aggs = [
+            (i, expr, compile_evaluator(expr.input, input_scheme)
+             if hasattr(expr, 'input') else lambda _tuple: None)
+            for i, expr in enumerate(op.aggregate_list)
+            if isinstance(expr, BuiltinAggregateExpression)]
+
+        def new_group():
+            return (State(input_scheme, op.state_scheme, op.inits),
+                    [expr.accumulator() for _, expr, _ in builtin_aggs])
+
+        def update(group, input_tuple):
+            state, accumulators = group
+            state.update(input_tuple, updater)
+            for acc, (_, _, input_func) in zip(accumulators, builtin_aggs):
+                acc.add(input_func(input_tuple))
+
+        # Keep one state and one set of accumulators per group, updated as
+        # the input tuples stream by. If there are no grouping terms, then
+        # there is a single group, even if the input is empty.
+        initial_keys = [()] if len(op.grouping_list) == 0 else []
+        groups = self.memory.aggregate(child_it, process_grouping_columns,
+                                       new_group, update, initial_keys)
 
         # resolve aggregate functions
-        for key, tuples in results.iteritems():
-            state = State(input_scheme, op.state_scheme, op.inits)
-            for tpl in tuples:
-                state.update(tpl, op.updaters)
-
-            # For now, built-in aggregates are handled differently than UDA
-            # aggregates.  TODO: clean this up!
-
-            agg_fields = []
-            for expr in op.aggregate_list:
-                if isinstance(expr, BuiltinAggregateExpression):
-                    # Old-style aggregate: pass all tuples to the eval func
-                    agg_fields.append(
-                        expr.evaluate_aggregate(tuples, input_scheme))
-                else:
-                    # UDA-style aggregate: evaluate a normal expression that
-                    # can reference only the state tuple
-                    agg_fields.append(expr.evaluate(None, None, state))
+        for key, (state, accumulators) in groups:
+            agg_fields = [None] * len(op.aggregate_list)
+            for acc, (i, _, _) in zip(accumulators, builtin_aggs):
+                agg_fields[i] = acc.result()
+            for i, emitter in uda_emitters.iteritems():
+                # UDA-style aggregate: evaluate a normal expression that
+                # can reference only the state tuple
+                agg_fields[i] = emitter(None, state)
             yield(key + tuple(agg_fields))
 
     def sequence(self, op):
-        for child_op in op.children():
-            self.evaluate(child_op)
+        self._evaluate_statements(op.children())
         return None
 
     def parallel(self, op):
-        for child_op in op.children():
-            self.evaluate(child_op)
+        self._evaluate_statements(op.children())
         return None
 
+    def _evaluate_statements(self, statements):
+        # The profiler attributes time to one operator at a time
+        if self.parallelism is None or self.profiler is not None:
+            for statement in statements:
+                self.evaluate(statement)
+            return
+
+        for batch in statement_batches(statements):
+            queries = [s.input for s in batch if len(batch) > 1 and
+                       not self._is_cached(s.input)]
+            try:
+                if len(queries) > 1:
+                    for query, tuples in zip(queries,
+                                             self._map_queries(queries)):
+                        self._precomputed[id(query)] = tuples
+                for statement in batch:
+                    self.evaluate(statement)
+            finally:
+                self._precomputed.clear()
+
+    def _is_cached(self, op):
+        if self.result_cache is None or not resultcache.is_cacheable(op):
+            return False
+        key = self.result_cache.key(op, self._input_versions(op))
+        return self.result_cache.contains(key)
+
+    def _map_queries(self, queries):
+        """Evaluate queries concurrently into lists of tuples."""
+        if self._statement_pool is None:
+            if self.parallel_processes:
+                self._statement_pool = multiprocessing.Pool(self.parallelism)
+            else:
+                self._statement_pool = ThreadPool(self.parallelism)
+        if not self.parallel_processes:
+            return self._statement_pool.map(
+                lambda query: list(self.evaluate(query)), queries)
+
+        try:
+            pickle.dumps(queries, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError):
+            # e.g., Python UDFs: evaluate the queries in this process
+            return [list(self.evaluate(query)) for query in queries]
+        return self._statement_pool.map(
+            evaluate_remote, [self._remote_task(q) for q in queries])
+
+    def _remote_task(self, query):
+        """The task of evaluate_remote for a query: the query, and the
+        relations that it reads, and the registered functions."""
+        tables = {}
+        temp_tables = {}
+        for node in query.walk():
+            if isinstance(node, RELATION_READERS):
+                tables[node.relation_key] = (
+                    self.tables.get_scheme(node.relation_key),
+                    list(self.tables.scan(node.relation_key)))
+            elif isinstance(node, algebra.ScanTemp):
+                temp_tables[node.name] = (
+                    node.scheme(), list(self.temp_tables.scan(node.name)))
+        return (query, tables, temp_tables,
+                self.tables.registered_functions(), self.memory.budget,
+                self.memory.directory)
+
     def dowhile(self, op):
         i = 0
 
@@ -392,21 +971,79 @@ class FakeDatabase(Catalog):
             except IndexError:
                 break
 
+    def untilconvergence(self, op):
+        """Compute the IDB relations of a do/until convergence loop by
+        semi-naive evaluation; see raco.seminaive."""
+        controllers = [seminaive.find_idb_controller(child)
+                       for child in op.children()]
+        controllers = [c for c in controllers if c is not None]
+        states = [seminaive.IDBState(c) for c in controllers]
+        self.iteration_stats = []
+
+        start = time.time()
+        deltas = [state.update(self.evaluate(c.children()[0]))
+                  for c, state in zip(controllers, states)]
+        olds = [[] for _ in states]
+        iteration = 0
+        plans = [seminaive.semi_naive_plans(c.children()[1])
+                 for c in controllers]
+        while True:
+            for state, old, delta in zip(states, olds, deltas):
+                self._set_temp_table(seminaive.old_name(state.name),
+                                     state.scheme, old)
+                self._set_temp_table(seminaive.delta_name(state.name),
+                                     state.scheme, delta)
+                self._set_temp_table(state.name, state.scheme, state.tuples())
+            self.iteration_stats.append(seminaive.IterationStats(
+                iteration, time.time() - start,
+                {state.name: len(delta)
+                 for state, delta in zip(states, deltas)}))
+            if not any(deltas):
+                break
+
+            # Derive the new tuples of every IDB from the same deltas, then
+            # add them to the IDB relations.
+            start = time.time()
+            iteration += 1
+            news = [list(itertools.chain.from_iterable(
+                self.evaluate(plan) for plan in c_plans))
+                for c_plans in plans]
+            olds = [list(state.tuples()) for state in states]
+            deltas = [state.update(new) for state, new in zip(states, news)]
+
+        for state, controller in zip(states, controllers):
+            self.delete_temp_table(seminaive.old_name(state.name))
+            self.delete_temp_table(seminaive.delta_name(state.name))
+            if controller.relation_key is not None:
+                self._set_table(controller.relation_key, state.scheme,
+                                state.tuples())
+
+    def scanidb(self, op):
+        return self.temp_tables.scan(op.name)
+
+    def _set_table(self, rel_key, scheme, tuples, version=None):
+        self.tables.add_table(rel_key, scheme, tuples)
+        self._versions[str(rel_key)] = version or self._new_version()
+        self._column_stats.pop(str(rel_key), None)
+
+    def _set_temp_table(self, name, scheme, tuples, version=None):
+        self.temp_tables.add_table(name, scheme, tuples)
+        self._temp_versions[name] = version or self._new_version()
+
     def debroadcast(self, op):
         return self.evaluate(op.input)
 
     def store(self, op):
         assert isinstance(op.relation_key, relation_key.RelationKey)
 
-        scheme = op.input.scheme()
-        self.tables.add_table(op.relation_key, scheme, self.evaluate(op.input))
+        tuples, version = self._evaluate_cached(op.input)
+        self._set_table(op.relation_key, op.input.scheme(), tuples, version)
         return None
 
     def sink(self, op):
-        scheme = op.input.scheme()
-        self.tables.add_table(
-            relation_key.RelationKey("OUTPUT"),
-            scheme, self.evaluate(op.input))
+        tuples, version = self._evaluate_cached(op.input)
+        self._set_table(relation_key.RelationKey("OUTPUT"), op.input.scheme(),
+                        tuples, version)
         return None
 
     def dump(self, op):
@@ -415,14 +1052,15 @@ class FakeDatabase(Catalog):
         return None
 
     def storetemp(self, op):
-        scheme = op.input.scheme()
-        self.temp_tables.add_table(op.name, scheme, self.evaluate(op.input))
+        tuples, version = self._evaluate_cached(op.input)
+        self._set_temp_table(op.name, op.input.scheme(), tuples, version)
 
     def appendtemp(self, op):
         self.temp_tables.append_table(op.name, self.evaluate(op.input))
+        self._temp_versions[op.name] = self._new_version()
 
     def scantemp(self, op):
-        return self.temp_tables.get_table(op.name).elements()
+        return self.temp_tables.scan(op.name)
 
     def myriascan(self, op):
         return self.scan(op)
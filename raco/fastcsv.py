@@ -0,0 +1,149 @@
+"""
+Load CSV files into typed tuples.
+
+The file is memory-mapped and each row is converted by a list of per-column
+conversion functions that is built once from the scheme. Large files are
+split at line boundaries into chunks that are parsed by a pool of worker
+processes. The dialect of files without explicit options is detected once
+per file and cached.
+"""
+
+import csv
+import mmap
+import multiprocessing
+import os
+
+from raco import types
+
+# Files larger than this are parsed in parallel, in chunks of this size
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+# The number of bytes that csv.Sniffer looks at to detect the dialect
+SNIFF_SIZE = 1024
+
+# Detected dialects, as csv.reader arguments, by (path, mtime, size)
+_dialects = {}
+
+
+def dialect_options(dialect):
+    """Convert a csv dialect into (picklable) csv.reader arguments."""
+    return {'delimiter': dialect.delimiter,
+            'quotechar': dialect.quotechar,
+            'escapechar': dialect.escapechar,
+            'doublequote': dialect.doublequote,
+            'skipinitialspace': dialect.skipinitialspace,
+            'quoting': dialect.quoting}
+
+
+def sniff_dialect(path, data):
+    """Detect the dialect of a file, whose contents are data."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    if key not in _dialects:
+        _dialects[key] = dialect_options(
+            csv.Sniffer().sniff(data[:SNIFF_SIZE]))
+    return _dialects[key]
+
+
+def reader_options(options):
+    """Convert the options of a FileScan into csv.reader arguments and the
+    number of lines to skip."""
+    opts = {
+        'delimiter': ",",
+        'quote': '"',
+        'escape': None,
+        'skip': 0}
+    opts.update(options)
+    return ({'delimiter': opts['delimiter'],
+             'quotechar': opts['quote'],
+             'escapechar': opts['escape']},
+            opts['skip'])
+
+
+def skip_lines(data, start, count):
+    """Return the offset of the line count lines after offset start."""
+    for _ in xrange(count):
+        end = data.find('\n', start)
+        if end == -1:
+            return len(data)
+        start = end + 1
+    return start
+
+
+def split_lines(data, start, chunk_size):
+    """Split data[start:] into [start, end) ranges of about chunk_size
+    bytes that end at line boundaries."""
+    ranges = []
+    while start < len(data):
+        end = data.find('\n', start + chunk_size)
+        end = len(data) if end == -1 else end + 1
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def parse_rows(lines, csv_options, type_list):
+    converters = [types.parse_function(t) for t in type_list]
+    for row in csv.reader(lines, **csv_options):
+        yield tuple(f(s) for f, s in zip(converters, row))
+
+
+def parse_chunk(task):
+    """Parse the rows in a byte range of a file, in a worker process."""
+    path, start, end, csv_options, type_list = task
+    with open(path, 'rb') as fh:
+        data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        lines = data[start:end].splitlines(True)
+    finally:
+        data.close()
+    return list(parse_rows(lines, csv_options, type_list))
+
+
+def read_csv(path, type_list, options=None, processes=None,
+             chunk_size=DEFAULT_CHUNK_SIZE):
+    """Iterate over the rows of a CSV file, as tuples of typed values.
+
+    :param path: The path of the file
+    :param type_list: The types of the columns
+    :param options: The options of the FileScan (delimiter, quote, escape
+    and skip); without options, the dialect is detected from the file
+    :param processes: The number of processes that parse large files, by
+    default the number of CPUs
+    :param chunk_size: The size of the chunks that the processes parse
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as fh:
+        data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if not options:
+            csv_options = sniff_dialect(path, data)
+            start = 0
+        else:
+            csv_options, skip = reader_options(options)
+            start = skip_lines(data, 0, skip)
+
+        # A quoted field may contain newlines, so files that use quotes are
+        # not split into chunks.
+        quote = csv_options['quotechar']
+        if (processes == 1 or len(data) - start <= chunk_size or
+                (quote and data.find(quote, start) != -1)):
+            data.seek(start)
+            for tpl in parse_rows(iter(data.readline, ''), csv_options,
+                                  type_list):
+                yield tpl
+            return
+
+        tasks = [(path, s, e, csv_options, type_list)
+                 for s, e in split_lines(data, start, chunk_size)]
+    finally:
+        data.close()
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for rows in pool.imap(parse_chunk, tasks):
+            for tpl in rows:
+                yield tpl
+    finally:
+        pool.terminate()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from raco import fastcsv, types
+
+
+class FastCSVTest(unittest.TestCase):
+
+    type_list = [types.LONG_TYPE, types.STRING_TYPE, types.DOUBLE_TYPE]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, contents):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as fh:
+            fh.write(contents)
+        return path
+
+    def test_sniffed_dialect(self):
+        path = self.write('a.csv', '1;a;1.5\n2;b;2.5\n')
+        rows = list(fastcsv.read_csv(path, self.type_list))
+        self.assertEquals(rows, [(1, 'a', 1.5), (2, 'b', 2.5)])
+
+        # The dialect is detected once per file
+        self.assertEquals(len([k for k in fastcsv._dialects
+                               if k[0] == os.path.abspath(path)]), 1)
+        self.assertEquals(list(fastcsv.read_csv(path, self.type_list)), rows)
+        self.assertEquals(len([k for k in fastcsv._dialects
+                               if k[0] == os.path.abspath(path)]), 1)
+
+    def test_options(self):
+        rows = list(fastcsv.read_csv(
+            'examples/load_options.csv',
+            [types.LONG_TYPE, types.STRING_TYPE, types.STRING_TYPE,
+             types.DOUBLE_TYPE],
+            {'delimiter': '|', 'quote': '~', 'escape': '%', 'skip': 2}))
+        self.assertEquals(rows, [(1, "foo", "abc|def", 1.0),
+                                 (2, "bar", "ghi|jkl", 2.0)])
+
+    def test_empty_file(self):
+        path = self.write('empty.csv', '')
+        self.assertEquals(list(fastcsv.read_csv(path, self.type_list)), [])
+
+    def test_chunks(self):
+        lines = ['{i},name{i},{i}.25\n'.format(i=i) for i in range(1000)]
+        path = self.write('big.csv', 'header\n' + ''.join(lines))
+        options = {'skip': 1}
+        expected = list(fastcsv.read_csv(path, self.type_list, options,
+                                         processes=1))
+        self.assertEquals(len(expected), 1000)
+        self.assertEquals(expected[999], (999, 'name999', 999.25))
+
+        ranges = fastcsv.split_lines(open(path).read(), 7, 100)
+        self.assertGreater(len(ranges), 1)
+        self.assertEquals(ranges[-1][1], os.path.getsize(path))
+
+        parallel = fastcsv.read_csv(path, self.type_list, options,
+                                    processes=2, chunk_size=100)
+        self.assertEquals(list(parallel), expected)
+
+    def test_quoted_newlines(self):
+        """Files with quotes are not split, since fields may span lines"""
+        path = self.write('quoted.csv', '1,"a\nb",1.0\n2,c,2.0\n' * 10)
+        rows = list(fastcsv.read_csv(path, self.type_list, {'skip': 0},
+                                     processes=2, chunk_size=4))
+        self.assertEquals(rows, [(1, 'a\nb', 1.0), (2, 'c', 2.0)] * 10)
@@ -0,0 +1,403 @@
+"""
+Order the joins of a plan by estimated cost.
+
+MyriaL builds a chain of cross products in the order of the FROM clause,
+and PushSelects turns them into joins in place. order_joins takes a
+cluster of joins and cross products, extracts its join graph (the inputs
+of the cluster are the relations, and the conjuncts of the join conditions
+connect them), and searches for a cheaper join tree:
+
+- by dynamic programming over the connected subsets of the relations,
+  with left-deep or bushy trees, for up to MAX_DP_RELATIONS relations;
+- greedily for larger clusters, adding at each step the relation that
+  yields the cheapest intermediate result.
+
+The cost of a plan is the number of tuples of its intermediate results,
+plus, when shuffles are counted, the number of tuples that the joins
+shuffle or broadcast: an input that is already hash-partitioned on its
+join columns, e.g., a relation partitioned on them in the catalog, is not
+shuffled. Cardinalities come from num_tuples of the inputs, which reads
+the catalog for scans; an equijoin selects 1/max(NDV) of the cross product
+of its inputs when the catalog has the statistics of its columns, and
+1/max(cardinality) otherwise.
+
+Relations that no join condition connects are joined last, by cross
+products. The new tree is wrapped in an Apply that restores the column
+order of the cluster, so that the operators above are not affected.
+"""
+
+import copy
+import itertools
+
+from raco import algebra
+from raco.algebra import DEFAULT_CARDINALITY
+from raco.expression import (AND, EQ, UnnamedAttributeRef, accessed_columns,
+                             extract_conjuncs, reindex_expr,
+                             to_unnamed_recursive, toUnnamed)
+
+# The largest clusters that are ordered by dynamic programming
+MAX_DP_RELATIONS = 12
+
+# The selectivity of a conjunct that is not an equijoin
+DEFAULT_SELECTIVITY = 0.5
+
+
+def is_join(op):
+    """Whether op belongs to a cluster of joins and cross products."""
+    return type(op) in (algebra.Join, algebra.CrossProduct)
+
+
+def cardinality(op):
+    try:
+        return max(op.num_tuples(), 1)
+    except NotImplementedError:
+        return DEFAULT_CARDINALITY
+
+
+class Plan(object):
+    """A join tree over a subset of the relations of a JoinGraph.
+
+    :param tree: A relation index, or a (left, right) pair of Plans
+    """
+
+    def __init__(self, tree, mask, cost, card, partitions):
+        self.tree = tree
+        self.mask = mask
+        self.cost = cost
+        self.card = card
+        # The sets of (global) columns on which the tuples are hash
+        # partitioned, or None if they are broadcast
+        self.partitions = partitions
+
+
+class JoinGraph(object):
+    """The relations and conjuncts of a cluster of joins.
+
+    The columns of the cluster are numbered globally, in the order of the
+    output of the cluster; relations are numbered from left to right.
+    """
+
+    def __init__(self, root, shuffles=True):
+        self.root = root
+        self.shuffles = shuffles
+        self.relations = []
+        self.offsets = []
+        conjuncts = []
+        self.original = self._flatten(root, 0, conjuncts)
+        self.width = self.offsets[-1] + len(self.relations[-1].scheme())
+        self.relation_of = []
+        for i, rel in enumerate(self.relations):
+            self.relation_of.extend([i] * len(rel.scheme()))
+
+        self.all = (1 << len(self.relations)) - 1
+        self.cards = [cardinality(rel) for rel in self.relations]
+        self.stats = [s for rel in self.relations for s in rel.column_stats()]
+        # (conjunct, mask of its relations, equijoin columns or None)
+        self.conjuncts = []
+        self.neighbors = [0] * len(self.relations)
+        pair_selectivities = {}
+        other_selectivities = []
+        for conjunct in conjuncts:
+            columns = accessed_columns(conjunct)
+            mask = 0
+            for col in columns:
+                mask |= 1 << self.relation_of[col]
+            if bin(mask).count('1') < 2:
+                # Constants and single relation conditions are applied by
+                # the last join
+                mask = self.all
+            else:
+                for i in self._members(mask):
+                    self.neighbors[i] |= mask & ~(1 << i)
+            equi = self._equijoin_columns(conjunct)
+            self.conjuncts.append((conjunct, mask, equi))
+            if equi is not None:
+                a, b = [self.relation_of[col] for col in equi]
+                ndvs = [self.stats[col].ndv for col in equi
+                        if self.stats[col] is not None and
+                        self.stats[col].ndv]
+                sel = 1.0 / max(ndvs or [self.cards[a], self.cards[b]])
+                pair_selectivities[mask] = min(
+                    sel, pair_selectivities.get(mask, 1.0))
+            else:
+                other_selectivities.append((mask, DEFAULT_SELECTIVITY))
+        # Conjuncts on the same pair of relations are correlated, e.g., a
+        # composite key: only the most selective one counts
+        self.selectivities = pair_selectivities.items() + other_selectivities
+        self._cards = {}
+
+    def _flatten(self, op, offset, conjuncts):
+        """Collect the relations and conjuncts of the cluster rooted at op,
+        whose first column is the global column offset.
+
+        :returns: the tree of the cluster, as in Plan
+        """
+        if not is_join(op):
+            self.offsets.append(offset)
+            self.relations.append(op)
+            return len(self.relations) - 1
+
+        left = self._flatten(op.left, offset, conjuncts)
+        right = self._flatten(op.right, offset + len(op.left.scheme()),
+                              conjuncts)
+        if isinstance(op, algebra.Join) and op.condition is not None:
+            condition = to_unnamed_recursive(copy.deepcopy(op.condition),
+                                             op.scheme())
+            reindex_expr(condition, {col: col + offset
+                                     for col in accessed_columns(condition)})
+            conjuncts.extend(extract_conjuncs(condition))
+        return (left, right)
+
+    def _equijoin_columns(self, conjunct):
+        if (isinstance(conjunct, EQ) and
+                isinstance(conjunct.left, UnnamedAttributeRef) and
+                isinstance(conjunct.right, UnnamedAttributeRef)):
+            cols = (conjunct.left.position, conjunct.right.position)
+            if self.relation_of[cols[0]] != self.relation_of[cols[1]]:
+                return cols
+        return None
+
+    @staticmethod
+    def _members(mask):
+        i = 0
+        while mask:
+            if mask & 1:
+                yield i
+            mask >>= 1
+            i += 1
+
+    def card(self, mask):
+        """The estimated number of tuples of the join of the relations in
+        mask."""
+        if mask not in self._cards:
+            card = 1.0
+            for i in self._members(mask):
+                card *= self.cards[i]
+            for pred_mask, sel in self.selectivities:
+                if pred_mask & mask == pred_mask:
+                    card *= sel
+            self._cards[mask] = max(card, 1.0)
+        return self._cards[mask]
+
+    def _applicable(self, left_mask, right_mask):
+        """The conjuncts that are evaluated by the join of two subsets."""
+        mask = left_mask | right_mask
+        return [(conjunct, equi) for conjunct, m, equi in self.conjuncts
+                if m & mask == m and m & left_mask != m and
+                m & right_mask != m]
+
+    def leaf(self, i):
+        rel = self.relations[i]
+        try:
+            partitioning = rel.partitioning()
+        except NotImplementedError:
+            partitioning = None
+        partitions = frozenset()
+        if partitioning is not None and partitioning.broadcasted:
+            partitions = None
+        elif partitioning is not None and partitioning.hash_partitioned:
+            scheme = rel.scheme()
+            cols = frozenset(self.offsets[i] + toUnnamed(ref, scheme).position
+                             for ref in partitioning.hash_partitioned)
+            partitions = frozenset([cols])
+        return Plan(i, 1 << i, 0.0, self.cards[i], partitions)
+
+    def _shuffle_cost(self, plan, key):
+        if (not self.shuffles or plan.partitions is None or
+                key in plan.partitions):
+            return 0.0
+        return plan.card
+
+    def join(self, left, right):
+        """Join two plans over disjoint subsets."""
+        mask = left.mask | right.mask
+        card = self.card(mask)
+        equis = [equi for _, equi in self._applicable(left.mask, right.mask)
+                 if equi is not None]
+        if equis:
+            left_key = frozenset(col for equi in equis for col in equi
+                                 if left.mask >> self.relation_of[col] & 1)
+            right_key = frozenset(col for equi in equis for col in equi
+                                  if right.mask >> self.relation_of[col] & 1)
+            shuffled = (self._shuffle_cost(left, left_key) +
+                        self._shuffle_cost(right, right_key))
+            partitions = frozenset([left_key, right_key])
+        else:
+            # A cross product (or theta join) broadcasts its smaller input
+            shuffled = min(left.card, right.card) if self.shuffles else 0.0
+            partitions = left.partitions
+        cost = left.cost + right.cost + card + shuffled
+        return Plan((left, right), mask, cost, card, partitions)
+
+    def plan_of(self, tree):
+        """The Plan of a tree of relation indexes, e.g., the original tree
+        of the cluster."""
+        if isinstance(tree, int):
+            return self.leaf(tree)
+        return self.join(self.plan_of(tree[0]), self.plan_of(tree[1]))
+
+    def components(self):
+        """The masks of the connected components of the join graph."""
+        remaining = self.all
+        while remaining:
+            start = remaining & -remaining
+            component = start
+            frontier = start
+            while frontier:
+                i = next(self._members(frontier))
+                frontier &= ~(1 << i)
+                new = self.neighbors[i] & ~component
+                component |= new
+                frontier |= new
+            remaining &= ~component
+            yield component
+
+    def adjacent(self, mask):
+        adjacent = 0
+        for i in self._members(mask):
+            adjacent |= self.neighbors[i]
+        return adjacent & ~mask
+
+    def best_left_deep(self, component):
+        """Dynamic programming over left-deep trees of connected subsets."""
+        level = {1 << i: self.leaf(i) for i in self._members(component)}
+        for _ in range(bin(component).count('1') - 1):
+            next_level = {}
+            for mask, plan in level.iteritems():
+                for i in self._members(self.adjacent(mask) & component):
+                    candidate = self.join(plan, self.leaf(i))
+                    best = next_level.get(candidate.mask)
+                    if best is None or candidate.cost < best.cost:
+                        next_level[candidate.mask] = candidate
+            level = next_level
+        return level[component]
+
+    def best_bushy(self, component):
+        """Dynamic programming over bushy trees of connected subsets."""
+        best = {1 << i: self.leaf(i) for i in self._members(component)}
+        members = list(self._members(component))
+        for size in range(2, len(members) + 1):
+            for subset in itertools.combinations(members, size):
+                mask = sum(1 << i for i in subset)
+                # Enumerate the proper submasks of mask
+                left_mask = (mask - 1) & mask
+                while left_mask:
+                    right_mask = mask & ~left_mask
+                    left = best.get(left_mask)
+                    right = best.get(right_mask)
+                    if (left is not None and right is not None and
+                            self.adjacent(left_mask) & right_mask):
+                        candidate = self.join(left, right)
+                        current = best.get(mask)
+                        if current is None or candidate.cost < current.cost:
+                            best[mask] = candidate
+                    left_mask = (left_mask - 1) & mask
+        return best[component]
+
+    def greedy(self, component):
+        """Build a left-deep tree, adding at each step the relation that
+        makes the cheapest plan."""
+        members = list(self._members(component))
+        pairs = [self.join(self.leaf(i), self.leaf(j))
+                 for i, j in itertools.permutations(members, 2)
+                 if self.neighbors[i] >> j & 1]
+        plan = min(pairs, key=lambda p: p.cost)
+        while plan.mask != component:
+            plan = min((self.join(plan, self.leaf(i))
+                        for i in self._members(self.adjacent(plan.mask) &
+                                               component)),
+                       key=lambda p: p.cost)
+        return plan
+
+    def best(self, bushy=False):
+        """The cheapest plan that this search finds."""
+        plans = []
+        for component in self.components():
+            if bin(component).count('1') == 1:
+                plans.append(self.leaf(next(self._members(component))))
+            elif bin(component).count('1') > MAX_DP_RELATIONS:
+                plans.append(self.greedy(component))
+            elif bushy:
+                plans.append(self.best_bushy(component))
+            else:
+                plans.append(self.best_left_deep(component))
+        # The smallest plans come first, so that the intermediate results
+        # are the smallest
+        plans.sort(key=lambda p: p.card)
+        return reduce(self.join, plans)
+
+    def build(self, plan):
+        """Build the operators of a plan.
+
+        :returns: a tuple (op, relations), where relations lists the
+        relation indexes of the output of op, in order
+        """
+        if isinstance(plan.tree, int):
+            return self.relations[plan.tree], [plan.tree]
+        left, right = plan.tree
+        left_op, left_rels = self.build(left)
+        right_op, right_rels = self.build(right)
+        relations = left_rels + right_rels
+        index_map = self._index_map(relations)
+
+        conditions = []
+        for conjunct, _ in self._applicable(left.mask, right.mask):
+            conjunct = copy.deepcopy(conjunct)
+            reindex_expr(conjunct, index_map)
+            conditions.append(conjunct)
+        if conditions:
+            op = algebra.Join(reduce(AND, conditions), left_op, right_op)
+        else:
+            op = algebra.CrossProduct(left_op, right_op)
+        return op, relations
+
+    def _index_map(self, relations):
+        """Map the global columns of relations to their positions in the
+        concatenation of the relations."""
+        index_map = {}
+        position = 0
+        for i in relations:
+            for col in range(len(self.relations[i].scheme())):
+                index_map[self.offsets[i] + col] = position
+                position += 1
+        return index_map
+
+
+def cluster(op):
+    """The joins and cross products of the cluster rooted at op."""
+    if is_join(op):
+        yield op
+        for child in (op.left, op.right):
+            for join in cluster(child):
+                yield join
+
+
+def order_joins(op, bushy=False, shuffles=True, ordered=None):
+    """Reorder the cluster of joins rooted at op, if that is estimated to be
+    cheaper.
+
+    :param bushy: Consider bushy trees rather than left-deep trees only
+    :param shuffles: Count the tuples shuffled and broadcast by the joins
+    :param ordered: If given, a dictionary to which the joins of the
+    resulting cluster are added by id, so that its subclusters need not be
+    ordered again
+    :returns: op, or an equivalent plan
+    """
+    graph = JoinGraph(op, shuffles)
+    best = graph.best(bushy)
+    if best.cost >= graph.plan_of(graph.original).cost:
+        new_op = op
+    else:
+        new_op, relations = graph.build(best)
+    if ordered is not None:
+        ordered.update((id(join), join) for join in cluster(new_op))
+    if new_op is op:
+        return op
+
+    index_map = graph._index_map(relations)
+    if all(index_map[col] == col for col in range(graph.width)):
+        return new_op
+    scheme = op.scheme()
+    emitters = [(scheme.getName(col), UnnamedAttributeRef(index_map[col]))
+                for col in range(graph.width)]
+    return algebra.Apply(emitters, new_op)
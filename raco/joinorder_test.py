@@ -0,0 +1,153 @@
+import collections
+import unittest
+
+from raco import joinorder, memo, rules, types
+from raco.algebra import Apply, CrossProduct, Join, Scan
+from raco.compile import RuleProfiler, optimize_by_rules
+from raco.expression import AND, EQ, UnnamedAttributeRef
+from raco.fakedb import FakeDatabase
+from raco.relation_key import RelationKey
+from raco.representation import RepresentationProperties
+from raco.scheme import Scheme
+
+
+def eq(a, b):
+    return EQ(UnnamedAttributeRef(a), UnnamedAttributeRef(b))
+
+
+class JoinOrderTest(unittest.TestCase):
+    """Chains R0(a, b) - R1(a, b) - ... joined on Ri.b = Ri+1.a"""
+
+    def setUp(self):
+        self.db = FakeDatabase()
+
+    def relation(self, i, size=5, partitioning=RepresentationProperties()):
+        scheme = Scheme([('a{i}'.format(i=i), types.LONG_TYPE),
+                         ('b{i}'.format(i=i), types.LONG_TYPE)])
+        key = RelationKey.from_string('public:adhoc:R{i}'.format(i=i))
+        contents = collections.Counter((j, j) for j in range(size))
+        self.db.ingest(key, contents, scheme, partitioning)
+        return Scan(key, scheme, size, partitioning)
+
+    def chain(self, order, sizes=None):
+        """Join the relations of a chain in the given order, as MyriaL
+        would: a left-deep tree, with each condition at the lowest join
+        that has the columns of both of its relations."""
+        sizes = sizes or {}
+        scans = {i: self.relation(i, sizes.get(i, 5)) for i in order}
+        plan = scans[order[0]]
+        columns = {order[0]: 0}
+        for i in order[1:]:
+            columns[i] = len(plan.scheme())
+            conditions = [eq(columns[j] + 1, columns[i]) for j in columns
+                          if j == i - 1]
+            conditions += [eq(columns[i] + 1, columns[j]) for j in columns
+                           if j == i + 1]
+            if conditions:
+                plan = Join(reduce(AND, conditions), plan, scans[i])
+            else:
+                plan = CrossProduct(plan, scans[i])
+        return plan
+
+    def check(self, plan, new_plan):
+        self.assertEquals(new_plan.scheme(), plan.scheme())
+        self.assertEquals(
+            collections.Counter(self.db.evaluate(new_plan)),
+            collections.Counter(self.db.evaluate(plan)))
+
+    def count(self, op, cls):
+        return sum(1 for o in op.walk() if type(o) is cls)
+
+    def test_cross_product_first(self):
+        plan = self.chain([0, 2, 1], sizes={0: 50, 1: 5, 2: 50})
+        self.assertEquals(self.count(plan, CrossProduct), 1)
+        new_plan = joinorder.order_joins(plan)
+        self.assertIsInstance(new_plan, Apply)
+        self.assertEquals(self.count(new_plan, CrossProduct), 0)
+        self.check(plan, new_plan)
+
+    def test_good_order(self):
+        plan = self.chain([0, 1, 2])
+        self.assertIs(joinorder.order_joins(plan), plan)
+        # The rule does not order the subclusters of an ordered cluster
+        rule = rules.OrderJoins()
+        self.assertIs(rule.fire(plan), plan)
+        self.assertIs(rule.fire(plan.left), plan.left)
+        self.assertEquals(rule._ordered, {})
+
+    def test_optimize_twice(self):
+        """Ordering the joins does not modify the plan, so that it can be
+        optimized again."""
+        plan = self.chain([0, 2, 1, 3])
+        text = repr(plan)
+        for _ in range(2):
+            profiler = RuleProfiler()
+            new_plan = optimize_by_rules(plan, [rules.OrderJoins()],
+                                         profiler)
+            self.assertIsNot(new_plan, plan)
+            self.assertEquals(self.count(new_plan, CrossProduct), 0)
+            self.check(plan, new_plan)
+            # Only the root of the cluster is rewritten
+            stats, = profiler.report().rules
+            self.assertEquals(stats.rewrites, 1)
+            self.assertEquals(repr(plan), text)
+
+        plan = self.chain([0, 1, 2])
+        profiler = RuleProfiler()
+        before = memo.epoch()
+        self.assertIs(optimize_by_rules(plan, [rules.OrderJoins()],
+                                        profiler), plan)
+        stats, = profiler.report().rules
+        self.assertEquals(stats.rewrites, 0)
+        self.assertIs(memo.epoch(), before)
+
+    def test_ten_way(self):
+        order = [0, 2, 4, 6, 8, 1, 3, 5, 7, 9]
+        plan = self.chain(order)
+        graph = joinorder.JoinGraph(plan)
+        best = graph.best()
+        self.assertLess(best.cost * 50, graph.plan_of(graph.original).cost)
+
+        new_plan = joinorder.order_joins(plan)
+        self.assertEquals(self.count(new_plan, CrossProduct), 0)
+        self.assertEquals(self.count(new_plan, Join), 9)
+        self.check(plan, new_plan)
+
+    def test_bushy(self):
+        plan = self.chain([0, 2, 4, 1, 3])
+        new_plan = joinorder.order_joins(plan, bushy=True)
+        self.assertEquals(self.count(new_plan, CrossProduct), 0)
+        self.check(plan, new_plan)
+
+    def test_greedy(self):
+        """Clusters larger than MAX_DP_RELATIONS are ordered greedily."""
+        n = joinorder.MAX_DP_RELATIONS + 2
+        order = range(0, n, 2) + range(1, n, 2)
+        plan = self.chain(order)
+        new_plan = joinorder.order_joins(plan)
+        self.assertEquals(self.count(new_plan, CrossProduct), 0)
+        # Each chain of Ri.b = Ri+1.a is one of 5 values
+        self.assertEquals(sorted(self.db.evaluate(new_plan)),
+                          [(j,) * 2 * n for j in range(5)])
+
+    def test_disconnected(self):
+        plan = CrossProduct(self.chain([0, 1]), self.relation(5, 2))
+        new_plan = joinorder.order_joins(plan)
+        self.check(plan, new_plan)
+
+    def test_partitioning(self):
+        """An input that is partitioned on its join column is not
+        shuffled."""
+        r1 = self.relation(1, partitioning=RepresentationProperties(
+            hash_partitioned=(UnnamedAttributeRef(1),)))
+        r0 = self.relation(0)
+        r2 = self.relation(2)
+        # R1.b = R2.a, and R1.a = R0.b
+        plan = Join(eq(0, 5), Join(eq(1, 2), r1, r2), r0)
+        graph = joinorder.JoinGraph(plan)
+        self.assertEquals(graph.leaf(0).partitions,
+                          frozenset([frozenset([1])]))
+        with_r2 = graph.join(graph.leaf(0), graph.leaf(1))
+        with_r0 = graph.join(graph.leaf(0), graph.leaf(2))
+        self.assertEquals(with_r0.cost - with_r2.cost, graph.cards[0])
+        self.assertIs(joinorder.order_joins(plan), plan)
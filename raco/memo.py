@@ -0,0 +1,93 @@
+"""
+Memoize the derived properties of operators, e.g., their schemes.
+
+The scheme, cardinality, partitioning and column statistics of an operator
+are computed recursively from its children, and rules ask for them at every
+node of a plan. An operator remembers them until the next epoch, which
+starts whenever a plan or an expression changes: an attribute of an
+operator or an expression is reassigned to another value, an attribute is
+added to an operator that has memoized properties, or a list attribute of
+an operator (e.g., the children of an NaryOperator) is modified in place.
+Constructing new operators and expressions does not start an epoch.
+
+Starting a new epoch forgets the properties of all operators, not only
+those above the change: operators do not know their parents.
+"""
+
+import functools
+
+# Set to False to recompute the properties at every call
+enabled = True
+
+# The current epoch; memoized values are valid while it is the same object
+_epoch = [object()]
+
+
+def new_epoch():
+    """Forget the memoized properties of all operators."""
+    _epoch[0] = object()
+
+
+def epoch():
+    """The current epoch: the same object as long as no plan or expression
+    has changed."""
+    return _epoch[0]
+
+
+def same(old, new):
+    """Whether assigning new in place of old changes nothing: they are the
+    same object, or lists of the same objects."""
+    if old is new:
+        return True
+    return (isinstance(old, list) and isinstance(new, list) and
+            len(old) == len(new) and all(a is b for a, b in zip(old, new)))
+
+
+def memoized(method):
+    """Memoize a method without arguments until the next epoch."""
+    @functools.wraps(method)
+    def wrapper(self):
+        if not enabled:
+            return method(self)
+        epoch = _epoch[0]
+        memo = self.__dict__.get('_memo')
+        if memo is None or memo[0] is not epoch:
+            memo = self.__dict__['_memo'] = (epoch, {})
+        values = memo[1]
+        if method not in values:
+            # A property that changes the plan while it is computed is
+            # stored in the memo of a past epoch, and is forgotten
+            values[method] = method(self)
+        return values[method]
+    return wrapper
+
+
+def _modifies(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        new_epoch()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+class ObservedList(list):
+    """A list that starts a new epoch when it is modified."""
+
+    __setitem__ = _modifies('__setitem__')
+    __delitem__ = _modifies('__delitem__')
+    __setslice__ = _modifies('__setslice__')
+    __delslice__ = _modifies('__delslice__')
+    __iadd__ = _modifies('__iadd__')
+    __imul__ = _modifies('__imul__')
+    append = _modifies('append')
+    extend = _modifies('extend')
+    insert = _modifies('insert')
+    pop = _modifies('pop')
+    remove = _modifies('remove')
+    reverse = _modifies('reverse')
+    sort = _modifies('sort')
+
+    def __reduce__(self):
+        return ObservedList, (list(self),)
@@ -0,0 +1,67 @@
+import copy
+import pickle
+import unittest
+
+from raco import memo, types
+from raco.algebra import Apply, Scan, Select, UnionAll
+from raco.expression import EQ, NumericLiteral, UnnamedAttributeRef
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+from raco.statistics import ColumnStats
+
+
+class MemoTest(unittest.TestCase):
+
+    def setUp(self):
+        key = RelationKey.from_string('public:adhoc:R')
+        self.scheme = Scheme([('a', types.LONG_TYPE),
+                              ('b', types.LONG_TYPE)])
+        self.scan = Scan(key, self.scheme, 100)
+        self.apply = Apply([('x', UnnamedAttributeRef(0))], self.scan)
+
+    def tearDown(self):
+        memo.enabled = True
+
+    def test_hit(self):
+        self.assertIs(self.apply.scheme(), self.apply.scheme())
+        self.assertEquals(self.apply.num_tuples(), 100)
+        self.assertIs(self.apply.column_stats(), self.apply.column_stats())
+
+    def test_assignment(self):
+        scheme = self.apply.scheme()
+        self.apply.emitters = [('y', UnnamedAttributeRef(1))]
+        self.assertEquals(self.apply.scheme().get_names(), ['y'])
+        self.assertIsNot(self.apply.scheme(), scheme)
+
+    def test_list_mutation(self):
+        self.assertEquals(self.apply.scheme().get_names(), ['x'])
+        self.apply.emitters[0] = ('z', UnnamedAttributeRef(1))
+        self.assertEquals(self.apply.scheme().get_names(), ['z'])
+        self.apply.emitters.append(('w', UnnamedAttributeRef(0)))
+        self.assertEquals(self.apply.scheme().get_names(), ['z', 'w'])
+
+    def test_child_change(self):
+        union = UnionAll([self.scan, self.scan])
+        self.assertEquals(union.num_tuples(), 200)
+        self.scan._cardinality = 5
+        self.assertEquals(union.num_tuples(), 10)
+
+    def test_expression_change(self):
+        self.scan._column_stats = [None, ColumnStats(ndv=4, min=0, max=3)]
+        condition = EQ(UnnamedAttributeRef(1), NumericLiteral(3))
+        select = Select(condition, self.scan)
+        self.assertEquals(select.num_tuples(), 25)
+        condition.right = NumericLiteral(10)
+        self.assertEquals(select.num_tuples(), 0)
+
+    def test_copies(self):
+        self.apply.scheme()
+        self.assertNotIn('_memo', copy.deepcopy(self.apply).__dict__)
+        self.assertNotIn('_memo', pickle.loads(
+            pickle.dumps(self.apply)).__dict__)
+        self.assertIsInstance(copy.deepcopy(self.apply).emitters,
+                              memo.ObservedList)
+
+    def test_disabled(self):
+        memo.enabled = False
+        self.assertIsNot(self.apply.scheme(), self.apply.scheme())
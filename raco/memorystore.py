@@ -0,0 +1,93 @@
+"""Store relations in memory as python lists of tuples.
+
+The MemoryStore has the same interface as raco.dbconn.DBConnection, but does
+not translate tuples to and from a SQL database: storing a relation appends
+its tuples to a list, and scanning it iterates over that list. Only SQL
+queries (for MyriaQueryScan) go through a temporary sqlite database.
+"""
+
+import collections
+
+from raco.dbconn import DBConnection
+from raco.scheme import Scheme
+import raco.types as types
+
+
+class MemoryStore(object):
+
+    functions_schema = Scheme([("name", types.STRING_TYPE),
+                               ("description", types.STRING_TYPE),
+                               ("outputType", types.STRING_TYPE),
+                               ("lang", types.INT_TYPE),
+                               ("binary", types.BLOB_TYPE)])
+
+    def __init__(self):
+        # Relations, as (scheme, list of tuples), identified by str(rel_key)
+        self.relations = {}
+        self.functions = {}
+
+    def get_scheme(self, rel_key):
+        """Return the schema associated with a relation key."""
+        return self.relations[str(rel_key)][0]
+
+    def add_table(self, rel_key, schema, tuples=None):
+        """Add a table to the database, replacing any existing table."""
+        self.relations[str(rel_key)] = (schema, list(tuples or []))
+
+    def append_table(self, rel_key, tuples):
+        """Append tuples to an existing relation."""
+        contents = self.relations[str(rel_key)][1]
+        # Materialize the new tuples first: they may be computed from a scan
+        # of this relation.
+        contents.extend(list(tuples))
+
+    def num_tuples(self, rel_key):
+        """Return number of tuples of rel_key """
+        return len(self.relations[str(rel_key)][1])
+
+    def scan(self, rel_key):
+        """Iterate over the tuples of a table, without copying them."""
+        return iter(self.relations[str(rel_key)][1])
+
+    def get_table(self, rel_key):
+        """Retrieve the contents of a table as a bag (Counter)."""
+        return collections.Counter(self.relations[str(rel_key)][1])
+
+    def delete_table(self, rel_key, ignore_failure=False):
+        """Delete a table from the database."""
+        try:
+            del self.relations[str(rel_key)]
+        except KeyError:
+            if not ignore_failure:
+                raise
+
+    def iteritems(self):
+        """Iterate over (relation name, bag) pairs."""
+        for key, (_, contents) in self.relations.iteritems():
+            yield key, collections.Counter(contents)
+
+    def get_sql_output(self, sql):
+        """Retrieve the result of a query as a bag (Counter).
+
+        The query runs over a copy of the relations in a temporary sqlite
+        database.
+        """
+        conn = DBConnection()
+        for key, (schema, contents) in self.relations.iteritems():
+            conn.add_table(key, schema, contents)
+        return conn.get_sql_output(sql)
+
+    def get_function(self, name):
+        """Retrieve a function from catalog."""
+        return self.functions[str(name)]
+
+    def register_function(self, tup):
+        """Register a function in the catalog."""
+        func = dict(zip(self.functions_schema.get_names(), tup))
+        self.functions[str(func['name'])] = func
+
+    def registered_functions(self):
+        """Return the registered functions, as tuples of functions_schema."""
+        names = self.functions_schema.get_names()
+        return [tuple(func[n] for n in names)
+                for func in self.functions.itervalues()]
@@ -0,0 +1,64 @@
+import collections
+import unittest
+
+import raco.fakedb
+from raco.algebra import Scan, Store, StoreTemp, ScanTemp, AppendTemp
+from raco.dbconn import DBConnection
+from raco.fake_data import FakeData
+from raco.memorystore import MemoryStore
+from raco.relation_key import RelationKey
+
+
+class MemoryStoreTest(unittest.TestCase, FakeData):
+
+    def setUp(self):
+        self.store = MemoryStore()
+        self.store.add_table("emp", FakeData.emp_schema,
+                             FakeData.emp_table.elements())
+
+    def test_scan(self):
+        self.assertEquals(collections.Counter(self.store.scan('emp')),
+                          FakeData.emp_table)
+        self.assertEquals(self.store.get_table('emp'), FakeData.emp_table)
+        self.assertEquals(self.store.get_scheme('emp'), FakeData.emp_schema)
+        self.assertEquals(self.store.num_tuples('emp'),
+                          len(FakeData.emp_table))
+
+    def test_append_from_scan(self):
+        """Appending the scan of a relation to itself doubles it"""
+        self.store.append_table('emp', self.store.scan('emp'))
+        self.assertEquals(self.store.get_table('emp'),
+                          FakeData.emp_table + FakeData.emp_table)
+
+    def test_replace_during_scan(self):
+        """A scan sees the relation as of when it started"""
+        it = self.store.scan('emp')
+        self.store.add_table('emp', FakeData.emp_schema, [])
+        self.assertEquals(collections.Counter(it), FakeData.emp_table)
+        self.assertEquals(self.store.num_tuples('emp'), 0)
+
+    def test_key_error(self):
+        with self.assertRaises(KeyError):
+            self.store.scan('dept')
+        self.store.delete_table('emp')
+        with self.assertRaises(KeyError):
+            self.store.get_scheme('emp')
+        self.store.delete_table('emp', ignore_failure=True)
+
+    def test_sql_output(self):
+        out = self.store.get_sql_output('SELECT id FROM emp WHERE id < 3')
+        self.assertEquals(out, collections.Counter([(1,), (2,)]))
+
+    def test_fakedb_stores(self):
+        key = RelationKey.from_string("public:adhoc:emp")
+        for db in (raco.fakedb.FakeDatabase(),
+                   raco.fakedb.FakeDatabase(connection_string='sqlite://')):
+            db.ingest(key, FakeData.emp_table, FakeData.emp_schema)
+            scan = Scan(key, FakeData.emp_schema)
+            db.evaluate(StoreTemp('t', scan))
+            db.evaluate(AppendTemp('t', ScanTemp('t', FakeData.emp_schema)))
+            db.evaluate(Store(RelationKey.from_string("public:adhoc:out"),
+                              ScanTemp('t', FakeData.emp_schema)))
+            self.assertEquals(db.get_table("public:adhoc:out"),
+                              FakeData.emp_table + FakeData.emp_table)
+        self.assertIsInstance(db.tables, DBConnection)
@@ -0,0 +1,13 @@
+from nose.plugins.skip import SkipTest
+
+import raco.columnardb
+from raco.myrial import query_tests
+
+
+class TestColumnarQueryFunctions(query_tests.TestQueryFunctions):
+    """Run the MyriaL query tests against the ColumnarDatabase"""
+
+    def create_db(self):
+        if raco.columnardb.np is None:
+            raise SkipTest("numpy is not installed")
+        return raco.columnardb.ColumnarDatabase()
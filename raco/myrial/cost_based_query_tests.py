@@ -0,0 +1,23 @@
+from nose.plugins.skip import SkipTest
+
+import raco.partitioneddb
+from raco.myrial import query_tests
+
+
+class TestCostBasedQueryFunctions(query_tests.TestQueryFunctions):
+    """Run the MyriaL query tests on several simulated workers, with the
+    plans chosen by the cost-based search (see raco.cascades)"""
+
+    def create_db(self):
+        return raco.partitioneddb.PartitionedDatabase(num_workers=3)
+
+    def get_plan(self, query, **kwargs):
+        kwargs.setdefault('cost_based', True)
+        return super(TestCostBasedQueryFunctions, self).get_plan(
+            query, **kwargs)
+
+    def test_running_mean_sapply(self):
+        raise SkipTest("the state of a StatefulApply is local to a worker")
+
+    def test_sapply_multi_invocation(self):
+        raise SkipTest("the state of a StatefulApply is local to a worker")
@@ -6,9 +6,12 @@ from raco.myrial.exceptions import *
 import raco.algebra
 import raco.expression
 import raco.catalog
+import raco.columnfile
 import raco.scheme
+import raco.types
 from raco.backends.myria import (MyriaLeftDeepTreeAlgebra,
                                  MyriaHyperCubeAlgebra,
+                                 MyriaCostBasedAlgebra,
                                  compile_to_json)
 from raco.compile import optimize
 from raco import relation_key
@@ -99,6 +102,8 @@ class ExpressionProcessor(object):
         """Scan a database table."""
         assert isinstance(rel_key, relation_key.RelationKey)
         scheme = self._get_scan_scheme(rel_key)
+        # The statistics of the columns are read when the plan is built
+        # (see StatementProcessor.get_logical_plan)
         return raco.algebra.Scan(rel_key, scheme,
                                  self.catalog.num_tuples(rel_key),
                                  self.catalog.partitioning(rel_key))
@@ -114,6 +119,20 @@ class ExpressionProcessor(object):
                                        samp_type)
 
     def load(self, path, format, scheme, options):
+        if format == 'BINARY':
+            # Column files describe their own scheme
+            try:
+                stored = raco.columnfile.read_scheme(path)
+            except (IOError, ValueError) as e:
+                raise MyrialCompileException(
+                    "Cannot read the header of %s: %s" % (path, e))
+            declared = [raco.types.map_type(t) for t in scheme.get_types()]
+            if len(scheme) == 0:
+                scheme = stored
+            elif declared != stored.get_types():
+                raise MyrialCompileException(
+                    "The schema of %s does not match its header: %s" %
+                    (path, stored))
         return raco.algebra.FileScan(path, format, scheme, options)
 
     def table(self, emit_clause):
@@ -565,9 +584,33 @@ class StatementProcessor(object):
 
     def get_logical_plan(self, **kwargs):
         """Return an operator representing the logical query plan."""
-        return self.cfg.get_logical_plan(
+        plan = self.cfg.get_logical_plan(
             dead_code_elimination=kwargs.get('dead_code_elimination', True),
             apply_chaining=kwargs.get('apply_chaining', True))
+        self.__add_column_stats__(plan)
+        return plan
+
+    def __add_column_stats__(self, plan):
+        """Give the scans of plan the statistics of the columns of their
+        relations, reading those of each relation from the catalog once."""
+        stats = {}
+        visited = set()
+
+        def visit(op):
+            if id(op) in visited:
+                return
+            visited.add(id(op))
+            if (isinstance(op, raco.algebra.Scan) and
+                    op._column_stats is None):
+                key = op.relation_key
+                if key not in stats:
+                    stats[key] = self.catalog.column_stats(key)
+                if stats[key] is not None:
+                    op._column_stats = stats[key]
+            for child in op.children():
+                if child is not None:
+                    visit(child)
+        visit(plan)
 
     def __get_physical_plan_for__(self, target_phys_algebra, **kwargs):
         logical_plan = self.get_logical_plan(**kwargs)
@@ -579,7 +622,9 @@ class StatementProcessor(object):
         """Return an operator representing the physical query plan."""
         target_phys_algebra = kwargs.get('target_alg')
         if target_phys_algebra is None:
-            if kwargs.get('multiway_join', False):
+            if kwargs.get('cost_based', False):
+                target_phys_algebra = MyriaCostBasedAlgebra(self.catalog)
+            elif kwargs.get('multiway_join', False):
                 target_phys_algebra = MyriaHyperCubeAlgebra(self.catalog)
             else:
                 target_phys_algebra = MyriaLeftDeepTreeAlgebra()
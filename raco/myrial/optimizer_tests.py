@@ -519,6 +519,35 @@ class OptimizerTest(myrial_test.MyrialTestCase):
         # compile to JSON. See https://github.com/uwescience/raco/issues/240
         pp = self.execute_query(query, output='OutputTemp')
 
+    def test_join_order(self):
+        """A join written after a cross product of unconnected relations is
+        evaluated first."""
+        query = """
+        x = scan({x});
+        y = scan({y});
+        z = scan({z});
+        out = [from x, z, y where x.a = y.d and y.e = z.src emit *];
+        store(out, OUTPUT);
+        """.format(x=self.x_key, y=self.y_key, z=self.z_key)
+
+        pp = self.get_physical_plan(query)
+        self.assertEquals(self.get_count(pp, CrossProduct), 0)
+        self.assertEquals(self.get_count(pp, Join), 2)
+
+        self.new_processor()
+        expected = collections.Counter(
+            x + z + y
+            for x in self.x_data.elements()
+            for z in self.z_data.elements()
+            for y in self.y_data.elements()
+            if x[0] == y[0] and y[1] == z[0])
+        self.check_result(query, expected)
+
+        # The rule can be disabled
+        self.new_processor()
+        pp = self.get_physical_plan(query, no_OrderJoins=True)
+        self.assertEquals(self.get_count(pp, CrossProduct), 1)
+
     def test_broadcast_cardinality_right(self):
         # x and y have the same cardinality, z is smaller
         query = """
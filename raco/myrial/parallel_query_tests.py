@@ -0,0 +1,10 @@
+import raco.fakedb
+from raco.myrial import query_tests
+
+
+class TestParallelQueryFunctions(query_tests.TestQueryFunctions):
+    """Run the MyriaL query tests with the queries of independent
+    statements evaluated concurrently"""
+
+    def create_db(self):
+        return raco.fakedb.FakeDatabase(parallelism=4)
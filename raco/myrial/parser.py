@@ -679,14 +679,20 @@ class Parser(object):
    schema_fun COMMA option_list RPAREN
  | CSV LPAREN schema_fun RPAREN
  | OPP LPAREN RPAREN
+ | ID LPAREN schema_fun RPAREN
+ | ID LPAREN RPAREN
  | TIPSY LPAREN implicit_tipsy_schema empty option_list RPAREN
  | TIPSY LPAREN implicit_tipsy_schema RPAREN"""
+        # binary is not reserved, so that it may name columns
+        format = p[1].upper()
+        if format not in ('CSV', 'OPP', 'TIPSY', 'BINARY'):
+            raise NoSuchFunctionException(p[1], p.lineno(1))
         if len(p) == 7:
-            format, schema, options = (p[1], p[3], dict(p[5]))
+            schema, options = (p[3], dict(p[5]))
         elif len(p) == 5:
-            format, schema, options = (p[1], p[3], {})
+            schema, options = (p[3], {})
         else:
-            format, schema, options = (p[1], [], {})
+            schema, options = ([], {})
         p[0] = (format, schema, options)
 
     @staticmethod
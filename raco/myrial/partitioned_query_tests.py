@@ -0,0 +1,17 @@
+from nose.plugins.skip import SkipTest
+
+import raco.partitioneddb
+from raco.myrial import query_tests
+
+
+class TestPartitionedQueryFunctions(query_tests.TestQueryFunctions):
+    """Run the MyriaL query tests on several simulated workers"""
+
+    def create_db(self):
+        return raco.partitioneddb.PartitionedDatabase(num_workers=3)
+
+    def test_running_mean_sapply(self):
+        raise SkipTest("the state of a StatefulApply is local to a worker")
+
+    def test_sapply_multi_invocation(self):
+        raise SkipTest("the state of a StatefulApply is local to a worker")
@@ -2596,6 +2596,20 @@ class TestQueryFunctions(myrial_test.MyrialTestCase, FakeData):
         with self.assertRaises(MyrialCompileException):
             self.check_result(";", None)
 
+    def test_binary_column_name(self):
+        """binary names a file format only in load, so it may name a
+        column."""
+        query = """
+        emp = SCAN(%s);
+        out = [FROM emp AS e EMIT e.id AS binary];
+        STORE(out, OUTPUT);
+        """ % self.emp_key
+
+        expected = collections.Counter(
+            [(x[0],) for x in self.emp_table.elements()])
+        self.check_result(query, expected,
+                          scheme=scheme.Scheme([('binary', LONG_TYPE)]))
+
     def test_case_binary(self):
         query = """
         emp = SCAN(%s);
@@ -2975,6 +2989,74 @@ class TestQueryFunctions(myrial_test.MyrialTestCase, FakeData):
         expected = collections.Counter([(32, 5)])
         self.check_result(query, expected, output="powersOfTwo")
 
+    def __emp_graph_fixpoint(self, init, step):
+        """Iterate step over the edges (id, dept_id) of the employees,
+        starting from init, until nothing changes."""
+        edges = [(e[0], e[1]) for e in self.emp_table]
+        result = init
+        while True:
+            new_result = step(result, edges)
+            if new_result == result:
+                return collections.Counter(result)
+            result = new_result
+
+    def __check_physical_result(self, query, expected):
+        """Like check_result, but for cyclic plans, which have no repr"""
+        self.new_processor()
+        self.parse(query)
+        self.db.evaluate(self.processor.get_physical_plan())
+        self.assertEquals(self.db.get_table('OUTPUT'), expected)
+
+    def test_until_convergence_min(self):
+        """Propagate the minimum label along the edges"""
+        query = """
+        E = [FROM SCAN(%s) AS X EMIT id AS src, dept_id AS dst];
+        V = [FROM E EMIT src AS x];
+        DO
+            CC = [nid, MIN(cid) AS cid] <-
+                 [FROM V EMIT x AS nid, x AS cid] +
+                 [FROM E, CC WHERE E.src = CC.nid EMIT E.dst AS nid, CC.cid];
+        UNTIL CONVERGENCE;
+        STORE(CC, OUTPUT);
+        """ % self.emp_key
+
+        def step(labels, edges):
+            new_labels = dict(labels)
+            for src, dst in edges:
+                if src in labels:
+                    new_labels[dst] = min(new_labels.get(dst, labels[src]),
+                                          labels[src])
+            return new_labels
+
+        labels = self.__emp_graph_fixpoint(
+            {e[0]: e[0] for e in self.emp_table}, step)
+        expected = collections.Counter(labels.items())
+        self.check_result(query, expected, test_logical=True)
+        self.assertEquals(self.db.iteration_stats[-1].deltas, {'CC': 0})
+        self.__check_physical_result(query, expected)
+
+    def test_until_convergence_transitive_closure(self):
+        """A recursive rule that reads its IDB relation twice"""
+        query = """
+        E = [FROM SCAN(%s) AS X EMIT id AS src, dept_id AS dst];
+        DO
+            TC = [a, b] <- [FROM E EMIT src AS a, dst AS b] +
+                 [FROM TC AS T1, TC AS T2 WHERE T1.b = T2.a
+                  EMIT T1.a, T2.b];
+        UNTIL CONVERGENCE;
+        STORE(TC, OUTPUT);
+        """ % self.emp_key
+
+        def step(pairs, edges):
+            return pairs | {(a, d) for a, b in pairs for c, d in pairs
+                            if b == c}
+
+        pairs = self.__emp_graph_fixpoint(
+            {(e[0], e[1]) for e in self.emp_table}, step)
+        self.check_result(query, collections.Counter(pairs),
+                          test_logical=True)
+        self.__check_physical_result(query, collections.Counter(pairs))
+
     def test_pyUDF_dotted_arguments(self):
         query = """
         T1=scan(%s);
@@ -55,3 +55,16 @@ class TestSamplingOperations(myrial_test.MyrialTestCase, FakeData):
 
     def test_samplescan__wor_100_pct(self):
         self.run_samplescan(100, 'WoR', True)
+
+    def test_samplescan_logical(self):
+        query = """
+        emp = SAMPLESCAN({rel_key}, 2, WoR);
+        STORE(emp, OUTPUT);
+        """.format(rel_key=self.emp_key)
+        res = self.execute_query(query, test_logical=True)
+        self.assertEquals(len(res), 2)
+        self.assertTrue(set(res).issubset(self.emp_table))
+
+    def test_samplescan__wor_too_large(self):
+        with self.assertRaises(ValueError):
+            self.run_samplescan(len(self.emp_table) + 1, 'WoR')
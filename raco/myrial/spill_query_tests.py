@@ -0,0 +1,10 @@
+import raco.fakedb
+from raco.myrial import query_tests
+
+
+class TestSpillQueryFunctions(query_tests.TestQueryFunctions):
+    """Run the MyriaL query tests with a memory budget small enough that
+    the operators spill to disk"""
+
+    def create_db(self):
+        return raco.fakedb.FakeDatabase(memory_budget=1024)
@@ -1,3 +1,4 @@
+import math
 import unittest
 
 import raco.fakedb
@@ -147,3 +148,141 @@ class OperatorTest(unittest.TestCase):
         pj = ProjectingJoin(condition=BooleanLiteral(True),
                             left=emp, right=emp1, output_columns=refs)
         self.assertEquals(emp.scheme().get_names(), pj.scheme().get_names())
+
+    def _nested_loop_join(self, condition):
+        """Reference result for a self-join of emp: cross product + filter"""
+        emp = list(TestQueryFunctions.emp_table.elements())
+        sch = TestQueryFunctions.emp_schema + TestQueryFunctions.emp_schema
+        return collections.Counter(
+            l + r for l in emp for r in emp
+            if condition.evaluate(l + r, sch))
+
+    def test_hash_equijoin(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        emp1 = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        cond = EQ(UnnamedAttributeRef(5), UnnamedAttributeRef(1))
+        join = Join(cond, emp, emp1)
+        self.assertEquals(self.db.evaluate_to_bag(join),
+                          self._nested_loop_join(cond))
+
+    def test_hash_equijoin_residual(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        emp1 = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema,
+                    cardinality=1)
+        cond = AND(AND(EQ(UnnamedAttributeRef(1), UnnamedAttributeRef(5)),
+                       LT(UnnamedAttributeRef(3), UnnamedAttributeRef(7))),
+                   EQ(UnnamedAttributeRef(7), UnnamedAttributeRef(3)))
+        join = Join(cond, emp, emp1)
+        self.assertEquals(self.db.evaluate_to_bag(join),
+                          self._nested_loop_join(cond))
+
+    def test_theta_join(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        emp1 = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        cond = GT(UnnamedAttributeRef(3), UnnamedAttributeRef(7))
+        join = Join(cond, emp, emp1)
+        self.assertEquals(self.db.evaluate_to_bag(join),
+                          self._nested_loop_join(cond))
+
+    def test_hash_projecting_join(self):
+        emp = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        emp1 = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        cond = EQ(UnnamedAttributeRef(1), UnnamedAttributeRef(4))
+        pj = ProjectingJoin(cond, emp, emp1,
+                            [UnnamedAttributeRef(2), UnnamedAttributeRef(6)])
+        expected = collections.Counter(
+            (t[2], t[6]) for t in self._nested_loop_join(cond).elements())
+        self.assertEquals(self.db.evaluate_to_bag(pj), expected)
+
+    def _ingest_edges(self):
+        edge_key = relation_key.RelationKey.from_string("public:adhoc:edges")
+        edge_schema = scheme.Scheme([("src", types.LONG_TYPE),
+                                     ("dst", types.LONG_TYPE)])
+        edges = collections.Counter(
+            [(1, 2), (2, 3), (3, 1), (1, 3), (3, 4), (4, 1), (2, 2), (1, 2)])
+        self.db.ingest(edge_key, edges, edge_schema)
+        return edge_key, edge_schema, edges
+
+    def test_triangle_nary_join(self):
+        edge_key, edge_schema, edges = self._ingest_edges()
+        scans = [Scan(edge_key, edge_schema) for _ in range(3)]
+        # R(x,y), S(y,z), T(z,x)
+        conditions = [[UnnamedAttributeRef(0), UnnamedAttributeRef(5)],
+                      [UnnamedAttributeRef(1), UnnamedAttributeRef(2)],
+                      [UnnamedAttributeRef(3), UnnamedAttributeRef(4)]]
+        join = NaryJoin(scans, conditions)
+
+        e = list(edges.elements())
+        expected = collections.Counter(
+            r + s + t for r in e for s in e for t in e
+            if r[0] == t[1] and r[1] == s[0] and s[1] == t[0])
+        self.assertEquals(self.db.evaluate_to_bag(join), expected)
+
+    def test_star_nary_join(self):
+        edge_key, edge_schema, edges = self._ingest_edges()
+        scans = [Scan(edge_key, edge_schema) for _ in range(3)]
+        # R(x,y), S(x,z), T(x,x): one variable bound by four columns
+        conditions = [[UnnamedAttributeRef(0), UnnamedAttributeRef(2),
+                       UnnamedAttributeRef(4), UnnamedAttributeRef(5)]]
+        join = NaryJoin(scans, conditions)
+
+        e = list(edges.elements())
+        expected = collections.Counter(
+            r + s + t for r in e for s in e for t in e
+            if r[0] == s[0] == t[0] == t[1])
+        self.assertEquals(self.db.evaluate_to_bag(join), expected)
+
+    def test_streaming_groupby(self):
+        scan = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        salary = NamedAttributeRef("salary")
+        gb = GroupBy([NamedAttributeRef("dept_id")],
+                     [COUNTALL(), SUM(salary), MIN(salary), MAX(salary),
+                      AVG(salary), STDEV(salary)], scan)
+        result = self.db.evaluate_to_bag(gb)
+
+        groups = collections.defaultdict(list)
+        for tpl in TestQueryFunctions.emp_table:
+            groups[tpl[1]].append(tpl[3])
+        self.assertEqual(len(result), len(groups))
+        for tpl in result:
+            salaries = groups[tpl[0]]
+            n = len(salaries)
+            mean = float(sum(salaries)) / n
+            stdev = math.sqrt(sum((s - mean) ** 2 for s in salaries) / n)
+            self.assertEqual(tpl[1:6], (n, sum(salaries), min(salaries),
+                                        max(salaries), sum(salaries) / n))
+            self.assertAlmostEqual(tpl[6], stdev if n > 1 else 0.0)
+
+    def test_groupby_empty_input(self):
+        """Without grouping terms, an empty input still produces a group"""
+        scan = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        empty = Select(EQ(NamedAttributeRef("id"), NumericLiteral(-1)), scan)
+        gb = GroupBy([], [COUNTALL(), COUNT(NamedAttributeRef("salary")),
+                          SUM(NamedAttributeRef("salary"))], empty)
+        self.assertEqual(list(self.db.evaluate(gb)), [(0, 0, 0)])
+
+        gb = GroupBy([NamedAttributeRef("dept_id")], [COUNTALL()], empty)
+        self.assertEqual(list(self.db.evaluate(gb)), [])
+
+    def test_orderby_mixed_directions(self):
+        scan = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        # salary descending, then name ascending
+        orderby = OrderBy(scan, sort_columns=[3, 2], ascending=[False, True])
+        expected = sorted(TestQueryFunctions.emp_table.elements(),
+                          key=lambda t: (-t[3], t[2]))
+        self.assertEqual(list(self.db.evaluate(orderby)), expected)
+
+        orderby = OrderBy(scan, sort_columns=[1, 3], ascending=[False, False])
+        expected = sorted(TestQueryFunctions.emp_table.elements(),
+                          key=lambda t: (-t[1], -t[3]))
+        self.assertEqual(list(self.db.evaluate(orderby)), expected)
+
+    def test_limit_orderby_top_k(self):
+        scan = Scan(TestQueryFunctions.emp_key, TestQueryFunctions.emp_schema)
+        for count in [0, 3, 100]:
+            for ascending in ([True, False], [False, False], [True, True]):
+                orderby = OrderBy(scan, sort_columns=[3, 0],
+                                  ascending=ascending)
+                expected = list(self.db.evaluate(orderby))[:count]
+                limit = Limit(count, orderby)
+                self.assertEqual(list(self.db.evaluate(limit)), expected)
@@ -0,0 +1,138 @@
+import collections
+import threading
+import unittest
+
+from raco import fakedb, types
+from raco.algebra import (Parallel, SampleScan, Scan, ScanTemp, Select,
+                          Sequence, Store, StoreTemp)
+from raco.expression import GT, NumericLiteral, UnnamedAttributeRef
+from raco.fakedb import FakeDatabase
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+
+
+class ThreadRecordingDatabase(FakeDatabase):
+    """A FakeDatabase that records the threads that evaluate selects."""
+
+    def __init__(self, *args, **kwargs):
+        super(ThreadRecordingDatabase, self).__init__(*args, **kwargs)
+        self.threads = set()
+
+    def select(self, op):
+        self.threads.add(threading.current_thread().name)
+        return super(ThreadRecordingDatabase, self).select(op)
+
+
+class ParallelStatementsTest(unittest.TestCase):
+
+    scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE)])
+    key = RelationKey.from_string('public:adhoc:R')
+    contents = collections.Counter([(i, i % 3) for i in range(30)])
+
+    def scan(self):
+        return Scan(self.key, self.scheme)
+
+    def select(self, value, child=None):
+        return Select(GT(UnnamedAttributeRef(0), NumericLiteral(value)),
+                      child or self.scan())
+
+    def output(self, name):
+        return RelationKey.from_string('public:adhoc:' + name)
+
+    def make_db(self, **kwargs):
+        db = ThreadRecordingDatabase(**kwargs)
+        db.ingest(self.key, self.contents, self.scheme)
+        return db
+
+    def test_batches(self):
+        a = StoreTemp('A', self.select(1))
+        b = StoreTemp('B', self.select(2))
+        c = Store(self.output('C'), ScanTemp('A', self.scheme))
+        d = Store(self.output('D'), self.select(3))
+        e = Sequence([d])
+        batches = list(fakedb.statement_batches([a, b, c, d, e, b]))
+        self.assertEquals(batches, [[a, b], [c, d], [e], [b]])
+
+    def check_outputs(self, db, count):
+        for i in range(count):
+            self.assertEquals(
+                db.get_table(self.output('O{i}'.format(i=i))),
+                collections.Counter(t for t in self.contents if t[0] > i))
+
+    def test_parallel(self):
+        plan = Parallel([Store(self.output('O{i}'.format(i=i)),
+                               self.select(i)) for i in range(5)])
+        db = self.make_db(parallelism=4)
+        db.evaluate(plan)
+        db.close()
+        self.check_outputs(db, 5)
+        self.assertNotIn(threading.current_thread().name, db.threads)
+        self.assertGreater(len(db.threads), 1)
+
+    def test_dependent_statements(self):
+        """A statement that reads the result of an earlier statement is
+        evaluated after it."""
+        plan = Sequence([
+            StoreTemp('A', self.select(10)),
+            Store(self.output('O0'), self.select(0)),
+            Store(self.output('B'),
+                  self.select(20, ScanTemp('A', self.scheme))),
+            StoreTemp('A', self.select(25)),
+            Store(self.output('C'), ScanTemp('A', self.scheme))])
+        db = self.make_db(parallelism=4)
+        db.evaluate(plan)
+        db.close()
+        self.check_outputs(db, 1)
+        self.assertEquals(
+            db.get_table(self.output('B')),
+            collections.Counter(t for t in self.contents if t[0] > 20))
+        self.assertEquals(
+            db.get_table(self.output('C')),
+            collections.Counter(t for t in self.contents if t[0] > 25))
+
+    def test_processes(self):
+        plan = Sequence([StoreTemp('A', self.select(10))] +
+                        [Store(self.output('O{i}'.format(i=i)),
+                               self.select(i)) for i in range(3)] +
+                        [Store(self.output('B'),
+                               ScanTemp('A', self.scheme))])
+        db = self.make_db(parallelism=2, parallel_processes=True)
+        db.evaluate(plan)
+        db.close()
+        self.check_outputs(db, 3)
+        self.assertEquals(
+            db.get_table(self.output('B')),
+            collections.Counter(t for t in self.contents if t[0] > 10))
+        # The selects ran in other processes
+        self.assertEquals(db.threads, set())
+
+    def test_sample_after_store(self):
+        """A sample of a relation is taken after the relation is stored."""
+        for processes in (False, True):
+            plan = Sequence([
+                Store(self.output('S'), self.select(10)),
+                Store(self.output('T'),
+                      SampleScan(self.output('S'), self.scheme, 100, True,
+                                 'WoR'))])
+            self.assertEquals(len(list(fakedb.statement_batches(
+                plan.children()))), 2)
+            db = self.make_db(parallelism=2, parallel_processes=processes)
+            db.evaluate(plan)
+            db.close()
+            self.assertEquals(
+                db.get_table(self.output('T')),
+                collections.Counter(t for t in self.contents if t[0] > 10))
+
+    def test_remote_task(self):
+        """The relations that a query samples, and the registered functions,
+        are sent to the other processes."""
+        db = self.make_db(parallelism=2, parallel_processes=True)
+        function = ('f', 'a function', 'LONG_TYPE', 0, 'binary')
+        db.tables.register_function(function)
+        query = SampleScan(self.key, self.scheme, 100, True, 'WoR')
+        task = db._remote_task(query)
+        self.assertEquals(task[1], {self.key: (self.scheme,
+                                               list(self.contents))})
+        self.assertEquals(task[3], [function])
+        self.assertEquals(collections.Counter(fakedb.evaluate_remote(task)),
+                          self.contents)
@@ -0,0 +1,327 @@
+"""
+Simulate the partitioned execution of a physical plan on several workers.
+
+The PartitionedDatabase evaluates plans like the FakeDatabase, but keeps
+every relation as one bag of tuples per worker. Plans are cut into fragments
+at their exchange operators (shuffles, broadcasts, collects and hypercube
+shuffles): each worker runs each fragment over its own partitions, and the
+exchanges route the tuples between the workers as Myria would. The number of
+tuples that every exchange sends to each worker is recorded, which shows the
+skew of a plan.
+
+Fragments can optionally run in a multiprocessing pool, one task per worker.
+"""
+
+import collections
+import itertools
+import multiprocessing
+import pickle
+
+from raco import algebra, relation_key
+from raco.backends.myria import MyriaOperator
+from raco.expression import toUnnamed
+from raco.fakedb import CONTROL_OPERATORS, FakeDatabase
+
+# The exchange consumers of the Myria algebra; each reads the output of the
+# producer that is its input.
+CONSUMERS = {'myriashuffleconsumer', 'myriabroadcastconsumer',
+             'myriacollectconsumer', 'myriahypercubeshuffleconsumer',
+             'myriasplitconsumer'}
+
+
+class ExchangeStats(collections.namedtuple('ExchangeStats',
+                                           'operator counts')):
+    """The number of tuples an exchange operator sent to each worker."""
+
+    @property
+    def skew(self):
+        """The ratio of the largest partition to the mean partition."""
+        total = sum(self.counts)
+        if total == 0:
+            return 1.0
+        return max(self.counts) * len(self.counts) / float(total)
+
+    def __str__(self):
+        return '{op}: {counts} (skew {s:.2f})'.format(
+            op=self.operator, counts=list(self.counts), s=self.skew)
+
+
+def worker_for(key, num_workers):
+    """The worker that a hash partitioning sends a key (a tuple) to."""
+    return hash(key) % num_workers
+
+
+def hash_partition(tuples, positions, num_workers):
+    parts = [[] for _ in range(num_workers)]
+    for tpl in tuples:
+        key = tuple(tpl[p] for p in positions)
+        parts[worker_for(key, num_workers)].append(tpl)
+    return parts
+
+
+def round_robin_partition(tuples, num_workers):
+    parts = [[] for _ in range(num_workers)]
+    for i, tpl in enumerate(tuples):
+        parts[i % num_workers].append(tpl)
+    return parts
+
+
+def run_fragment(task):
+    """Evaluate a fragment on one worker.
+
+    :param task: a tuple (fragment, inputs), where inputs maps the names of
+    the ScanTemps in the fragment to their (scheme, tuples) on the worker
+    :returns: the list of tuples output by the fragment on the worker
+    """
+    fragment, inputs = task
+    db = FakeDatabase()
+    for name, (scheme, tuples) in inputs.iteritems():
+        db.temp_tables.add_table(name, scheme, tuples)
+    return list(db.evaluate(fragment))
+
+
+class PartitionedDatabase(FakeDatabase):
+    """An in-memory implementation of relational algebra operators that
+    simulates their partitioned execution on num_workers workers."""
+
+    def __init__(self, num_workers=4, processes=None):
+        """Initialize the database.
+
+        :param num_workers: The number of simulated workers
+        :param processes: If given, run the fragments of each worker in a
+        multiprocessing pool of this many processes
+        """
+        super(PartitionedDatabase, self).__init__()
+        self.num_workers = num_workers
+        self.processes = processes
+        self._pool = None
+
+        # The partitions of the relations, as lists of per-worker lists
+        self.worker_tables = {}
+        self.worker_temp_tables = {}
+
+        # ExchangeStats for every exchange that was evaluated
+        self.exchange_stats = []
+
+    def get_num_servers(self):
+        return self.num_workers
+
+    def close(self):
+        """Shut down the process pools, if any."""
+        super(PartitionedDatabase, self).close()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def evaluate(self, op):
+        if isinstance(op, CONTROL_OPERATORS):
+            return super(PartitionedDatabase, self).evaluate(op)
+        return itertools.chain.from_iterable(self.evaluate_partitioned(op))
+
+    def evaluate_partitioned(self, op):
+        """Evaluate a query operator on all workers.
+
+        :returns: a list with the output tuples of each worker
+        """
+        if not self._is_distributed(op):
+            # Logical plans do not exchange tuples between the workers, so
+            # run them on the whole relations on worker 0.
+            tuples = list(super(PartitionedDatabase, self).evaluate(op))
+            return [tuples] + [[] for _ in range(self.num_workers - 1)]
+
+        inputs = {}
+        workers = set(range(self.num_workers))
+        fragment = self._cut_fragment(op, inputs, workers, {})
+        workers = sorted(workers)
+        tasks = [(fragment, {name: (scheme, parts[worker])
+                             for name, (scheme, parts) in inputs.iteritems()})
+                 for worker in workers]
+        results = [[] for _ in range(self.num_workers)]
+        for worker, tuples in zip(workers, self._map(run_fragment, tasks)):
+            results[worker] = tuples
+        return results
+
+    def _is_distributed(self, op):
+        return any(isinstance(o, MyriaOperator) or
+                   hasattr(self, 'route_' + o.opname().lower())
+                   for o in op.walk())
+
+    def _map(self, func, tasks):
+        if self.processes is None:
+            return map(func, tasks)
+        try:
+            pickle.dumps(tasks[0], pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError):
+            # e.g., Python UDFs: run the fragments in this process
+            return map(func, tasks)
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+        return self._pool.map(func, tasks)
+
+    def _cut_fragment(self, op, inputs, workers, exchanged):
+        """Copy the fragment rooted at op, replacing its exchanges and scans
+        by ScanTemps of their partitions; the partitions are added to
+        inputs.
+
+        Fragments that read a collected relation only run on the worker it
+        was collected on, so the workers that do not run the fragment are
+        removed from the set workers.
+        """
+        name = op.opname().lower()
+        if name in CONSUMERS:
+            parts = self._exchange(op.input, exchanged)
+            if name == 'myriacollectconsumer':
+                workers.intersection_update([self._collect_worker(op.input)])
+        elif hasattr(self, 'route_' + name):
+            parts = self._exchange(op, exchanged)
+            if isinstance(op, algebra.Collect):
+                workers.intersection_update([self._collect_worker(op)])
+        elif isinstance(op, algebra.Scan):
+            parts = self._scan_partitions(op.relation_key, op.scheme())
+        elif isinstance(op, algebra.ScanTemp):
+            parts = self._scan_temp_partitions(op.name)
+        elif isinstance(op, algebra.ZeroaryOperator):
+            # Other sources (files, singletons, SQL) are read by worker 0
+            tuples = list(super(PartitionedDatabase, self).evaluate(op))
+            parts = [tuples] + [[] for _ in range(self.num_workers - 1)]
+        else:
+            # Operators forbid copy.copy: copy the attributes by hand, so
+            # that the children of op are not modified
+            new_op = op.__class__.__new__(op.__class__)
+            new_op.__dict__.update(op.__dict__)
+            new_op.apply(lambda child: self._cut_fragment(
+                child, inputs, workers, exchanged))
+            return new_op
+
+        input_name = '__input{i}'.format(i=len(inputs))
+        inputs[input_name] = (op.scheme(), parts)
+        return algebra.ScanTemp(input_name, op.scheme())
+
+    def _scan_partitions(self, rel_key, scheme):
+        if rel_key not in self.worker_tables:
+            # Distribute an ingested relation by its declared partitioning
+            tuples = self.tables.scan(rel_key)
+            partitioning = self.partitionings.get(rel_key)
+            if partitioning and partitioning.hash_partitioned:
+                positions = [toUnnamed(attr, scheme).position
+                             for attr in partitioning.hash_partitioned]
+                parts = hash_partition(tuples, positions, self.num_workers)
+            else:
+                parts = round_robin_partition(tuples, self.num_workers)
+            self.worker_tables[rel_key] = parts
+        return self.worker_tables[rel_key]
+
+    def _scan_temp_partitions(self, name):
+        if name not in self.worker_temp_tables:
+            self.worker_temp_tables[name] = round_robin_partition(
+                self.temp_tables.scan(name), self.num_workers)
+        return self.worker_temp_tables[name]
+
+    def _exchange(self, producer, exchanged):
+        """Evaluate the input of an exchange producer on all workers and
+        route the tuples to their destination workers."""
+        if id(producer) not in exchanged:
+            parts = self.evaluate_partitioned(producer.input)
+            route = getattr(self, 'route_' + producer.opname().lower())
+            routed = route(producer, parts)
+            self.exchange_stats.append(ExchangeStats(
+                producer.shortStr(), tuple(len(p) for p in routed)))
+            exchanged[id(producer)] = routed
+        return exchanged[id(producer)]
+
+    def route_shuffle(self, op, parts):
+        tuples = itertools.chain.from_iterable(parts)
+        shuffle_type = op.shuffle_type
+        if shuffle_type == algebra.Shuffle.ShuffleType.RoundRobin:
+            return round_robin_partition(tuples, self.num_workers)
+        # The planner hashes relations without attributes (singletons) on
+        # $0; they are hashed on the empty key instead.
+        arity = len(op.input.scheme())
+        positions = [col.position for col in op.columnlist
+                     if col.position < arity]
+        if shuffle_type == algebra.Shuffle.ShuffleType.Identity:
+            routed = [[] for _ in range(self.num_workers)]
+            for tpl in tuples:
+                routed[tpl[positions[0]] % self.num_workers].append(tpl)
+            return routed
+        return hash_partition(tuples, positions, self.num_workers)
+
+    def route_myriashuffleproducer(self, op, parts):
+        logical = algebra.Shuffle(op.input, op.hash_columns, op.shuffle_type)
+        return self.route_shuffle(logical, parts)
+
+    def route_broadcast(self, op, parts):
+        tuples = list(itertools.chain.from_iterable(parts))
+        return [tuples for _ in range(self.num_workers)]
+
+    route_myriabroadcastproducer = route_broadcast
+
+    def _collect_worker(self, op):
+        return (op.server or 0) % self.num_workers
+
+    def route_collect(self, op, parts):
+        routed = [[] for _ in range(self.num_workers)]
+        routed[self._collect_worker(op)] = list(
+            itertools.chain.from_iterable(parts))
+        return routed
+
+    route_myriacollectproducer = route_collect
+
+    def route_myriasplitproducer(self, op, parts):
+        # Local multiway producers do not move tuples between workers
+        return parts
+
+    def route_hypercubeshuffle(self, op, parts):
+        dims = op.hyper_cube_dimensions
+        sizes = [dims[d] for d in op.mapped_hc_dimensions]
+        routed = [[] for _ in range(self.num_workers)]
+        for tpl in itertools.chain.from_iterable(parts):
+            # The voxel of the tuple in the subcube of its hashed dimensions;
+            # the cell partition lists voxels in lexicographic order.
+            voxel = 0
+            for col, size in zip(op.hashed_columns, sizes):
+                voxel = voxel * size + worker_for((tpl[col],), size)
+            for worker in op.cell_partition[voxel]:
+                routed[worker % self.num_workers].append(tpl)
+        return routed
+
+    route_myriahypercubeshuffleproducer = route_hypercubeshuffle
+
+    def store(self, op):
+        parts = self.evaluate_partitioned(op.input)
+        self._set_table(op.relation_key, op.input.scheme(),
+                        itertools.chain.from_iterable(parts))
+        self.worker_tables[op.relation_key] = parts
+        return None
+
+    def storetemp(self, op):
+        parts = self.evaluate_partitioned(op.input)
+        self._set_temp_table(op.name, op.input.scheme(),
+                             itertools.chain.from_iterable(parts))
+        self.worker_temp_tables[op.name] = parts
+
+    def appendtemp(self, op):
+        parts = self.evaluate_partitioned(op.input)
+        old = self._scan_temp_partitions(op.name)
+        self.worker_temp_tables[op.name] = [o + p for o, p in zip(old, parts)]
+        self.temp_tables.append_table(op.name,
+                                      itertools.chain.from_iterable(parts))
+        self._temp_versions[op.name] = self._new_version()
+
+    def _set_table(self, rel_key, *args, **kwargs):
+        super(PartitionedDatabase, self)._set_table(rel_key, *args, **kwargs)
+        self.worker_tables.pop(rel_key, None)
+
+    def _set_temp_table(self, name, *args, **kwargs):
+        super(PartitionedDatabase, self)._set_temp_table(name, *args,
+                                                         **kwargs)
+        self.worker_temp_tables.pop(name, None)
+
+    def ingest(self, rel_key, contents, scheme, *args, **kwargs):
+        if isinstance(rel_key, basestring):
+            rel_key = relation_key.RelationKey.from_string(rel_key)
+        super(PartitionedDatabase, self).ingest(rel_key, contents, scheme,
+                                                *args, **kwargs)
+        # Partition the new contents the next time they are scanned
+        self.worker_tables.pop(rel_key, None)
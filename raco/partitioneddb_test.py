@@ -0,0 +1,90 @@
+import collections
+import unittest
+
+from raco.algebra import Store
+from raco.backends.myria import (MyriaScan, MyriaGroupBy, MyriaShuffleProducer,
+                                 MyriaShuffleConsumer, MyriaCollectProducer,
+                                 MyriaCollectConsumer)
+from raco.expression import UnnamedAttributeRef, COUNTALL, SUM
+from raco.fake_data import FakeData
+from raco.partitioneddb import PartitionedDatabase, worker_for
+from raco.relation_key import RelationKey
+from raco.representation import RepresentationProperties
+
+
+class PartitionedDatabaseTest(unittest.TestCase, FakeData):
+
+    emp_key = RelationKey.from_string(FakeData.emp_key)
+    out_key = RelationKey.from_string("public:adhoc:OUTPUT")
+
+    def setUp(self):
+        self.db = PartitionedDatabase(num_workers=3)
+        self.db.ingest(self.emp_key, FakeData.emp_table, FakeData.emp_schema)
+        self.scan = MyriaScan(self.emp_key, FakeData.emp_schema)
+
+    def tearDown(self):
+        self.db.close()
+
+    def count_by_dept(self):
+        """Count the employees of each department: a partial aggregate on
+        each worker, a shuffle on dept_id and a final aggregate."""
+        dept = UnnamedAttributeRef(0)
+        partial = MyriaGroupBy([UnnamedAttributeRef(1)], [COUNTALL()],
+                               self.scan)
+        shuffle = MyriaShuffleConsumer(MyriaShuffleProducer(partial, [dept]))
+        return MyriaGroupBy([dept], [SUM(UnnamedAttributeRef(1))], shuffle)
+
+    def test_shuffle(self):
+        self.db.evaluate(Store(self.out_key, self.count_by_dept()))
+        out = self.db.get_table(self.out_key)
+        self.assertEquals(out, collections.Counter([(1, 4), (2, 2), (3, 1)]))
+
+        # Each worker holds the departments that hash to it
+        for worker, part in enumerate(self.db.worker_tables[self.out_key]):
+            for dept, _ in part:
+                self.assertEquals(worker_for((dept,), 3), worker)
+
+        stats, = self.db.exchange_stats
+        self.assertEquals(len(stats.counts), 3)
+        self.assertGreaterEqual(stats.skew, 1.0)
+
+    def test_store_new_version(self):
+        """Storing a relation starts a new version of it, which forgets its
+        statistics."""
+        self.db.evaluate(Store(self.out_key, self.count_by_dept()))
+        version = self.db._versions.get(str(self.out_key))
+        self.assertIsNotNone(version)
+        self.assertEquals(self.db.column_stats(self.out_key)[0].ndv, 3)
+
+        self.db.evaluate(Store(self.out_key, self.scan))
+        self.assertNotEqual(self.db._versions[str(self.out_key)], version)
+        self.assertEquals(self.db.column_stats(self.out_key)[0].ndv, 7)
+        self.assertEquals(len(self.db.worker_tables[self.out_key]), 3)
+
+    def test_collect(self):
+        total = MyriaGroupBy([], [COUNTALL()], MyriaCollectConsumer(
+            MyriaCollectProducer(self.scan, 2)))
+        self.assertEquals(self.db.evaluate_partitioned(total),
+                          [[], [], [(7,)]])
+        self.assertEquals(self.db.exchange_stats[0].counts, (0, 0, 7))
+        self.assertEquals(self.db.exchange_stats[0].skew, 3.0)
+
+    def test_hash_partitioned_input(self):
+        """Relations are distributed by their declared partitioning"""
+        partitioning = RepresentationProperties(
+            hash_partitioned=frozenset([UnnamedAttributeRef(1)]))
+        self.db.ingest(self.emp_key, FakeData.emp_table, FakeData.emp_schema,
+                       partitioning)
+        parts = self.db.evaluate_partitioned(self.scan)
+        for worker, part in enumerate(parts):
+            for tpl in part:
+                self.assertEquals(worker_for((tpl[1],), 3), worker)
+
+    def test_process_pool(self):
+        db = PartitionedDatabase(num_workers=3, processes=2)
+        db.ingest(self.emp_key, FakeData.emp_table, FakeData.emp_schema)
+        try:
+            self.assertEquals(db.evaluate_to_bag(self.count_by_dept()),
+                              collections.Counter([(1, 4), (2, 2), (3, 1)]))
+        finally:
+            db.close()
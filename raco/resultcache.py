@@ -0,0 +1,169 @@
+"""
+Cache the results of queries on disk, across runs.
+
+A result is identified by a key that combines the fingerprint of the plan
+that computed it (see raco.sharing) with the versions of the relations and
+files that the plan reads. The FakeDatabase gives each relation that it
+writes a new version, unless the relation is the result of a cached plan:
+its version is then derived from the key of that plan, so that a script
+that is run again over unchanged files finds the results of all of its
+statements in the cache.
+
+Results are stored as pickled batches of tuples, one file per key. When the
+files take more than the size cap, the least recently used are deleted.
+"""
+
+import cPickle
+import hashlib
+import os
+import tempfile
+
+from raco import algebra, columnfile, sharing
+
+# The default size cap of a cache
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# The number of tuples that are pickled at once
+BATCH_SIZE = 1024
+
+SUFFIX = '.result'
+
+# Operators whose results may differ between runs, besides those that are
+# not deterministic (see raco.sharing.is_deterministic)
+UNCACHEABLE_OPERATORS = (algebra.ScanIDB, algebra.IDBController)
+
+
+class CacheStats(object):
+    """The number of hits, misses and evicted results of a cache."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return 'result cache: {h} hits, {m} misses, {e} evictions'.format(
+            h=self.hits, m=self.misses, e=self.evictions)
+
+
+def is_cacheable(op):
+    """Whether the plan rooted at op computes the same result every time
+    that it reads the same inputs."""
+    for node in op.walk():
+        if (node.stop_recursion or
+                isinstance(node, UNCACHEABLE_OPERATORS)):
+            return False
+    return sharing.is_deterministic(op)
+
+
+def file_version(path):
+    """The version of a file, or of a relation stored as column files."""
+    if columnfile.is_relation(path):
+        path = os.path.join(path, columnfile.HEADER)
+    stat = os.stat(path)
+    return 'file:{m!r}:{s}'.format(m=stat.st_mtime, s=stat.st_size)
+
+
+class ResultCache(object):
+    """A directory of query results, with a size cap.
+
+    :param directory: The directory of the results; it is created if needed
+    :param max_bytes: The size cap, in bytes
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+
+    @staticmethod
+    def key(op, versions):
+        """The key of the result of a plan.
+
+        :param versions: The versions of the inputs of the plan, as
+        (input, version) pairs
+        """
+        text = repr((sharing.fingerprint(op), sorted(versions)))
+        return hashlib.sha1(text).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def contains(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Return an iterator over a cached result, or None."""
+        path = self._path(key)
+        try:
+            fh = open(path, 'rb')
+        except IOError:
+            self.stats.misses += 1
+            return None
+        # Mark the result as recently used
+        os.utime(path, None)
+        self.stats.hits += 1
+        return self._read(fh)
+
+    @staticmethod
+    def _read(fh):
+        with fh:
+            while True:
+                try:
+                    batch = cPickle.load(fh)
+                except EOFError:
+                    return
+                for tpl in batch:
+                    yield tpl
+
+    def put(self, key, tuples):
+        """Iterate over tuples, writing them to the cache. The result is
+        cached only once all of the tuples have been read."""
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                batch = []
+                for tpl in tuples:
+                    batch.append(tpl)
+                    if len(batch) == BATCH_SIZE:
+                        cPickle.dump(batch, fh, cPickle.HIGHEST_PROTOCOL)
+                        batch = []
+                    yield tpl
+                if batch:
+                    cPickle.dump(batch, fh, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self._path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict()
+
+    def entries(self):
+        """Return the (last use, size, path) of each cached result."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Delete the least recently used results until the cache fits in
+        its size cap."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.stats.evictions += 1
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
@@ -0,0 +1,143 @@
+import collections
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from raco import resultcache
+from raco.algebra import (Apply, FileScan, GroupBy, NaryJoin, Scan, Select,
+                          Sequence, Store)
+from raco.expression import (COUNTALL, GT, NumericLiteral, RANDOM,
+                             UnnamedAttributeRef)
+from raco.fakedb import FakeDatabase
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+from raco import types
+
+
+class CountingDatabase(FakeDatabase):
+    """A FakeDatabase that counts the files it reads."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingDatabase, self).__init__(*args, **kwargs)
+        self.file_scans = 0
+
+    def filescan(self, op):
+        self.file_scans += 1
+        return super(CountingDatabase, self).filescan(op)
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_put_get(self):
+        cache = resultcache.ResultCache(self.cache_dir)
+        self.assertIsNone(cache.get('a'))
+        tuples = [(i, 'x' * i) for i in range(3000)]
+        self.assertEquals(list(cache.put('a', iter(tuples))), tuples)
+        self.assertEquals(list(cache.get('a')), tuples)
+        self.assertEquals((cache.stats.hits, cache.stats.misses), (1, 1))
+
+    def test_partial_result(self):
+        """Results that are not read to the end are not cached."""
+        cache = resultcache.ResultCache(self.cache_dir)
+        it = cache.put('a', iter([(1,), (2,)]))
+        next(it)
+        it.close()
+        self.assertIsNone(cache.get('a'))
+        self.assertEquals(os.listdir(self.cache_dir), [])
+
+    def test_lru(self):
+        cache = resultcache.ResultCache(self.cache_dir)
+        tuples = [(i,) for i in range(100)]
+        for key in 'abc':
+            list(cache.put(key, tuples))
+            os.utime(cache._path(key), (0, {'a': 1, 'b': 2, 'c': 3}[key]))
+        size = cache.size() / 3
+
+        # Use a, so that b is the least recently used
+        list(cache.get('a'))
+        cache.max_bytes = 3 * size
+        list(cache.put('d', tuples))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEquals(cache.stats.evictions, 1)
+
+    def test_uncacheable(self):
+        scheme = Scheme([('a', types.LONG_TYPE)])
+        scan = Scan(RelationKey.from_string('public:adhoc:R'), scheme)
+        self.assertTrue(resultcache.is_cacheable(scan))
+        self.assertFalse(resultcache.is_cacheable(
+            Apply([('a', UnnamedAttributeRef(0)), ('r', RANDOM())], scan)))
+
+    def test_same_repr(self):
+        """Plans whose reprs are the same have different keys, and do not
+        share results."""
+        scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE)])
+        key = RelationKey.from_string('public:adhoc:R')
+        scan = Scan(key, scheme)
+        joins = [NaryJoin([scan, scan], [[UnnamedAttributeRef(i),
+                                          UnnamedAttributeRef(2)]])
+                 for i in (1, 0)]
+        self.assertEquals(repr(joins[0]), repr(joins[1]))
+        self.assertNotEquals(resultcache.ResultCache.key(joins[0], []),
+                             resultcache.ResultCache.key(joins[1], []))
+
+        db = FakeDatabase(cache_dir=self.cache_dir)
+        db.ingest(key, collections.Counter([(1, 2), (2, 2)]), scheme)
+        outputs = [RelationKey.from_string(name) for name in ('A', 'B')]
+        db.evaluate(Sequence([Store(output, join)
+                              for output, join in zip(outputs, joins)]))
+        self.assertEquals(db.get_table(outputs[0]),
+                          collections.Counter([(1, 2, 2, 2), (2, 2, 2, 2)]))
+        self.assertEquals(db.get_table(outputs[1]),
+                          collections.Counter([(1, 2, 1, 2), (2, 2, 2, 2)]))
+
+    def run_script(self, csv_path):
+        """Store S = [from T where a > 1 emit *], then count the tuples of
+        each value of a in S."""
+        scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE)])
+        key = RelationKey.from_string('public:adhoc:S')
+        select = Select(GT(UnnamedAttributeRef(0), NumericLiteral(1)),
+                        FileScan(csv_path, 'CSV', scheme, {}))
+        count = GroupBy([UnnamedAttributeRef(0)], [COUNTALL()],
+                        Scan(key, scheme))
+        plan = Sequence([Store(key, select),
+                         Store(RelationKey.from_string('OUTPUT'), count)])
+
+        db = CountingDatabase(cache_dir=self.cache_dir)
+        db.evaluate(plan)
+        return db
+
+    def test_rerun(self):
+        """A script run again over the same file reads the cache."""
+        csv_path = os.path.join(self.dir, 'T.csv')
+        with open(csv_path, 'w') as fh:
+            fh.write('1,1\n2,1\n2,2\n3,5\n')
+        expected = collections.Counter([(2, 2), (3, 1)])
+
+        db = self.run_script(csv_path)
+        self.assertEquals(db.get_table('OUTPUT'), expected)
+        self.assertEquals(db.file_scans, 1)
+        self.assertEquals(db.result_cache.stats.misses, 2)
+
+        db = self.run_script(csv_path)
+        self.assertEquals(db.get_table('OUTPUT'), expected)
+        self.assertEquals(db.file_scans, 0)
+        self.assertEquals(db.result_cache.stats.hits, 2)
+
+        # A modified file invalidates the results that depend on it
+        time.sleep(0.01)
+        with open(csv_path, 'w') as fh:
+            fh.write('1,1\n2,1\n')
+        db = self.run_script(csv_path)
+        self.assertEquals(db.get_table('OUTPUT'),
+                          collections.Counter([(2, 1)]))
+        self.assertEquals(db.file_scans, 1)
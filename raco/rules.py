@@ -1,6 +1,8 @@
+import collections
+import logging
 import re
 
-from raco import algebra, expression
+from raco import algebra, expression, joinorder, memo
 from raco.representation import RepresentationProperties
 from .expression import (accessed_columns, UnnamedAttributeRef,
                          rebase_local_aggregate_output, rebase_finalizer,
@@ -9,6 +11,8 @@ from .expression import (accessed_columns, UnnamedAttributeRef,
 from abc import ABCMeta, abstractmethod
 import itertools
 
+LOG = logging.getLogger(__name__)
+
 
 class Rule(object):
 
@@ -20,6 +24,11 @@ class Rule(object):
 
     _flag_pattern = re.compile(r'no_([A-Za-z_]+)')  # e.g., no_MergeSelects
 
+    # The operator class (or tuple of classes, as for isinstance) that this
+    # rule may rewrite. The optimizer does not fire the rule on other
+    # operators; None means any operator.
+    matches = None
+
     def __init__(self):
         self._disabled = False
 
@@ -29,6 +38,10 @@ class Rule(object):
         else:
             return self.fire(expr)
 
+    def match(self, op):
+        """Whether this rule may rewrite op."""
+        return self.matches is None or isinstance(op, self.matches)
+
     @classmethod
     def apply_disable_flags(cls, rule_list, *args):
         disabled_rules = set()
@@ -41,6 +54,8 @@ class Rule(object):
 
         for r in rule_list:
             r._disabled = r.__class__.__name__ in disabled_rules
+            if isinstance(r, FixedPoint):
+                cls.apply_disable_flags(r.rules, *args)
 
     @abstractmethod
     def fire(self, expr):
@@ -64,6 +79,8 @@ class AbstractInterpretedValue:
 
 class NumTuplesPropagation(Rule):
 
+    matches = algebra.Sequence
+
     def fire(self, expr):
         # TODO I really just want this to fire once on the top node...
         if isinstance(expr, algebra.Sequence):
@@ -105,6 +122,8 @@ class CrossProduct2Join(Rule):
 
     """A rewrite rule for removing Cross Product"""
 
+    matches = algebra.CrossProduct
+
     def fire(self, expr):
         if isinstance(expr, algebra.CrossProduct):
             return algebra.Join(expression.EQ(expression.NumericLiteral(1),
@@ -120,6 +139,8 @@ class removeProject(Rule):
 
     """A rewrite rule for removing Projections"""
 
+    matches = algebra.Project
+
     def fire(self, expr):
         if isinstance(expr, algebra.Project):
             return expr.input
@@ -134,6 +155,7 @@ class OneToOne(Rule):
     def __init__(self, opfrom, opto):
         self.opfrom = opfrom
         self.opto = opto
+        self.matches = opfrom
         super(OneToOne, self).__init__()
 
     def fire(self, expr):
@@ -151,6 +173,8 @@ class JoinToProjectingJoin(Rule):
 
     """A rewrite rule for turning every Join into a ProjectingJoin"""
 
+    matches = algebra.Join
+
     def fire(self, expr):
         if not isinstance(expr, algebra.Join) or \
                 isinstance(expr, algebra.ProjectingJoin):
@@ -187,6 +211,8 @@ class SimpleGroupBy(Rule):
     # GroupBy wants to handle. Thus we will insert Apply before a GroupBy to
     # take all the "Complex" expressions away.
 
+    matches = algebra.GroupBy
+
     def fire(self, expr):
         if not isinstance(expr, algebra.GroupBy):
             return expr
@@ -242,6 +268,8 @@ class DedupGroupBy(Rule):
     """When a GroupBy computes redundant fields, replace this duplicate
     computation by a single computation plus a duplicating Apply."""
 
+    matches = algebra.GroupBy
+
     def fire(self, expr):
         if not isinstance(expr, algebra.GroupBy):
             return expr
@@ -293,6 +321,8 @@ class DistinctToGroupBy(Rule):
 
     """Turns a distinct into an empty GroupBy"""
 
+    matches = algebra.Distinct
+
     def fire(self, expr):
         if isinstance(expr, algebra.Distinct):
             in_scheme = expr.scheme()
@@ -309,6 +339,8 @@ class EmptyGroupByToDistinct(Rule):
 
     """Turns a GroupBy with no aggregates into a Distinct"""
 
+    matches = algebra.GroupBy
+
     def fire(self, expr):
         if isinstance(expr, algebra.GroupBy) and len(expr.aggregate_list) == 0:
             # We can turn an empty GroupBy into a Distinct. However,
@@ -336,6 +368,8 @@ class CountToCountall(Rule):
     map COUNT to COUNTALL."""
     # TODO fix when we have NULL support.
 
+    matches = algebra.GroupBy
+
     def fire(self, expr):
         if not isinstance(expr, algebra.GroupBy):
             return expr
@@ -358,6 +392,8 @@ class CountToCountall(Rule):
 
 class RemoveTrivialSequences(Rule):
 
+    matches = algebra.Sequence
+
     def fire(self, expr):
         if not isinstance(expr, algebra.Sequence):
             return expr
@@ -372,6 +408,8 @@ class SplitSelects(Rule):
 
     """Replace AND clauses with multiple consecutive selects."""
 
+    matches = algebra.Select
+
     def fire(self, op):
         if not isinstance(op, algebra.Select):
             return op
@@ -394,6 +432,8 @@ class PushSelects(Rule):
 
     """Push selections."""
 
+    matches = algebra.Select
+
     @staticmethod
     def is_column_equality_comparison(cond):
         """Return a tuple of column indexes if the condition is an equality
@@ -507,6 +547,8 @@ class MergeSelects(Rule):
 
     """Merge consecutive Selects into a single conjunctive selection."""
 
+    matches = algebra.Select
+
     def fire(self, op):
         if not isinstance(op, algebra.Select):
             return op
@@ -533,6 +575,8 @@ class PushApply(Rule):
       - makes ProjectingJoin only produce columns that are later read.
     """
 
+    matches = algebra.Apply
+
     def fire(self, op):
         if not isinstance(op, algebra.Apply):
             return op
@@ -581,6 +625,9 @@ class PushApply(Rule):
 
             accessed = sorted(set(itertools.chain(*(accessed_columns(e)
                                                     for e in emits))))
+            if accessed == range(len(child.output_columns)):
+                # The join produces no column that this Apply drops
+                return op
             index_map = {a: i for (i, a) in enumerate(accessed)}
             child.output_columns = [child.output_columns[i] for i in accessed]
             for e in emits:
@@ -623,6 +670,8 @@ class PushApply(Rule):
 
 class ProjectToDistinctColumnSelect(Rule):
 
+    matches = algebra.Project
+
     def fire(self, expr):
         # If not a Project, who cares?
         if not isinstance(expr, algebra.Project):
@@ -646,6 +695,8 @@ class RemoveUnusedColumns(Rule):
     a subsequent invocation of PushApply will be able to push that
     column-selection operation further down the tree."""
 
+    matches = (algebra.GroupBy, algebra.ProjectingJoin)
+
     def fire(self, op):
         if isinstance(op, algebra.GroupBy):
             child = op.input
@@ -723,6 +774,8 @@ class ProjectingJoinToProjectOfJoin(Rule):
     optimizations and then remove ProjectingJoin for
     backends that don't have one"""
 
+    matches = algebra.ProjectingJoin
+
     def fire(self, expr):
         if isinstance(expr, algebra.ProjectingJoin):
             return algebra.Apply([(None, x) for x in expr.output_columns],
@@ -740,6 +793,8 @@ class RemoveNoOpApply(Rule):
 
     """Remove Apply operators that have no effect."""
 
+    matches = algebra.Apply
+
     def fire(self, op):
         if not isinstance(op, algebra.Apply):
             return op
@@ -772,6 +827,8 @@ class RemoveNoOpApply(Rule):
 class SwapJoinSides(Rule):
     # swaps the inputs to a join
 
+    matches = (algebra.Join, algebra.CrossProduct)
+
     def fire(self, expr):
         # don't allow swap-created join to be swapped
         if (isinstance(expr, algebra.Join) or
@@ -821,6 +878,161 @@ class SwapJoinSides(Rule):
         return "Join(L,R) => Join(R,L)"
 
 
+class OrderJoins(Rule):
+    """Reorder clusters of joins and cross products by estimated cost; see
+    raco.joinorder.
+
+    :param bushy: Consider bushy join trees, not only left-deep ones
+    :param shuffles: Count the tuples that the joins shuffle
+    """
+
+    matches = (algebra.Join, algebra.CrossProduct)
+
+    def __init__(self, bushy=False, shuffles=True):
+        self.bushy = bushy
+        self.shuffles = shuffles
+        # The joins of the clusters ordered in this pass, by id, until the
+        # pass reaches them: their subclusters are not ordered again
+        self._ordered = {}
+        super(OrderJoins, self).__init__()
+
+    def fire(self, expr):
+        if not joinorder.is_join(expr):
+            return expr
+        if self._ordered.pop(id(expr), None) is expr:
+            return expr
+        new_expr = joinorder.order_joins(expr, self.bushy, self.shuffles,
+                                         self._ordered)
+        # The pass goes on with the children of the new root
+        self._ordered.pop(id(new_expr), None)
+        return new_expr
+
+    def __str__(self):
+        return "Join(Join(A, B), C) => Join(Join(A, C), B) by cost"
+
+
+class FixedPoint(Rule):
+    """Fire a group of rules until none of them changes the plan.
+
+    Each operator is dispatched only to the rules that match its class (see
+    Rule.matches), from a worklist of the operators that may have become
+    rewritable: at first the whole plan, then, after each rewrite, the new
+    operator, the operators below it, and its parent. A rule rewrites an
+    operator if it returns another one or modifies the plan in place,
+    which starts a new epoch (see raco.memo).
+
+    :param rules: The rules of the group; each operator is rewritten by the
+                  first rule that changes it, then dispatched again
+    :param max_rewrites: The number of rewrites, per operator of the input
+                         plan, after which the rules are assumed not to
+                         converge and the plan is returned as it is
+    """
+
+    def __init__(self, rules, max_rewrites=100):
+        self.rules = rules
+        self.max_rewrites = max_rewrites
+        # operator class -> the rules that match it
+        self._dispatch = {}
+        super(FixedPoint, self).__init__()
+
+    def rules_for(self, op):
+        cls = type(op)
+        if cls not in self._dispatch:
+            self._dispatch[cls] = [r for r in self.rules if r.match(op)]
+        return [r for r in self._dispatch[cls] if not r._disabled]
+
+    def fire(self, expr):
+        return self.optimize(expr)
+
+    def optimize(self, expr, profiler=None):
+        """Rewrite the plan rooted at expr to a fixed point.
+
+        :param profiler: A compile.RuleProfiler that records the statistics
+                         of the rules, or None
+        """
+        stats = {}
+        if profiler is not None:
+            for rule in self.rules:
+                stats[rule] = profiler.rule(rule)
+                stats[rule].invocations += 1
+
+        # id(op) -> the parent of op, or None for the root
+        parents = {id(expr): None}
+        root = [expr]
+        worklist = collections.deque()
+        queued = set()
+
+        def enqueue(op):
+            if id(op) not in queued and self.rules_for(op):
+                queued.add(id(op))
+                worklist.append(op)
+
+        def add_tree(op):
+            enqueue(op)
+            if op.stop_recursion:
+                return
+            for child in op.children():
+                parents[id(child)] = op
+                add_tree(child)
+
+        def attached(op):
+            """Whether op is still in the plan."""
+            while True:
+                parent = parents.get(id(op))
+                if parent is None:
+                    return op is root[0]
+                if not any(child is op for child in parent.children()):
+                    return False
+                op = parent
+
+        def fire(rule, op):
+            if rule not in stats:
+                return rule(op)
+            start = profiler.clock()
+            new_op = rule(op)
+            stats[rule].time += profiler.clock() - start
+            stats[rule].nodes += 1
+            return new_op
+
+        add_tree(expr)
+        budget = self.max_rewrites * len(parents)
+        while worklist:
+            op = worklist.popleft()
+            queued.discard(id(op))
+            if not attached(op):
+                continue
+
+            for rule in self.rules_for(op):
+                before = memo.epoch()
+                new_op = fire(rule, op)
+                if new_op is op and memo.epoch() is before:
+                    continue
+
+                if rule in stats:
+                    stats[rule].rewrites += 1
+                parent = parents[id(op)]
+                if parent is None:
+                    root[0] = new_op
+                elif new_op is not op:
+                    parent.apply(lambda c: new_op if c is op else c)
+                parents[id(new_op)] = parent
+                if parent is not None:
+                    enqueue(parent)
+                add_tree(new_op)
+
+                budget -= 1
+                if budget == 0:
+                    LOG.warning("%s did not converge", self)
+                    return root[0]
+                break
+
+        return root[0]
+
+    def __str__(self):
+        return "FixedPoint({r})".format(
+            r=", ".join(r.__class__.__name__ for r in self.rules))
+
+
 # logical groups of catalog transparent rules
 # 1. this must be applied first
 remove_trivial_sequences = [RemoveTrivialSequences()]
@@ -843,14 +1055,11 @@ push_project = [
 
 # 5. push apply
 push_apply = [
-    # These really ought to be run until convergence.
-    # For now, run twice and finish with PushApply.
-    PushApply(),
-    RemoveUnusedColumns(),
-    PushApply(),
-    RemoveUnusedColumns(),
-    PushApply(),
-    RemoveNoOpApply(),
+    FixedPoint([
+        PushApply(),
+        RemoveUnusedColumns(),
+        RemoveNoOpApply(),
+    ])
 ]
 
 
@@ -865,6 +1074,8 @@ class DecomposeGroupBy(Rule):
           - the cardinality of the grouping keys is high.
     """
 
+    matches = algebra.GroupBy
+
     def __init__(self, partition_groupby_class, only_fire_on_multi_key=None):
         self._gb_class = partition_groupby_class
         self._only_fire_on_multi_key = only_fire_on_multi_key
@@ -1046,6 +1257,9 @@ def check_partition_equality(op, representation):
 
 class DeDupBroadcastInputs(Rule):
 
+    matches = (algebra.Shuffle, algebra.HyperCubeShuffle,
+               algebra.Collect, algebra.Broadcast)
+
     def fire(self, expr):
         def is_nonlocal_exchange_op(expr):
             return isinstance(expr, (
@@ -0,0 +1,145 @@
+"""
+Sample a stream of tuples in one pass.
+
+The samplers read their input once and hold at most sample_size tuples,
+so that the size of the input need not be known, or fit in memory:
+
+- reservoir_sample draws without replacement, using Algorithm L (Li,
+  1994), which skips over the tuples that are not sampled instead of
+  drawing a random number for each tuple as Algorithm R does.
+- reservoir_sample_with_replacement keeps sample_size independent
+  reservoirs of one tuple each; each reservoir computes when it is next
+  replaced, so that the work is proportional to the number of
+  replacements rather than to sample_size times the size of the input.
+- bernoulli_sample and poisson_sample draw a fraction of the input,
+  without and with replacement, and hold nothing.
+"""
+
+import heapq
+import itertools
+import math
+import random
+
+
+def _uniform(rand):
+    """Draw a number uniformly from the open interval (0, 1)."""
+    u = 0.0
+    while u == 0.0:
+        u = rand.random()
+    return u
+
+
+def _skip(rand, w):
+    """The number of tuples to skip before the next replacement, for a
+    reservoir whose threshold is w."""
+    return int(math.floor(math.log(_uniform(rand)) / math.log(1 - w)))
+
+
+def _threshold(rand, k):
+    return math.exp(math.log(_uniform(rand)) / k)
+
+
+def reservoir_sample(tuples, sample_size, rand=random):
+    """Return sample_size tuples drawn without replacement, in no
+    particular order.
+
+    :raises ValueError: if there are fewer than sample_size tuples
+    """
+    it = iter(tuples)
+    reservoir = list(itertools.islice(it, sample_size))
+    if len(reservoir) < sample_size:
+        raise ValueError("sample larger than population")
+    if sample_size == 0:
+        return reservoir
+
+    w = _threshold(rand, sample_size)
+    while True:
+        skipped = _skip(rand, w)
+        try:
+            tpl = next(itertools.islice(it, skipped, None))
+        except StopIteration:
+            return reservoir
+        reservoir[rand.randrange(sample_size)] = tpl
+        w *= _threshold(rand, sample_size)
+
+
+def reservoir_sample_with_replacement(tuples, sample_size, rand=random):
+    """Return sample_size tuples drawn with replacement, in no particular
+    order.
+
+    :raises ValueError: if there are no tuples and sample_size > 0
+    """
+    if sample_size == 0:
+        return []
+    it = iter(tuples)
+    try:
+        first = next(it)
+    except StopIteration:
+        raise ValueError("cannot sample from an empty input")
+
+    reservoir = [first] * sample_size
+    # (index of the next tuple that replaces the slot, threshold, slot)
+    replacements = []
+    for slot in range(sample_size):
+        w = _uniform(rand)
+        replacements.append((1 + _skip(rand, w) + 1, w, slot))
+    heapq.heapify(replacements)
+
+    # The index of the next tuple of it, counting from 1
+    index = 2
+    while True:
+        target = replacements[0][0]
+        try:
+            tpl = next(itertools.islice(it, target - index, None))
+        except StopIteration:
+            return reservoir
+        index = target + 1
+        # Every slot that is due at this tuple takes it
+        while replacements[0][0] == target:
+            _, w, slot = replacements[0]
+            reservoir[slot] = tpl
+            w *= _uniform(rand)
+            heapq.heapreplace(replacements,
+                              (target + _skip(rand, w) + 1, w, slot))
+
+
+def bernoulli_sample(tuples, fraction, rand=random):
+    """Iterate over the tuples, keeping each with probability fraction."""
+    if fraction >= 1:
+        for tpl in tuples:
+            yield tpl
+        return
+    if fraction <= 0:
+        return
+    # Skip geometrically distributed gaps rather than drawing a random
+    # number for each tuple
+    log_q = math.log(1 - fraction)
+    it = iter(tuples)
+    while True:
+        gap = int(math.floor(math.log(_uniform(rand)) / log_q))
+        try:
+            yield next(itertools.islice(it, gap, None))
+        except StopIteration:
+            return
+
+
+def _poisson(rand, mean):
+    """Draw a Poisson distributed number (Knuth's method; mean is small)."""
+    limit = math.exp(-mean)
+    count = 0
+    product = rand.random()
+    while product > limit:
+        count += 1
+        product *= rand.random()
+    return count
+
+
+def poisson_sample(tuples, fraction, rand=random):
+    """Iterate over the tuples, repeating each a Poisson distributed number
+    of times whose mean is fraction: a sample with replacement of about
+    fraction times the number of tuples."""
+    if fraction <= 0:
+        return
+    for tpl in tuples:
+        for _ in range(_poisson(rand, fraction)):
+            yield tpl
@@ -0,0 +1,58 @@
+import collections
+import random
+import unittest
+
+from raco import sampling
+
+
+class SamplingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(3)
+
+    def test_reservoir_sample(self):
+        sample = sampling.reservoir_sample(iter(range(1000)), 10, self.rand)
+        self.assertEquals(len(sample), 10)
+        self.assertEquals(len(set(sample)), 10)
+        self.assertEquals(sorted(sampling.reservoir_sample(range(5), 5)),
+                          range(5))
+        self.assertEquals(sampling.reservoir_sample(range(5), 0), [])
+        with self.assertRaises(ValueError):
+            sampling.reservoir_sample(range(5), 6)
+
+    def test_reservoir_sample_uniform(self):
+        """Every tuple is about as likely to be sampled."""
+        counts = collections.Counter()
+        for _ in range(2000):
+            counts.update(sampling.reservoir_sample(range(20), 5, self.rand))
+        # Each tuple is expected 500 times
+        self.assertEquals(len(counts), 20)
+        self.assertLess(max(counts.values()) - min(counts.values()), 150)
+
+    def test_reservoir_sample_with_replacement(self):
+        sample = sampling.reservoir_sample_with_replacement(
+            iter(range(10)), 1000, self.rand)
+        self.assertEquals(len(sample), 1000)
+        counts = collections.Counter(sample)
+        # Each tuple is expected 100 times
+        self.assertEquals(len(counts), 10)
+        self.assertLess(max(counts.values()) - min(counts.values()), 80)
+        self.assertEquals(
+            sampling.reservoir_sample_with_replacement([7], 3), [7, 7, 7])
+        with self.assertRaises(ValueError):
+            sampling.reservoir_sample_with_replacement([], 1)
+
+    def test_bernoulli_sample(self):
+        sample = list(sampling.bernoulli_sample(iter(range(10000)), 0.1,
+                                                self.rand))
+        self.assertEquals(sample, sorted(set(sample)))
+        self.assertTrue(900 < len(sample) < 1100)
+        self.assertEquals(list(sampling.bernoulli_sample(range(5), 0)), [])
+        self.assertEquals(list(sampling.bernoulli_sample(range(5), 1)),
+                          range(5))
+
+    def test_poisson_sample(self):
+        sample = list(sampling.poisson_sample(iter(range(10000)), 0.5,
+                                              self.rand))
+        self.assertTrue(4700 < len(sample) < 5300)
+        self.assertGreater(len(sample), len(set(sample)))
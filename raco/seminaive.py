@@ -0,0 +1,205 @@
+"""
+Semi-naive evaluation of the IDB relations of a do/until convergence loop.
+
+An UntilConvergence operator has one IDBController per IDB relation. The
+first input of an IDBController computes its initial tuples and the second
+input computes new tuples from the current IDB relations, which it reads
+through ScanIDB operators (or, in Myria plans, through consumers of the
+IDBController). Each iteration evaluates the second inputs over the delta
+relations only, i.e., the tuples that the previous iteration added, and the
+loop stops when no IDB relation changes.
+"""
+
+import collections
+import itertools
+
+from raco import algebra
+from raco.expression import aggregate
+from raco.expression.evaluator import compile_tuple_evaluator
+
+
+class IterationStats(collections.namedtuple('IterationStats',
+                                            'iteration seconds deltas')):
+    """The time taken by an iteration and the number of tuples it added to
+    each IDB relation (a dict by IDB name)."""
+
+    def __str__(self):
+        return 'iteration {i}: {d} ({s:.3f}s)'.format(
+            i=self.iteration, s=self.seconds,
+            d=', '.join('{n}={c}'.format(n=n, c=c)
+                        for n, c in sorted(self.deltas.iteritems())))
+
+
+def delta_name(idb_name):
+    return '__{n}_delta'.format(n=idb_name)
+
+
+def old_name(idb_name):
+    return '__{n}_old'.format(n=idb_name)
+
+
+def find_idb_controller(op):
+    """Return the IDBController below a chain of unary operators, if any.
+
+    In Myria plans, IDBControllers are wrapped by producers and sinks."""
+    while (isinstance(op, algebra.UnaryOperator) and
+           not isinstance(op, algebra.EOSController)):
+        op = op.input
+    if isinstance(op, algebra.IDBController):
+        return op
+    return None
+
+
+def idb_reference(op):
+    """Return the IDBController that op reads, or None if op is not a
+    reference to an IDB relation."""
+    if isinstance(op, algebra.ScanIDB):
+        return op.idbcontroller
+    if op.stop_recursion:
+        return find_idb_controller(op)
+    return None
+
+
+def idb_references(op):
+    """The IDBControllers of the IDB references in the plan rooted at op,
+    in the order in which bind_idb_references visits them."""
+    controller = idb_reference(op)
+    if controller is not None:
+        return [controller]
+    return list(itertools.chain.from_iterable(
+        idb_references(child) for child in op.children()))
+
+
+def bind_idb_references(op, bind):
+    """Copy the plan rooted at op, replacing the k-th IDB reference by a
+    ScanTemp of the temporary relation bind(controller, k)."""
+    counter = itertools.count()
+
+    def rewrite(op):
+        controller = idb_reference(op)
+        if controller is None:
+            # Operators forbid copy.copy
+            new_op = op.__class__.__new__(op.__class__)
+            new_op.__dict__.update(op.__dict__)
+            return new_op.apply(rewrite)
+
+        scan = algebra.ScanTemp(bind(controller, next(counter)),
+                                controller.scheme())
+        if isinstance(op, algebra.ScanIDB):
+            return scan
+        # Keep the exchanges between the reference and the IDBController
+        chain = []
+        while op is not controller:
+            chain.append(op)
+            op = op.input
+        for unary in reversed(chain):
+            new_op = unary.__class__.__new__(unary.__class__)
+            new_op.__dict__.update(unary.__dict__)
+            new_op.input = scan
+            scan = new_op
+        return scan
+
+    return rewrite(op)
+
+
+def semi_naive_plans(op):
+    """Return the plans whose union computes the new tuples of op from the
+    delta relations.
+
+    A tuple derived from tuples t_1 ... t_m read by the m IDB references of
+    op is new iff some t_k is in a delta relation. With k the first such
+    reference, the k-th plan reads the delta relation at reference k, the
+    old relations (without their deltas) before it and the current
+    relations after it, so that each new derivation is computed once.
+    """
+    count = len(idb_references(op))
+
+    def plan(k):
+        def bind(controller, j):
+            if j < k:
+                return old_name(controller.name)
+            elif j == k:
+                return delta_name(controller.name)
+            return controller.name
+        return bind_idb_references(op, bind)
+
+    return [plan(k) for k in range(count)]
+
+
+class IDBState(object):
+    """The tuples of an IDB relation, combined by the aggregate of its
+    IDBController: duplicate elimination (no aggregate), the minimum value
+    for each key (MIN or LEXMIN), or the number of times that each key was
+    derived (COUNTALL, possibly with the threshold of a CountFilter)."""
+
+    def __init__(self, controller):
+        self.name = controller.name
+        self.scheme = controller.scheme()
+        self.key_columns, self.agg = controller.get_group_agg()
+
+        # The expressions that compute the IDB tuple from an input tuple,
+        # and the positions of the aggregated values in the IDB tuple
+        self.exprs = []
+        self.value_columns = []
+        self.count_column = None
+        for emit in controller.emits:
+            sexpr = emit.sexprs[0]
+            if isinstance(sexpr, aggregate.COUNTALL):
+                self.count_column = len(self.exprs)
+            elif isinstance(sexpr, aggregate.LEXMIN):
+                for operand in sexpr.operands:
+                    self.value_columns.append(len(self.exprs))
+                    self.exprs.append(operand)
+            elif isinstance(sexpr, aggregate.MIN):
+                self.value_columns.append(len(self.exprs))
+                self.exprs.append(sexpr.input)
+            else:
+                self.exprs.append(sexpr)
+        # The inputs have the same attributes, but not always the same
+        # names: the IDBController names them after its first nonempty input
+        inputs = [child for child in controller.children()[:2]
+                  if child is not None and
+                  not isinstance(child, algebra.EmptyRelation)]
+        self._evaluator = compile_tuple_evaluator(self.exprs,
+                                                  inputs[0].scheme())
+
+        # The IDB tuples, by key
+        self.contents = collections.OrderedDict()
+        self.counts = collections.Counter()
+
+    def tuples(self):
+        return self.contents.values()
+
+    def update(self, tuples):
+        """Add the tuples output by an input of the IDBController.
+
+        :returns: the list of tuples added to the IDB relation (the delta)
+        """
+        evaluator = self._evaluator
+        changed = collections.OrderedDict()
+        if self.count_column is not None:
+            threshold = getattr(self.agg, 'threshold', None)
+            for tpl in tuples:
+                key = evaluator(tpl)
+                self.counts[key] += 1
+                count = self.counts[key]
+                if threshold is None or count == threshold:
+                    changed[key] = (key[:self.count_column] + (count,) +
+                                    key[self.count_column:])
+        elif self.agg is not None:
+            for tpl in tuples:
+                row = evaluator(tpl)
+                key = tuple(row[c] for c in self.key_columns)
+                value = tuple(row[c] for c in self.value_columns)
+                current = changed.get(key, self.contents.get(key))
+                if (current is None or
+                        value < tuple(current[c] for c in self.value_columns)):
+                    changed[key] = row
+        else:
+            for tpl in tuples:
+                row = evaluator(tpl)
+                if row not in self.contents:
+                    changed[row] = row
+
+        self.contents.update(changed)
+        return changed.values()
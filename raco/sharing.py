@@ -0,0 +1,188 @@
+"""
+Find the subplans that occur more than once in a plan, so that they are
+evaluated once.
+
+Identical subplans are common in MyriaL plans: the interpreter copies the
+plan of a variable into every expression that uses it, so a self-join of a
+derived relation contains two copies of its plan. Two subplans are
+identical if they have the same fingerprint, which is computed bottom-up
+from the class and the fields of each operator (those that __eq__ compares;
+reprs leave some of them out) with its children replaced by their
+fingerprints.
+
+share_subplans rewrites a plan into a plan that reads each shared subplan
+from a temporary relation, and a list of the subplans that compute these
+relations.
+
+Subplans whose results may differ from one evaluation to the next, such as
+samples and expressions that call random(), are not shared: each copy is an
+independent draw.
+"""
+
+import collections
+
+from raco import algebra
+from raco.expression import Expression
+from raco.expression.function import PYUDF, RANDOM
+
+# Sources that are not worth materializing: scans read relations that are
+# stored already
+UNSHARED_OPERATORS = (algebra.Scan, algebra.ScanTemp, algebra.ScanIDB,
+                      algebra.EmptyRelation, algebra.SingletonRelation)
+
+# Operators whose results may differ between evaluations, by name: the
+# Myria backend defines its sampling operators as MyriaSample and
+# MyriaCalculateSamplingDistribution
+NONDETERMINISTIC_OPERATORS = ('SampleScan', 'Sample',
+                              'CalculateSamplingDistribution')
+# Expressions whose values may differ between evaluations
+NONDETERMINISTIC_EXPRESSIONS = (RANDOM, PYUDF)
+
+# Fields of operators that do not describe what they compute
+IGNORED_FIELDS = ('_memo',)
+
+
+class _Fingerprint(object):
+    """A placeholder for a child operator in the repr of its parent."""
+
+    def __init__(self, key):
+        self.key = key
+
+    def __repr__(self):
+        return '#{k}'.format(k=self.key)
+
+
+def _copy(op, f):
+    """Copy op, replacing each child c by f(c)."""
+    # Operators forbid copy.copy
+    new_op = op.__class__.__new__(op.__class__)
+    new_op.__dict__.update(op.__dict__)
+    return new_op.apply(f)
+
+
+def _structure(op):
+    """The class and the fields of op, as text."""
+    fields = sorted((name, value) for name, value in op.__dict__.iteritems()
+                    if name not in IGNORED_FIELDS)
+    return repr((op.__class__.__module__, op.__class__.__name__, fields))
+
+
+def expressions(op):
+    """Iterate over the expressions of an operator, e.g., its condition or
+    the expressions of its emitters."""
+    for value in op.__dict__.itervalues():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for v in values:
+            for item in (v if isinstance(v, tuple) else [v]):
+                if isinstance(item, Expression):
+                    yield item
+
+
+def is_deterministic(op):
+    """Whether the plan rooted at op returns the same tuples every time
+    that it is evaluated over the same inputs."""
+    for node in op.walk():
+        if node.opname().endswith(NONDETERMINISTIC_OPERATORS):
+            return False
+        for expr in expressions(node):
+            if any(isinstance(e, NONDETERMINISTIC_EXPRESSIONS)
+                   for e in expr.walk()):
+                return False
+    return True
+
+
+def _shareable(op):
+    return not (op.stop_recursion or
+                any(child is None for child in op.children()))
+
+
+def _fingerprints(op):
+    texts = {}
+    keys = {}
+    nodes = {}
+
+    def visit(op):
+        if id(op) in keys:
+            return keys[id(op)]
+        if _shareable(op):
+            for child in op.children():
+                visit(child)
+            text = _structure(
+                _copy(op, lambda c: _Fingerprint(keys[id(c)])))
+        else:
+            # Recursive plans refer to operators above them
+            text = ('unique', id(op))
+        key = texts.setdefault(text, len(texts))
+        keys[id(op)] = key
+        nodes.setdefault(key, op)
+        return key
+
+    visit(op)
+    return texts, keys, nodes
+
+
+def fingerprints(op):
+    """Compute the fingerprints of the operators in the plan rooted at op.
+
+    :returns: a tuple (keys, nodes), where keys maps the id of each operator
+    to a small integer that identifies its fingerprint, and nodes maps each
+    fingerprint to an operator that has it
+    """
+    _, keys, nodes = _fingerprints(op)
+    return keys, nodes
+
+
+def fingerprint(op):
+    """A text that identifies the plan rooted at op: two plans have the
+    same text if and only if they are identical."""
+    texts, _, _ = _fingerprints(op)
+    # The keys are numbered in the same order in identical plans
+    return repr(sorted(texts, key=texts.get))
+
+
+def shared_fingerprints(op):
+    """Return the fingerprints of the subplans of op that have more than one
+    parent, counting the identical copies of a parent once. Subplans that
+    are not deterministic are not shared."""
+    keys, nodes = fingerprints(op)
+    parents = collections.Counter()
+    for node in nodes.itervalues():
+        if _shareable(node):
+            for child in node.children():
+                parents[keys[id(child)]] += 1
+    return keys, set(key for key, count in parents.iteritems()
+                     if count > 1 and _shareable(nodes[key]) and
+                     not isinstance(nodes[key], UNSHARED_OPERATORS) and
+                     is_deterministic(nodes[key]))
+
+
+def share_subplans(op, temp_name):
+    """Replace the shared subplans of op by ScanTemps.
+
+    :param temp_name: A function that returns a new temporary relation name
+    :returns: a tuple (plan, subplans), where subplans is a list of
+    (name, subplan) pairs in the order in which they must be evaluated.
+    The plans are copies; op is not modified.
+    """
+    if not _shareable(op):
+        return op, []
+    keys, shared = shared_fingerprints(op)
+    if not shared:
+        return op, []
+
+    names = {}
+    subplans = []
+
+    def rewrite(node):
+        if not _shareable(node):
+            return node
+        key = keys[id(node)]
+        if key not in shared:
+            return _copy(node, rewrite)
+        if key not in names:
+            subplan = _copy(node, rewrite)
+            names[key] = temp_name()
+            subplans.append((names[key], subplan))
+        return algebra.ScanTemp(names[key], node.scheme())
+
+    return _copy(op, rewrite), subplans
@@ -0,0 +1,169 @@
+import collections
+import copy
+import unittest
+
+from raco import sharing, types
+from raco.algebra import (CrossProduct, Distinct, NaryJoin, Scan, ScanTemp,
+                          Select, Union, UnionAll)
+from raco.expression import GT, NumericLiteral, UnnamedAttributeRef
+from raco.fakedb import FakeDatabase
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+import raco.myrial.interpreter as interpreter
+import raco.myrial.parser as parser
+
+
+class CountingDatabase(FakeDatabase):
+    """A FakeDatabase that counts the scans of persistent relations."""
+
+    def __init__(self, **kwargs):
+        super(CountingDatabase, self).__init__(**kwargs)
+        self.scans = 0
+
+    def scan(self, op):
+        self.scans += 1
+        return super(CountingDatabase, self).scan(op)
+
+
+class SharingTest(unittest.TestCase):
+
+    scheme = Scheme([('id', types.LONG_TYPE), ('salary', types.LONG_TYPE)])
+    key = RelationKey.from_string('public:adhoc:emp')
+
+    def setUp(self):
+        self.db = CountingDatabase()
+        self.db.ingest(self.key,
+                       collections.Counter([(1, 10), (2, 20), (3, 30)]),
+                       self.scheme)
+
+    def select(self, value):
+        return Select(GT(UnnamedAttributeRef(1), NumericLiteral(value)),
+                      Scan(self.key, self.scheme))
+
+    def test_fingerprints(self):
+        x = self.select(15)
+        plan = CrossProduct(x, copy.deepcopy(x))
+        keys, _ = sharing.fingerprints(plan)
+        self.assertEquals(keys[id(plan.left)], keys[id(plan.right)])
+
+        plan = CrossProduct(x, self.select(25))
+        keys, _ = sharing.fingerprints(plan)
+        self.assertNotEquals(keys[id(plan.left)], keys[id(plan.right)])
+        self.assertEquals(keys[id(plan.left.input)],
+                          keys[id(plan.right.input)])
+
+    def test_fields(self):
+        """Operators whose reprs leave out some fields are identical only
+        if all of their fields are."""
+        scan = Scan(self.key, self.scheme)
+        joins = [NaryJoin([scan, scan], [[UnnamedAttributeRef(i),
+                                          UnnamedAttributeRef(2)]])
+                 for i in (1, 0)]
+        self.assertEquals(repr(joins[0]), repr(joins[1]))
+        plan = UnionAll(joins)
+        keys, _ = sharing.fingerprints(plan)
+        self.assertNotEquals(keys[id(joins[0])], keys[id(joins[1])])
+        self.assertNotEquals(sharing.fingerprint(joins[0]),
+                             sharing.fingerprint(joins[1]))
+        self.assertEquals(sharing.fingerprint(joins[0]),
+                          sharing.fingerprint(copy.deepcopy(joins[0])))
+
+        expected = collections.Counter()
+        for join in joins:
+            expected.update(self.db.evaluate(join))
+        self.assertEquals(collections.Counter(self.db.evaluate(plan)),
+                          expected)
+
+    def test_share_subplans(self):
+        x = self.select(15)
+        plan = CrossProduct(x, copy.deepcopy(x))
+        names = iter(['t0', 't1'])
+        shared, subplans = sharing.share_subplans(plan, lambda: next(names))
+        self.assertEquals(subplans, [('t0', x)])
+        self.assertEquals(shared.left, ScanTemp('t0', x.scheme()))
+        self.assertEquals(shared.right, ScanTemp('t0', x.scheme()))
+        # The plan is not modified
+        self.assertEquals(plan.left, x)
+
+    def test_shared_parent(self):
+        """Only the largest shared subplans are materialized."""
+        x = Distinct(self.select(15))
+        plan = Union(x, copy.deepcopy(x))
+        _, subplans = sharing.share_subplans(plan, lambda: 't')
+        self.assertEquals([subplan for name, subplan in subplans], [x])
+
+    def test_evaluate_once(self):
+        x = self.select(15)
+        plan = CrossProduct(x, copy.deepcopy(x))
+        self.assertEquals(sorted(self.db.evaluate(plan)),
+                          [(2, 20, 2, 20), (2, 20, 3, 30),
+                           (3, 30, 2, 20), (3, 30, 3, 30)])
+        self.assertEquals(self.db.scans, 1)
+        self.assertEquals(list(self.db.temp_tables.iteritems()), [])
+
+    def test_self_join(self):
+        query = """
+        emp = scan(public:adhoc:emp);
+        x = [from emp where salary > 15 emit *];
+        y = [from x as a, x as b where a.id == b.id emit a.id, b.salary];
+        store(y, OUTPUT);
+        """
+        for physical in (False, True):
+            processor = interpreter.StatementProcessor(self.db, True)
+            processor.evaluate(parser.Parser().parse(query))
+            if physical:
+                plan = processor.get_physical_plan()
+            else:
+                plan = processor.get_logical_plan()
+            self.db.scans = 0
+            self.db.evaluate(plan)
+            self.assertEquals(self.db.scans, 1)
+            self.assertEquals(self.db.get_table('OUTPUT'),
+                              collections.Counter([(2, 20), (3, 30)]))
+
+    def test_memory_budget(self):
+        """With a memory budget, shared subplans are evaluated once per
+        copy rather than held in memory."""
+        db = CountingDatabase(memory_budget=1024 * 1024)
+        db.ingest(self.key, self.db.get_table(self.key), self.scheme)
+        x = self.select(15)
+        plan = CrossProduct(x, copy.deepcopy(x))
+        self.assertEquals(len(list(db.evaluate(plan))), 4)
+        self.assertEquals(db.scans, 2)
+
+    def evaluate_query(self, query):
+        r_key = RelationKey.from_string('public:adhoc:R')
+        self.db.ingest(r_key,
+                       collections.Counter((i,) for i in range(1000)),
+                       Scheme([('x', types.LONG_TYPE)]))
+        processor = interpreter.StatementProcessor(self.db, True)
+        processor.evaluate(parser.Parser().parse(query))
+        plan = processor.get_logical_plan()
+        self.db.evaluate(plan)
+        return plan, self.db.get_table('OUTPUT')
+
+    def test_random(self):
+        """Copies of a subplan that calls random() are independent."""
+        query = """
+        R = scan(public:adhoc:R);
+        d = [from R emit random() as v];
+        e = [from R emit random() as v];
+        f = [from d, e where d.v == e.v emit d.v];
+        store(f, OUTPUT);
+        """
+        plan, output = self.evaluate_query(query)
+        self.assertEquals(output, collections.Counter())
+        self.assertFalse(sharing.is_deterministic(plan))
+
+    def test_samples(self):
+        """Copies of a sample are independent samples."""
+        query = """
+        a = samplescan(public:adhoc:R, 5, WoR);
+        b = samplescan(public:adhoc:R, 5, WoR);
+        c = [from a, b where a.x == b.x emit a.x];
+        store(c, OUTPUT);
+        """
+        plan, output = self.evaluate_query(query)
+        self.assertLess(sum(output.values()), 5)
+        _, shared = sharing.shared_fingerprints(plan)
+        self.assertEquals(shared, set())
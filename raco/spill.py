@@ -0,0 +1,394 @@
+"""
+Evaluate operators within a memory budget by spilling to temporary files.
+
+The operators of the FakeDatabase keep their state (hash tables, sets,
+groups and sort buffers) in Python memory. With a MemoryBudget, an operator
+whose state outgrows the budget writes tuples to temporary files instead:
+
+- sort writes sorted runs and merges them (external merge sort);
+- hash_join partitions both inputs by the hash of the join key and joins
+  each pair of partitions (grace hash join);
+- distinct, difference, intersection and aggregate keep the groups that
+  fit in memory and partition the tuples of the other groups, which are
+  processed one partition at a time.
+
+Partitions that are still too large are partitioned again, on other bits of
+the hash, up to MAX_DEPTH times; a partition of tuples with a single
+key cannot be split, so it is then processed in memory.
+
+The size of a tuple is estimated with sys.getsizeof, so the budget bounds
+the memory used by the state of one operator only approximately.
+"""
+
+import collections
+import cPickle
+import heapq
+import itertools
+import sys
+import tempfile
+
+# The number of partitions that an operator spills to
+DEFAULT_FANOUT = 16
+
+# The number of times that a partition may be partitioned again
+MAX_DEPTH = 4
+
+# The number of tuples that are pickled at once
+BATCH_SIZE = 1024
+
+# The estimated memory used by a hash table entry, besides its tuple
+ENTRY_OVERHEAD = 32
+
+# The estimated memory used by the state of a group
+GROUP_OVERHEAD = 512
+
+
+def tuple_size(tpl):
+    """Estimate the memory used by a tuple and its values."""
+    return (sys.getsizeof(tpl) + sum(sys.getsizeof(v) for v in tpl) +
+            ENTRY_OVERHEAD)
+
+
+class SpillStats(object):
+    """The number of files, tuples and bytes spilled to disk."""
+
+    def __init__(self):
+        self.files = 0
+        self.tuples = 0
+        self.bytes = 0
+
+    def __str__(self):
+        return 'spilled {t} tuples ({b} bytes) to {f} files'.format(
+            t=self.tuples, b=self.bytes, f=self.files)
+
+
+class SpillFile(object):
+    """A temporary file of pickled tuples, which is deleted when closed."""
+
+    def __init__(self, directory, stats):
+        self.file = tempfile.TemporaryFile(prefix='raco-spill-',
+                                           dir=directory)
+        self.stats = stats
+        self.batch = []
+        self.count = 0
+
+    def add(self, tpl):
+        self.batch.append(tpl)
+        if len(self.batch) == BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        cPickle.dump(self.batch, self.file, cPickle.HIGHEST_PROTOCOL)
+        self.count += len(self.batch)
+        self.batch = []
+
+    def finish(self):
+        """Finish writing the file and record it in the spill stats."""
+        if self.batch:
+            self._flush()
+        self.file.flush()
+        self.stats.files += 1
+        self.stats.tuples += self.count
+        self.stats.bytes += self.file.tell()
+        return self
+
+    def __iter__(self):
+        self.file.seek(0)
+        while True:
+            try:
+                batch = cPickle.load(self.file)
+            except EOFError:
+                return
+            for tpl in batch:
+                yield tpl
+
+    def close(self):
+        self.file.close()
+
+
+class Partitioner(object):
+    """Spill tuples to one file per partition, by the hash of their key."""
+
+    def __init__(self, budget, depth, key=None):
+        self.budget = budget
+        self.depth = depth
+        self.key = key
+        self.files = [None] * budget.fanout
+
+    def add(self, tpl):
+        key = tpl if self.key is None else self.key(tpl)
+        # Each depth uses different bits of the hash, since the tuples of a
+        # partition agree on the bits used by the depths above it
+        fanout = len(self.files)
+        i = (hash(key) // fanout ** self.depth) % fanout
+        if self.files[i] is None:
+            self.files[i] = self.budget.spill_file()
+        self.files[i].add(tpl)
+
+    def extend(self, tuples):
+        for tpl in tuples:
+            self.add(tpl)
+        return self
+
+    def finish(self):
+        """Return the partitions; empty partitions are None."""
+        return [f and f.finish() for f in self.files]
+
+
+def _partitions(*partitioners):
+    """Iterate over the i-th partitions of several partitioners at once,
+    as lists of tuple iterables, closing their files afterwards."""
+    for files in zip(*[p.finish() for p in partitioners]):
+        try:
+            yield [f if f is not None else [] for f in files]
+        finally:
+            for f in files:
+                if f is not None:
+                    f.close()
+
+
+class MemoryBudget(object):
+    """Bound the memory used by the state of each operator.
+
+    :param budget: The budget in bytes, or None for no limit
+    :param directory: The directory of the spill files; by default, the
+    system's temporary directory
+    :param fanout: The number of partitions of a spilled input
+    """
+
+    def __init__(self, budget=None, directory=None, fanout=DEFAULT_FANOUT):
+        self.budget = budget
+        self.directory = directory
+        self.fanout = fanout
+        self.stats = SpillStats()
+        # A function that is called with the number of tuples or groups
+        # that an operator holds in memory, e.g., to profile operators
+        self.observer = None
+
+    def _held(self, count):
+        if self.observer is not None:
+            self.observer(count)
+
+    def spill_file(self):
+        return SpillFile(self.directory, self.stats)
+
+    def fill(self, tuples):
+        """Read tuples until the budget is used up.
+
+        :returns: a tuple (buffer, rest), where rest is an iterator over
+        the remaining tuples, or None if they all fit in the buffer
+        """
+        it = iter(tuples)
+        buf = []
+        used = 0
+        for tpl in it:
+            used += tuple_size(tpl)
+            if used > self.budget and buf:
+                return buf, itertools.chain([tpl], it)
+            buf.append(tpl)
+        return buf, None
+
+    def sort(self, tuples, key):
+        """Sort tuples by key, with an external merge sort if they do not
+        fit in memory. The sort is stable."""
+        if self.budget is None:
+            buf = sorted(tuples, key=key)
+            self._held(len(buf))
+            return iter(buf)
+        return self._merge_sort(tuples, key)
+
+    def _merge_sort(self, tuples, key):
+        runs = []
+        buf, rest = self.fill(tuples)
+        while rest is not None:
+            self._held(len(buf))
+            buf.sort(key=key)
+            run = self.spill_file()
+            for tpl in buf:
+                run.add(tpl)
+            runs.append(run.finish())
+            buf, rest = self.fill(rest)
+        self._held(len(buf))
+        buf.sort(key=key)
+        if not runs:
+            for tpl in buf:
+                yield tpl
+            return
+
+        # Merge the runs; ties are broken by run, so the order is stable
+        try:
+            sources = [iter(run) for run in runs] + [iter(buf)]
+            heap = []
+            for i, source in enumerate(sources):
+                for tpl in source:
+                    heap.append((key(tpl), i, tpl))
+                    break
+            heapq.heapify(heap)
+            while heap:
+                _, i, tpl = heap[0]
+                yield tpl
+                for nxt in sources[i]:
+                    heapq.heapreplace(heap, (key(nxt), i, nxt))
+                    break
+                else:
+                    heapq.heappop(heap)
+        finally:
+            for run in runs:
+                run.close()
+
+    def distinct(self, tuples):
+        """Iterate over the distinct tuples."""
+        if self.budget is None:
+            seen = set(tuples)
+            self._held(len(seen))
+            return iter(seen)
+        return self._distinct(tuples, 0)
+
+    def _distinct(self, tuples, depth):
+        seen = set()
+        used = 0
+        partitioner = None
+        for tpl in tuples:
+            if tpl in seen:
+                continue
+            if partitioner is None:
+                used += tuple_size(tpl)
+                if used <= self.budget or depth >= MAX_DEPTH:
+                    seen.add(tpl)
+                    yield tpl
+                    continue
+                partitioner = Partitioner(self, depth)
+            # A tuple not seen yet
+            partitioner.add(tpl)
+        self._held(len(seen))
+        if partitioner is None:
+            return
+        del seen
+        for (partition,) in _partitions(partitioner):
+            for tpl in self._distinct(partition, depth + 1):
+                yield tpl
+
+    def difference(self, left, right):
+        """Iterate over the distinct tuples of left that are not in right."""
+        if self.budget is None:
+            result = set(left)
+            self._held(len(result))
+            result.difference_update(right)
+            return iter(result)
+        return self._set_operation(left, right, False, 0)
+
+    def intersection(self, left, right):
+        """Iterate over the distinct tuples that are in left and right."""
+        if self.budget is None:
+            result = set(left)
+            self._held(len(result))
+            result.intersection_update(right)
+            return iter(result)
+        return self._set_operation(left, right, True, 0)
+
+    def _set_operation(self, left, right, in_right, depth):
+        buf, rest = self.fill(right)
+        if rest is None or depth >= MAX_DEPTH:
+            right_set = set(buf)
+            if rest is not None:
+                right_set.update(rest)
+            self._held(len(right_set))
+            del buf
+            matches = (tpl for tpl in left if (tpl in right_set) == in_right)
+            for tpl in self._distinct(matches, 0):
+                yield tpl
+            return
+
+        right_parts = Partitioner(self, depth).extend(
+            itertools.chain(buf, rest))
+        del buf
+        left_parts = Partitioner(self, depth).extend(left)
+        for left_part, right_part in _partitions(left_parts, right_parts):
+            for tpl in self._set_operation(left_part, right_part, in_right,
+                                           depth + 1):
+                yield tpl
+
+    def hash_join(self, build, build_key, probe, probe_key, join):
+        """Join two inputs on equal keys, with a grace hash join if the
+        build input does not fit in memory.
+
+        :param join: A function that takes a hash table, which maps keys to
+        lists of build tuples, and an iterable of probe tuples, and
+        iterates over the joined tuples
+        """
+        if self.budget is None:
+            return join(self._hash_table(build, build_key), probe)
+        return self._grace_join(build, build_key, probe, probe_key, join, 0)
+
+    def _hash_table(self, tuples, key):
+        table = collections.defaultdict(list)
+        count = 0
+        for count, tpl in enumerate(tuples, 1):
+            table[key(tpl)].append(tpl)
+        self._held(count)
+        return table
+
+    def _grace_join(self, build, build_key, probe, probe_key, join, depth):
+        buf, rest = self.fill(build)
+        if rest is None or depth >= MAX_DEPTH:
+            if rest is not None:
+                buf.extend(rest)
+            table = self._hash_table(buf, build_key)
+            del buf
+            for tpl in join(table, probe):
+                yield tpl
+            return
+
+        build_parts = Partitioner(self, depth, build_key).extend(
+            itertools.chain(buf, rest))
+        del buf
+        probe_parts = Partitioner(self, depth, probe_key).extend(probe)
+        for build_part, probe_part in _partitions(build_parts, probe_parts):
+            for tpl in self._grace_join(build_part, build_key, probe_part,
+                                        probe_key, join, depth + 1):
+                yield tpl
+
+    def aggregate(self, tuples, key, new_group, update, initial_keys=()):
+        """Group tuples by key, with a partitioned hash aggregation if the
+        groups do not fit in memory.
+
+        :param new_group: A function that returns the state of a new group
+        :param update: A function that updates the state of a group with a
+        tuple
+        :param initial_keys: The keys of groups that exist even if no tuple
+        belongs to them
+        :returns: an iterator over (key, state) pairs
+        """
+        return self._aggregate(tuples, key, new_group, update,
+                               {k: new_group() for k in initial_keys}, 0)
+
+    def _aggregate(self, tuples, key, new_group, update, groups, depth):
+        used = 0
+        partitioner = None
+        for tpl in tuples:
+            k = key(tpl)
+            group = groups.get(k)
+            if group is None:
+                if partitioner is None:
+                    if self.budget is not None and depth < MAX_DEPTH:
+                        used += sys.getsizeof(k) + GROUP_OVERHEAD
+                    if self.budget is None or used <= self.budget:
+                        group = groups[k] = new_group()
+                    else:
+                        partitioner = Partitioner(self, depth, key)
+                if group is None:
+                    # The group is not in memory, nor will it ever be
+                    partitioner.add(tpl)
+                    continue
+            update(group, tpl)
+
+        self._held(len(groups))
+        for item in groups.iteritems():
+            yield item
+        if partitioner is None:
+            return
+        del groups
+        for (partition,) in _partitions(partitioner):
+            for item in self._aggregate(partition, key, new_group, update,
+                                        {}, depth + 1):
+                yield item
@@ -0,0 +1,139 @@
+import collections
+import random
+import unittest
+
+from raco import spill
+from raco.algebra import (Difference, Distinct, GroupBy, Intersection, Join,
+                          OrderBy, Scan, Union)
+from raco.expression import (COUNTALL, EQ, SUM, UnnamedAttributeRef)
+from raco.fakedb import FakeDatabase
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+from raco import types
+
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.memory = spill.MemoryBudget(4096, fanout=4)
+        rand = random.Random(1)
+        self.tuples = [(rand.randrange(300), rand.randrange(10))
+                       for _ in range(2000)]
+
+    def test_sort(self):
+        key = lambda tpl: tpl[0]
+        self.assertEquals(list(self.memory.sort(self.tuples, key)),
+                          sorted(self.tuples, key=key))
+        self.assertGreater(self.memory.stats.files, 1)
+        # The last run is merged from memory
+        self.assertLess(self.memory.stats.tuples, 2000)
+        self.assertGreater(self.memory.stats.bytes, 0)
+
+    def test_distinct(self):
+        result = list(self.memory.distinct(self.tuples))
+        self.assertEquals(sorted(result), sorted(set(self.tuples)))
+        self.assertGreater(self.memory.stats.files, 0)
+
+    def test_set_operations(self):
+        left, right = self.tuples[:1500], self.tuples[500:]
+        self.assertEquals(sorted(self.memory.difference(left, right)),
+                          sorted(set(left) - set(right)))
+        self.assertEquals(sorted(self.memory.intersection(left, right)),
+                          sorted(set(left) & set(right)))
+
+    def test_hash_join(self):
+        def join(table, probe):
+            for tpl in probe:
+                for match in table.get(tpl[0], ()):
+                    yield match + tpl
+
+        right = [(i, str(i)) for i in range(10)]
+        expected = [tpl + match for tpl in self.tuples for match in right
+                    if tpl[1] == match[0]]
+        result = self.memory.hash_join(self.tuples, lambda tpl: tpl[1],
+                                       right, lambda tpl: tpl[0], join)
+        self.assertEquals(sorted(result), sorted(expected))
+        self.assertGreater(self.memory.stats.files, 0)
+
+    def test_skewed_join(self):
+        """Partitions of a single key are joined in memory eventually."""
+        def join(table, probe):
+            for tpl in probe:
+                for match in table.get(tpl[0], ()):
+                    yield match + tpl
+
+        build = [(0, i) for i in range(500)]
+        result = self.memory.hash_join(build, lambda t: t[0], [(0,)],
+                                       lambda t: t[0], join)
+        self.assertEquals(len(list(result)), 500)
+
+    def test_aggregate(self):
+        def update(group, tpl):
+            group[0] += tpl[1]
+
+        groups = self.memory.aggregate(self.tuples, lambda tpl: tpl[0],
+                                       lambda: [0], update)
+        sums = collections.Counter()
+        for a, b in self.tuples:
+            sums[a] += b
+        self.assertEquals({k: g[0] for k, g in groups}, dict(sums))
+        self.assertGreater(self.memory.stats.files, 0)
+
+    def test_unlimited(self):
+        memory = spill.MemoryBudget()
+        self.assertEquals(sorted(memory.distinct(self.tuples)),
+                          sorted(set(self.tuples)))
+        self.assertEquals(memory.stats.files, 0)
+
+
+class SpillingDatabaseTest(unittest.TestCase):
+    """Operators over relations several times larger than the budget."""
+
+    scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE)])
+
+    def setUp(self):
+        self.db = FakeDatabase(memory_budget=8192)
+        self.reference = FakeDatabase()
+        rand = random.Random(2)
+        self.keys = {}
+        for name in ('R', 'S'):
+            key = RelationKey.from_string('public:adhoc:' + name)
+            contents = collections.Counter(
+                (rand.randrange(200), rand.randrange(50))
+                for _ in range(1500))
+            for db in (self.db, self.reference):
+                db.ingest(key, contents, self.scheme)
+            self.keys[name] = key
+
+    def scan(self, name):
+        return Scan(self.keys[name], self.scheme)
+
+    def check(self, op, ordered=False):
+        expected = list(self.reference.evaluate(op))
+        actual = list(self.db.evaluate(op))
+        if ordered:
+            self.assertEquals(actual, expected)
+        else:
+            self.assertEquals(collections.Counter(actual),
+                              collections.Counter(expected))
+        self.assertGreater(self.db.spill_stats.files, 0)
+
+    def test_join(self):
+        condition = EQ(UnnamedAttributeRef(1), UnnamedAttributeRef(3))
+        self.check(Join(condition, self.scan('R'), self.scan('S')))
+
+    def test_orderby(self):
+        self.check(OrderBy(self.scan('R'), [1, 0], [False, True]),
+                   ordered=True)
+        self.check(OrderBy(self.scan('R'), [1], [False]), ordered=True)
+
+    def test_groupby(self):
+        self.check(GroupBy([UnnamedAttributeRef(0)],
+                           [COUNTALL(), SUM(UnnamedAttributeRef(1))],
+                           self.scan('R')))
+
+    def test_set_operations(self):
+        self.check(Distinct(self.scan('R')))
+        self.check(Union(self.scan('R'), self.scan('S')))
+        self.check(Difference(self.scan('R'), self.scan('S')))
+        self.check(Intersection(self.scan('R'), self.scan('S')))
@@ -1,6 +1,9 @@
 import collections
 import unittest
 import itertools
+import os
+import shutil
+import tempfile
 
 from raco.dbconn import DBConnection
 from raco.fake_data import FakeData
@@ -74,3 +77,28 @@ class SQLLiteTest(unittest.TestCase, FakeData):
         expected = collections.Counter(it)
         actual = collections.Counter(self.conn1.get_table('emp'))
         self.assertEquals(actual, expected)
+
+    def test_batched_ingest(self):
+        conn = DBConnection(batch_size=3)
+        tuples = (tup for tup in FakeData.numbers_table.elements())
+        stats = conn.add_table("num", FakeData.numbers_schema, tuples)
+        self.assertEquals(stats.rows, len(list(
+            FakeData.numbers_table.elements())))
+        self.assertEquals(conn.get_table("num"), FakeData.numbers_table)
+
+        stats = conn.append_table("num", FakeData.numbers_table.elements())
+        self.assertEquals(conn.get_table("num"),
+                          FakeData.numbers_table + FakeData.numbers_table)
+        self.assertTrue(stats.rows_per_second > 0)
+
+    def test_scratch_pragmas(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            conn = DBConnection('sqlite:///' + os.path.join(tmpdir, 'db'),
+                                scratch=True)
+            conn.add_table("emp", FakeData.emp_schema, FakeData.emp_table)
+            self.assertEquals(conn.get_table("emp"), FakeData.emp_table)
+            mode = conn.engine.execute('PRAGMA journal_mode').scalar()
+            self.assertEquals(mode.lower(), 'off')
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,366 @@
+"""
+Column statistics, and the selectivities that are estimated from them.
+
+A Catalog may describe the columns of a relation with column_stats: a list
+with one ColumnStats per column (or None for a column without statistics),
+holding its number of distinct values (NDV), its number of nulls, its
+minimum and maximum, and an equi-depth histogram of its values.
+
+Scans carry the statistics of their relation, and the operators above them
+pass on the statistics of the columns that they copy (see
+Operator.column_stats). Select, Join, GroupBy and Distinct estimate their
+cardinality from them:
+
+- col = literal selects 1/NDV of the non-null tuples, or nothing if the
+  literal is outside of [min, max];
+- col < literal (and the other ranges) selects the fraction of the
+  histogram below the literal, interpolating within a bucket of numbers;
+- col1 = col2 selects 1/max(NDV1, NDV2) of the (cross product of the)
+  tuples;
+- AND, OR and NOT combine selectivities as if the conditions were
+  independent;
+- grouping or removing duplicates yields the product of the NDVs of the
+  columns, at most the number of input tuples.
+
+A condition that the statistics say nothing about has no estimate (None),
+so that the operators keep their previous rules of thumb.
+
+The output of a multiway join (NaryJoin) is bounded by the AGM bound
+(Atserias, Grohe and Marx; see agm_bound), which the NDVs of the join
+variables tighten.
+"""
+
+import bisect
+import math
+
+from raco.expression import (AND, OR, NOT, EQ, NEQ, LT, LTEQ, GT, GTEQ,
+                             Literal, NamedAttributeRef, UnnamedAttributeRef)
+
+# The selectivity of a part of a condition without an estimate
+DEFAULT_SELECTIVITY = 0.5
+
+# The number of buckets of the histograms that are computed from data
+HISTOGRAM_BUCKETS = 20
+
+# col > literal is literal < col
+_FLIPPED = {EQ: EQ, NEQ: NEQ, LT: GT, LTEQ: GTEQ, GT: LT, GTEQ: LTEQ}
+
+
+def _is_number(value):
+    return (isinstance(value, (int, long, float)) and
+            not isinstance(value, bool))
+
+
+class Histogram(object):
+    """An equi-depth histogram: the values of a column are split into
+    buckets holding about as many values each, and bounds[i] <= the
+    values of bucket i <= bounds[i + 1].
+
+    :param bounds: The sorted bounds of the buckets, one more than the
+                   number of buckets
+    """
+
+    def __init__(self, bounds):
+        assert len(bounds) >= 2, "a histogram has at least one bucket"
+        self.bounds = list(bounds)
+
+    @classmethod
+    def from_sorted(cls, values, buckets=HISTOGRAM_BUCKETS):
+        """The histogram of a sorted list of values, or None if it is
+        empty."""
+        n = len(values)
+        if n == 0:
+            return None
+        buckets = min(buckets, n)
+        return cls([values[i * n // buckets] for i in range(buckets)] +
+                   [values[-1]])
+
+    @property
+    def buckets(self):
+        return len(self.bounds) - 1
+
+    def fraction_below(self, value):
+        """The estimated fraction of the values that are less than
+        value."""
+        if value <= self.bounds[0]:
+            return 0.0
+        if value > self.bounds[-1]:
+            return 1.0
+        i = min(bisect.bisect_left(self.bounds, value) - 1,
+                self.buckets - 1)
+        low, high = self.bounds[i], self.bounds[i + 1]
+        if _is_number(value) and _is_number(low) and high > low:
+            within = float(value - low) / (high - low)
+        else:
+            within = 0.5
+        return (i + within) / self.buckets
+
+    def __eq__(self, other):
+        return isinstance(other, Histogram) and self.bounds == other.bounds
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Histogram({b!r})".format(b=self.bounds)
+
+
+class ColumnStats(object):
+    """The statistics of a column. Any of them may be unknown (None).
+
+    :param ndv: The number of distinct non-null values
+    :param null_count: The number of nulls
+    :param min: The least non-null value
+    :param max: The greatest non-null value
+    :param histogram: A Histogram of the non-null values
+    :param count: The number of non-null values
+    """
+
+    def __init__(self, ndv=None, null_count=None, min=None, max=None,
+                 histogram=None, count=None):
+        self.ndv = ndv
+        self.null_count = null_count
+        self.min = min
+        self.max = max
+        self.histogram = histogram
+        self.count = count
+
+    @classmethod
+    def from_values(cls, values, buckets=HISTOGRAM_BUCKETS):
+        """Compute the statistics of the values of a column."""
+        values = list(values)
+        non_null = sorted(v for v in values if v is not None)
+        return cls(ndv=len(set(non_null)),
+                   null_count=len(values) - len(non_null),
+                   min=non_null[0] if non_null else None,
+                   max=non_null[-1] if non_null else None,
+                   histogram=Histogram.from_sorted(non_null, buckets),
+                   count=len(non_null))
+
+    @classmethod
+    def from_dict(cls, d):
+        """Read the statistics of a column from a dictionary, e.g., in a
+        catalog file: {'ndv': 10, 'nulls': 0, 'min': 1, 'max': 100,
+        'histogram': [1, 20, 50, 100], 'count': 1000}, where every key is
+        optional."""
+        histogram = d.get('histogram')
+        return cls(ndv=d.get('ndv'),
+                   null_count=d.get('nulls'),
+                   min=d.get('min'),
+                   max=d.get('max'),
+                   histogram=Histogram(histogram) if histogram else None,
+                   count=d.get('count'))
+
+    def to_dict(self):
+        d = {'ndv': self.ndv, 'nulls': self.null_count, 'min': self.min,
+             'max': self.max, 'count': self.count,
+             'histogram': self.histogram and self.histogram.bounds}
+        return {k: v for k, v in d.iteritems() if v is not None}
+
+    def non_null_fraction(self):
+        if not self.null_count or self.count is None:
+            return 1.0
+        return float(self.count) / (self.count + self.null_count)
+
+    def _range_histogram(self):
+        """The histogram, or else a single bucket from min to max."""
+        if self.histogram is not None:
+            return self.histogram
+        if self.min is not None and self.max is not None:
+            return Histogram([self.min, self.max])
+        return None
+
+    def equal_fraction(self, value):
+        """The estimated fraction of the non-null values that equal value,
+        or None."""
+        if ((self.min is not None and value < self.min) or
+                (self.max is not None and value > self.max)):
+            return 0.0
+        if self.ndv:
+            return 1.0 / self.ndv
+        return None
+
+    def compare(self, cls, value):
+        """The estimated fraction of the tuples whose value in this column
+        compares to value as cls (e.g., LT for column < value), or None."""
+        if value is None:
+            return None
+        eq = self.equal_fraction(value)
+        if cls in (EQ, NEQ):
+            if eq is None:
+                return None
+            sel = eq if cls is EQ else 1 - eq
+        else:
+            histogram = self._range_histogram()
+            if histogram is None:
+                return None
+            below = histogram.fraction_below(value)
+            eq = eq or 0.0
+            sel = {LT: below,
+                   LTEQ: below + eq,
+                   GT: 1 - below - eq,
+                   GTEQ: 1 - below}[cls]
+        return min(max(sel, 0.0), 1.0) * self.non_null_fraction()
+
+    def __eq__(self, other):
+        return (isinstance(other, ColumnStats) and
+                self.__dict__ == other.__dict__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "ColumnStats(**{d!r})".format(d=self.to_dict())
+
+
+def analyze(tuples, width, buckets=HISTOGRAM_BUCKETS):
+    """Compute the statistics of each column of tuples with width
+    columns, in one pass over the tuples."""
+    columns = [[] for _ in range(width)]
+    for tpl in tuples:
+        for column, value in zip(columns, tpl):
+            column.append(value)
+    return [ColumnStats.from_values(column, buckets) for column in columns]
+
+
+def _column(expr, scheme):
+    """The position of the column that expr refers to, or None."""
+    if isinstance(expr, UnnamedAttributeRef):
+        return expr.position
+    if isinstance(expr, NamedAttributeRef) and expr.name in scheme:
+        return scheme.getPosition(expr.name)
+    return None
+
+
+def _combine(a, b, f):
+    if a is None and b is None:
+        return None
+    return f(DEFAULT_SELECTIVITY if a is None else a,
+             DEFAULT_SELECTIVITY if b is None else b)
+
+
+def selectivity(condition, scheme, stats):
+    """Estimate the fraction of the tuples of an input that satisfy
+    condition.
+
+    :param scheme: The scheme of the input
+    :param stats: The statistics of the columns of the input, a list of
+                  ColumnStats or None
+    :returns: the selectivity, or None if the statistics say nothing about
+              condition
+    """
+    def lookup(expr):
+        pos = _column(expr, scheme)
+        if pos is None or pos >= len(stats):
+            return None
+        return stats[pos]
+
+    def estimate(cond):
+        if isinstance(cond, AND):
+            return _combine(estimate(cond.left), estimate(cond.right),
+                            lambda a, b: a * b)
+        if isinstance(cond, OR):
+            return _combine(estimate(cond.left), estimate(cond.right),
+                            lambda a, b: a + b - a * b)
+        if isinstance(cond, NOT):
+            sel = estimate(cond.input)
+            return None if sel is None else 1 - sel
+
+        cls = type(cond)
+        if cls not in _FLIPPED:
+            return None
+        left, right = lookup(cond.left), lookup(cond.right)
+        if left is not None and right is not None:
+            ndvs = [s.ndv for s in (left, right) if s.ndv]
+            if cls not in (EQ, NEQ) or not ndvs:
+                return None
+            eq = 1.0 / max(ndvs)
+            return eq if cls is EQ else 1 - eq
+        if left is not None and isinstance(cond.right, Literal):
+            return left.compare(cls, cond.right.value)
+        if right is not None and isinstance(cond.left, Literal):
+            return right.compare(_FLIPPED[cls], cond.left.value)
+        return None
+
+    if not any(stats):
+        return None
+    return estimate(condition)
+
+
+def distinct_count(stats, positions, num_tuples):
+    """Estimate the number of distinct combinations of values of the
+    columns at positions, or None if the NDV of one of them is unknown."""
+    count = 1
+    for pos in positions:
+        if pos is None or pos >= len(stats) or stats[pos] is None or \
+                stats[pos].ndv is None:
+            return None
+        # A column of nulls is one group
+        count *= max(stats[pos].ndv, 1)
+    return min(count, num_tuples)
+
+
+# Tolerance of the simplex method
+_EPSILON = 1e-9
+
+
+def _max_packing(edges, num_variables):
+    """Solve the linear program: maximize the sum of y_v over the variables
+    subject to sum(y_v for v in edge) <= capacity for each (capacity, edge)
+    of edges, and y >= 0. The capacities are not negative, so the origin is
+    feasible; the simplex method with Bland's rule finds the optimum.
+
+    :returns: the optimal value of the sum
+    """
+    n, m = num_variables, len(edges)
+    # The rows of the tableau: the constraints with a slack variable each,
+    # and the objective (as z - sum(y) = 0)
+    rows = [[1.0 if v in edge else 0.0 for v in range(n)] +
+            [1.0 if i == j else 0.0 for j in range(m)] + [float(capacity)]
+            for i, (capacity, edge) in enumerate(edges)]
+    objective = [-1.0] * n + [0.0] * m + [0.0]
+    basis = range(n, n + m)
+
+    while True:
+        entering = next((j for j in range(n + m)
+                         if objective[j] < -_EPSILON), None)
+        if entering is None:
+            return objective[-1]
+        leaving = None
+        for i, row in enumerate(rows):
+            if row[entering] > _EPSILON:
+                ratio = row[-1] / row[entering]
+                if (leaving is None or ratio < best - _EPSILON or
+                        (ratio < best + _EPSILON and
+                         basis[i] < basis[leaving])):
+                    leaving, best = i, ratio
+        assert leaving is not None, "every variable is bounded by an edge"
+
+        pivot = rows[leaving]
+        factor = pivot[entering]
+        pivot[:] = [x / factor for x in pivot]
+        for row in rows + [objective]:
+            if row is not pivot and row[entering]:
+                factor = row[entering]
+                row[:] = [x - factor * p for x, p in zip(row, pivot)]
+        basis[leaving] = entering
+
+
+def agm_bound(relations):
+    """The AGM bound on the size of the natural join of relations: the
+    least product of |R|^w_R over the fractional edge covers w, which give
+    each variable a total weight of at least 1 over the relations that
+    contain it.
+
+    The bound is exp of the optimum of a linear program, which equals the
+    optimum of its dual, a fractional packing of the variables.
+
+    :param relations: A list of (size, set of variables) pairs, where the
+                      variables are numbered from 0
+    """
+    if not relations:
+        return 1.0
+    edges = [(math.log(max(size, 1)), variables)
+             for size, variables in relations]
+    num_variables = max(v for _, variables in edges for v in variables) + 1
+    return math.exp(_max_packing(edges, num_variables))
@@ -0,0 +1,249 @@
+import collections
+import unittest
+
+from raco import statistics, types
+from raco.algebra import Distinct, GroupBy, Join, NaryJoin, Scan, Select
+from raco.expression import (AND, EQ, GT, LT, LTEQ, NOT, OR, COUNTALL,
+                             NamedAttributeRef, NumericLiteral,
+                             UnnamedAttributeRef)
+from raco.fakedb import FakeDatabase
+from raco.myrial import interpreter, parser
+from raco.relation_key import RelationKey
+from raco.scheme import Scheme
+from raco.statistics import ColumnStats, Histogram
+
+
+def col(i):
+    return UnnamedAttributeRef(i)
+
+
+def lit(v):
+    return NumericLiteral(v)
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_from_sorted(self):
+        self.assertEquals(Histogram.from_sorted(range(100), 4).bounds,
+                          [0, 25, 50, 75, 99])
+        self.assertEquals(Histogram.from_sorted([3, 7], 4).bounds, [3, 7, 7])
+        self.assertIsNone(Histogram.from_sorted([]))
+
+    def test_fraction_below(self):
+        h = Histogram.from_sorted(range(100), 4)
+        self.assertEquals(h.fraction_below(-5), 0)
+        self.assertEquals(h.fraction_below(0), 0)
+        self.assertEquals(h.fraction_below(50), 0.5)
+        self.assertAlmostEquals(h.fraction_below(10), 0.1)
+        self.assertEquals(h.fraction_below(1000), 1)
+        # Skewed: half of the values are 0
+        h = Histogram.from_sorted(sorted([0] * 50 + range(50)), 4)
+        self.assertAlmostEquals(h.fraction_below(25), 0.75)
+        # Strings are not interpolated
+        h = Histogram(['a', 'm', 'z'])
+        self.assertEquals(h.fraction_below('f'), 0.25)
+
+
+class ColumnStatsTest(unittest.TestCase):
+
+    def test_from_values(self):
+        stats = ColumnStats.from_values([3, None, 1, 3, None, 2])
+        self.assertEquals((stats.ndv, stats.null_count, stats.min, stats.max,
+                           stats.count), (3, 2, 1, 3, 4))
+        self.assertEquals(stats.histogram.bounds, [1, 2, 3, 3, 3])
+        self.assertEquals(ColumnStats.from_dict(stats.to_dict()), stats)
+
+        empty = ColumnStats.from_values([None])
+        self.assertEquals((empty.ndv, empty.min, empty.histogram),
+                          (0, None, None))
+
+    def test_analyze(self):
+        a, b = statistics.analyze(iter([(1, 'x'), (2, 'x'), (3, None)]), 2)
+        self.assertEquals((a.ndv, a.min, a.max), (3, 1, 3))
+        self.assertEquals((b.ndv, b.null_count), (1, 1))
+
+
+class SelectivityTest(unittest.TestCase):
+
+    scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE),
+                     ('c', types.LONG_TYPE)])
+
+    def setUp(self):
+        # a is uniform over 0..99, b has 4 values, c has no statistics
+        self.stats = [ColumnStats.from_values(range(100)),
+                      ColumnStats(ndv=4, min=0, max=3), None]
+
+    def sel(self, condition):
+        return statistics.selectivity(condition, self.scheme, self.stats)
+
+    def test_equality(self):
+        self.assertAlmostEquals(self.sel(EQ(col(0), lit(5))), 0.01)
+        self.assertAlmostEquals(self.sel(EQ(lit(2), col(1))), 0.25)
+        self.assertEquals(self.sel(EQ(col(1), lit(10))), 0)
+        self.assertAlmostEquals(self.sel(EQ(NamedAttributeRef('b'), lit(1))),
+                                0.25)
+        self.assertAlmostEquals(self.sel(EQ(col(0), col(1))), 0.01)
+
+    def test_ranges(self):
+        self.assertAlmostEquals(self.sel(LT(col(0), lit(10))), 0.1, 2)
+        self.assertAlmostEquals(self.sel(GT(lit(10), col(0))), 0.1, 2)
+        self.assertAlmostEquals(self.sel(LTEQ(col(0), lit(10))), 0.11, 2)
+        self.assertAlmostEquals(self.sel(GT(col(0), lit(89))), 0.1, 2)
+        # Without a histogram, the values are uniform between min and max
+        self.assertAlmostEquals(self.sel(LT(col(1), lit(1.5))), 0.5)
+        self.assertEquals(self.sel(GT(col(0), lit(500))), 0)
+
+    def test_combinations(self):
+        a_lt_50 = LT(col(0), lit(50))
+        b_eq_1 = EQ(col(1), lit(1))
+        self.assertAlmostEquals(self.sel(AND(a_lt_50, b_eq_1)), 0.125, 2)
+        self.assertAlmostEquals(self.sel(OR(a_lt_50, b_eq_1)), 0.625, 2)
+        self.assertAlmostEquals(self.sel(NOT(b_eq_1)), 0.75)
+        # A part without an estimate counts as DEFAULT_SELECTIVITY
+        c_eq_1 = EQ(col(2), lit(1))
+        self.assertAlmostEquals(self.sel(AND(b_eq_1, c_eq_1)), 0.125)
+
+    def test_unknown(self):
+        self.assertIsNone(self.sel(EQ(col(2), lit(1))))
+        self.assertIsNone(self.sel(LT(col(0), col(1))))
+        self.assertIsNone(statistics.selectivity(
+            EQ(col(0), lit(1)), self.scheme, [None] * 3))
+
+    def test_nulls(self):
+        stats = [ColumnStats.from_values([1, 2, None, None])]
+        self.assertAlmostEquals(
+            statistics.selectivity(EQ(col(0), lit(1)), self.scheme, stats),
+            0.25)
+
+
+class AGMBoundTest(unittest.TestCase):
+
+    def test_bounds(self):
+        n = 100
+        # Triangle: R(a, b), S(b, c), T(c, a)
+        triangle = [(n, {0, 1}), (n, {1, 2}), (n, {2, 0})]
+        self.assertAlmostEquals(statistics.agm_bound(triangle), n ** 1.5)
+        # Path: R(a, b), S(b, c)
+        path = [(n, {0, 1}), (n, {1, 2})]
+        self.assertAlmostEquals(statistics.agm_bound(path), n ** 2)
+        # Clique of 4 variables
+        clique = [(n, {i, j}) for i in range(4) for j in range(i + 1, 4)]
+        self.assertAlmostEquals(statistics.agm_bound(clique), n ** 2)
+        # The bound is sqrt(|R||S||T|), less than |R||S|
+        self.assertAlmostEquals(
+            statistics.agm_bound([(10, {0, 1}), (n, {1, 2}), (n, {2, 0})]),
+            (10 * n * n) ** 0.5)
+        # Unless |R| is small enough
+        self.assertAlmostEquals(
+            statistics.agm_bound([(1, {0, 1}), (n, {1, 2}), (n, {2, 0})]),
+            n)
+        # Distinct values bound each variable
+        domains = [(5, {v}) for v in range(3)]
+        self.assertAlmostEquals(statistics.agm_bound(triangle + domains), 125)
+        self.assertEquals(statistics.agm_bound([]), 1)
+        self.assertEquals(statistics.agm_bound([(0, {0})]), 1)
+
+
+class EstimateTest(unittest.TestCase):
+    """Cardinality estimates of operators over scans with statistics."""
+
+    scheme = Scheme([('a', types.LONG_TYPE), ('b', types.LONG_TYPE)])
+    key = RelationKey.from_string('public:adhoc:R')
+
+    def setUp(self):
+        self.db = FakeDatabase()
+        # a is a key, b has 10 values
+        self.db.ingest(self.key,
+                       collections.Counter((i, i % 10) for i in range(1000)),
+                       self.scheme)
+        self.scan = Scan(self.key, self.scheme, 1000,
+                         column_stats=self.db.column_stats(self.key))
+
+    def test_select(self):
+        select = Select(EQ(col(1), lit(3)), self.scan)
+        self.assertEquals(select.num_tuples(), 100)
+        select = Select(LT(col(0), lit(100)), self.scan)
+        self.assertAlmostEquals(select.num_tuples(), 100, delta=5)
+        # Without statistics, half of the tuples
+        self.assertEquals(
+            Select(EQ(col(1), lit(3)),
+                   Scan(self.key, self.scheme, 1000)).num_tuples(), 500)
+
+    def test_join(self):
+        join = Join(EQ(col(1), col(2)), self.scan, self.scan)
+        self.assertEquals(join.num_tuples(), 1000)
+        join = Join(EQ(col(1), col(3)), self.scan, self.scan)
+        self.assertEquals(join.num_tuples(), 100000)
+        # Selections pass on the statistics of their columns
+        join = Join(EQ(col(1), col(3)),
+                    Select(EQ(col(1), lit(3)), self.scan), self.scan)
+        self.assertEquals(join.num_tuples(), 10000)
+
+    def test_aggregates(self):
+        self.assertEquals(GroupBy([col(1)], [COUNTALL()],
+                                  self.scan).num_tuples(), 10)
+        self.assertEquals(Distinct(self.scan).num_tuples(), 1000)
+        select = Select(EQ(col(1), lit(3)), self.scan)
+        self.assertEquals(GroupBy([col(0)], [COUNTALL()],
+                                  select).num_tuples(), 100)
+
+    def test_myrial(self):
+        """MyriaL scans read the statistics from the catalog."""
+        processor = interpreter.StatementProcessor(self.db)
+        processor.evaluate(parser.Parser().parse("""
+            x = scan(public:adhoc:R);
+            y = [from x where b = 3 emit *];
+            store(y, OUTPUT);"""))
+        plan = processor.get_logical_plan()
+        select, = [op for op in plan.walk() if isinstance(op, Select)]
+        self.assertEquals(select.num_tuples(), 100)
+
+    def test_cached(self):
+        """The statistics of a relation are computed once per version."""
+        stats = self.db.column_stats(self.key)
+        self.assertIs(self.db.column_stats(self.key), stats)
+        self.db.ingest(self.key, collections.Counter([(1, 1)]), self.scheme)
+        self.assertEquals(self.db.column_stats(self.key)[0].ndv, 1)
+
+    def test_read_with_plan(self):
+        """MyriaL reads the statistics of each relation once, when it builds
+        the plan."""
+        calls = []
+        column_stats = self.db.column_stats
+
+        def counting(rel_key):
+            calls.append(rel_key)
+            return column_stats(rel_key)
+        self.db.column_stats = counting
+
+        processor = interpreter.StatementProcessor(self.db)
+        processor.evaluate(parser.Parser().parse("""
+            x = scan(public:adhoc:R);
+            y = scan(public:adhoc:R);
+            z = [from x, y where x.a = y.b emit *];
+            store(z, OUTPUT);"""))
+        self.assertEquals(calls, [])
+        plan = processor.get_logical_plan()
+        self.assertEquals(calls, [self.key])
+        scans = [op for op in plan.walk() if isinstance(op, Scan)]
+        self.assertEquals(len(scans), 2)
+        self.assertTrue(all(scan.column_stats()[1].ndv == 10
+                            for scan in scans))
+
+    def test_nary_join(self):
+        """R(a, b) joins R(b, c) and R(c, a)"""
+        scan = Scan(self.key, self.scheme, 1000)
+        triangle = NaryJoin([scan, scan, scan],
+                            [[col(1), col(2)], [col(3), col(4)],
+                             [col(5), col(0)]])
+        self.assertEquals(triangle.num_tuples(), int(round(1000 ** 1.5)))
+        # b has 10 values, so c and a as well
+        triangle = NaryJoin([self.scan, self.scan, self.scan],
+                            [[col(1), col(2)], [col(3), col(4)],
+                             [col(5), col(0)]])
+        self.assertEquals(triangle.num_tuples(), 1000)
+        # Columns that are not joined are variables, too
+        path = NaryJoin([scan, scan], [[col(1), col(2)]],
+                        output_columns=[col(0), col(3)])
+        self.assertEquals(path.num_tuples(), 1000 ** 2)
+        self.assertEquals(len(path.column_stats()), 2)
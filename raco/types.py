@@ -45,7 +45,12 @@ def map_type(s):
     return TYPE_MAP[s]
 
 
+def parse_function(_type):
+    """Return the function that converts strings to values of _type."""
+    assert _type in reverse_python_type_map
+    return reverse_python_type_map[_type]
+
+
 def parse_string(s, _type):
     """Convert from a string to an internal python representation."""
-    assert _type in reverse_python_type_map
-    return reverse_python_type_map[_type](s)
+    return parse_function(_type)(s)
@@ -6,6 +6,8 @@ def graph_to_dot(graph, **kwargs):
     list() }. This function returns a string that will be input to dot."""
 
     title = kwargs.get('title', '')
+    # Extra lines for the labels of nodes, by id, e.g., statistics
+    annotations = kwargs.get('annotations', {})
 
     # Template, including setup and formatting:
     template = """digraph G {
@@ -32,7 +34,13 @@ def graph_to_dot(graph, **kwargs):
 }"""
 
     # Nodes:
-    nodes = ['"%s" [label="%s"] ;' % (id(n), n.shortStr().replace(r'"', r'\"'))
+    def label(n):
+        text = n.shortStr()
+        if id(n) in annotations:
+            text += r'\n' + annotations[id(n)]
+        return text.replace(r'"', r'\"')
+
+    nodes = ['"%s" [label="%s"] ;' % (id(n), label(n))
              for n in graph['nodes']]
     node_str = '\n      '.join(nodes)
 
@@ -36,5 +36,5 @@ setup(name='raco',
       packages=find_packages(exclude=['clang']),
       package_data={'': ['c_templates/*.template','grappa_templates/*.template']},
       install_requires=['networkx==1.11', 'ply', 'pyparsing', 'SQLAlchemy', 'jinja2', 'requests', 'requests_toolbelt' ],
-      scripts=['scripts/myrial']
+      scripts=['scripts/myrial', 'scripts/csv2columns']
       )